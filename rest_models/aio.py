@@ -0,0 +1,53 @@
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.db.models.query import MAX_GET_RESULTS
+from django.db.models.sql.constants import MULTI
+
+from rest_models.backend.base import DatabaseWrapper
+
+
+async def alist(queryset):
+    """
+    evaluate the queryset on the running event loop and return the list of its results.
+    for an api model, the queries are made by the AsyncApiConnexion of the database without taking a thread.
+    the querysets on other databases, or using prefetch_related, are evaluated in a thread as django does.
+
+    :param django.db.models.query.QuerySet queryset: the queryset to evaluate
+    :rtype: list
+    """
+    if queryset._result_cache is not None:
+        return list(queryset)
+    if not isinstance(connections[queryset.db], DatabaseWrapper) or queryset._prefetch_related_lookups:
+        return await sync_to_async(list)(queryset)
+    queryset = queryset._chain()
+    compiler = queryset.query.get_compiler(using=queryset.db)
+    # the fetched results are given back by SQLCompiler.execute_sql when the queryset is evaluated
+    queryset.query.api_results = await compiler.aexecute_sql(MULTI)
+    return list(queryset)
+
+
+async def aget(queryset, *args, **kwargs):
+    """
+    the async counterpart of QuerySet.get, which use alist to fetch the results.
+
+    :param django.db.models.query.QuerySet queryset: the queryset to filter
+    :return: the only object matching the given lookups
+    """
+    clone = queryset.filter(*args, **kwargs)
+    if queryset.query.can_filter() and not queryset.query.distinct_fields:
+        clone = clone.order_by()
+    clone.query.set_limits(high=MAX_GET_RESULTS)
+    results = await alist(clone)
+    num = len(results)
+    if num == 1:
+        return results[0]
+    if not num:
+        raise queryset.model.DoesNotExist(
+            "%s matching query does not exist." % queryset.model._meta.object_name
+        )
+    raise queryset.model.MultipleObjectsReturned(
+        "get() returned more than one %s -- it returned %s!" % (
+            queryset.model._meta.object_name,
+            num if num < MAX_GET_RESULTS else 'more than %s' % (MAX_GET_RESULTS - 1),
+        )
+    )
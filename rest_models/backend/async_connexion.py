@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import time
+
+import requests
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from requests.exceptions import ConnectionError, Timeout
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from rest_models.backend.connexion import ApiVerbShortcutMixin, LocalApiAdapter, close_response, log_query
+from rest_models.backend.deadline import check_deadline, shrink_timeout
+from rest_models.backend.timings import get_query_timings, measure_phase, measure_query
+from rest_models.backend.tracing import trace_request
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+LOCAL_URLS = (LocalApiAdapter.SPECIAL_URL, 'http://testserver')
+"""
+the urls served by the LocalApiAdapter, which can't be queried by httpx
+"""
+
+REQUEST_ARGS = ('headers', 'files', 'data', 'params', 'auth', 'cookies', 'json')
+"""
+the arguments of a query used to build the request
+"""
+
+
+def to_httpx_timeout(timeout):
+    """
+    convert a timeout as given to requests into a httpx one
+    :param float|tuple[float, float]|None timeout: the timeout, or the tuple (connect timeout, read timeout)
+    :rtype: httpx.Timeout
+    """
+    if isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+class AsyncApiConnexion(ApiVerbShortcutMixin):
+    """
+    the asyncio counterpart of ApiConnexion. the queries are made by a httpx.AsyncClient on the current event loop,
+    without taking a thread.
+
+    it wrap a ApiConnexion, and share with it the middlewares, the auth, the retry and the timeout. each verb
+    shortcut (get, post, etc) return a coroutine.
+    """
+
+    def __init__(self, connexion):
+        """
+        :param ApiConnexion connexion: the sync connexion which provide the middlewares and settings
+        """
+        if httpx is None:
+            raise ImproperlyConfigured("the async queries on rest_models databases require httpx to be installed")
+        self.connexion = connexion
+        self._client = None
+        self._client_loop = None
+
+    @property
+    def url(self):
+        return self.connexion.url
+
+    @property
+    def backend(self):
+        return self.connexion.backend
+
+    def get_client(self):
+        """
+        return the httpx client for the running event loop. a httpx client can't be shared between event loops
+        :rtype: httpx.AsyncClient
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(verify=self.connexion.session.verify)
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def send(self, params):
+        """
+        make the query to the api (on the endpoint chosen by the load balancer, if any) with httpx, and return the
+        response as a requests's Response
+        :param dict params: the params of the query, as given to requests.Session.request
+        :rtype: requests.Response
+        """
+        params = dict(self.connexion.json_codec.encode_request(params))
+        balancer = self.connexion.balancer
+        if balancer is None:
+            return await self.send_to(params)
+        endpoint = balancer.acquire()
+        params['url'] = endpoint.get_url(params['url'], self.url)
+        start = time.perf_counter()
+        try:
+            response = await self.send_to(params)
+        except (httpx.TransportError, Timeout, ConnectionError):
+            balancer.release(endpoint, False)
+            raise
+        except BaseException:
+            balancer.release(endpoint, None)
+            raise
+        balancer.release(endpoint, response.status_code < 500, time.perf_counter() - start)
+        return response
+
+    async def send_to(self, params):
+        """
+        make the query with httpx, or the local api
+        :param dict params: the encoded params of the query
+        :rtype: requests.Response
+        """
+        method = params.pop('method')
+        url = params.pop('url')
+        if url.startswith(LOCAL_URLS):
+            # the local api is served by django in the sync world
+            return await sync_to_async(self.connexion.session.request)(method=method, url=url, **params)
+        request = requests.Request(method=method.upper(), url=url, **{
+            name: params[name] for name in REQUEST_ARGS if name in params
+        })
+        prepared = self.connexion.session.prepare_request(request)
+        httpx_response = await self.get_client().request(
+            prepared.method,
+            prepared.url,
+            headers=dict(prepared.headers),
+            content=prepared.body,
+            timeout=to_httpx_timeout(params.get('timeout')),
+            follow_redirects=params.get('allow_redirects', False),
+        )
+        timings = get_query_timings()
+        if timings is not None:
+            # httpx measure the time until the body is read: the connection and download are not distinguished
+            timings.add('ttfb', httpx_response.elapsed.total_seconds())
+        return self.to_response(httpx_response, prepared)
+
+    @staticmethod
+    def to_response(httpx_response, prepared_request):
+        """
+        transform a httpx response into a requests's Response, as used by the compilers
+        :param httpx.Response httpx_response: the response from httpx
+        :param requests.PreparedRequest prepared_request: the request sent
+        :rtype: requests.Response
+        """
+        response = Response()
+        response.status_code = httpx_response.status_code
+        response.headers = CaseInsensitiveDict(httpx_response.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = httpx_response.reason_phrase
+        response._content = httpx_response.content
+        response.url = str(httpx_response.url)
+        response.elapsed = httpx_response.elapsed
+        response.request = prepared_request
+        return response
+
+    async def _make_request(self, params):
+        """
+        make the request, passing through all middlewares of the connexion on send and receive
+        :param params:
+        :return:
+        """
+        connexion = self.connexion
+        requestid = connexion.inc_request_id()
+        pipeline = connexion.pipeline
+        with measure_query(params.get('method'), params.get('url')) as timings:
+            with measure_phase('middlewares'):
+                response, last = pipeline.process_request(params, requestid, connexion)
+            if response is None:
+                # if the middleware did not override the real response, we make the query
+                try:
+                    response = await self.send(params)
+                except Exception as e:
+                    pipeline.process_exception(params, e, requestid, last)
+                    raise
+            # iterate over all previously executed middlewares
+            with measure_phase('middlewares'):
+                response = pipeline.process_response(params, response, requestid, last)
+        response.timings = timings
+        return response
+
+    async def request(self, method, url, **kwargs):
+        """
+        the async counterpart of ApiConnexion.request
+
+        :param unicode method: the method to use
+        :param str url: the path relative to the current connexion
+        :rtype: requests.Response
+        """
+        connexion = self.connexion
+        kwargs.setdefault("allow_redirects", False)
+        kwargs.setdefault("timeout", connexion.get_timeout())
+        kwargs.setdefault('stream', False)
+        real_url = connexion.get_final_url(url)
+        timeout = kwargs['timeout']
+
+        error = 0
+        last_exception = None
+        start = time.time()
+        deadline = connexion.get_throttle_deadline()
+        response = None
+        try:
+            with trace_request(connexion.tracer, method, real_url, kwargs.get('params')) as span:
+                while error <= connexion.retry:
+                    connexion.check_circuit_breaker()
+                    if connexion.rate_limiter is not None:
+                        wait = connexion.rate_limiter.reserve()
+                        if wait > 0:
+                            check_deadline(wait)
+                            await asyncio.sleep(wait)
+                    kwargs['timeout'] = shrink_timeout(timeout)
+                    try:
+                        response = await self._make_request(dict(method=method, url=real_url, **kwargs))
+                    except (httpx.TransportError, Timeout, ConnectionError) as e:
+                        error += 1
+                        last_exception = e
+                        connexion.record_outcome(False)
+                        if error <= connexion.retry:
+                            delay = connexion.get_retry_delay(error)
+                            check_deadline(delay)
+                            await asyncio.sleep(delay)
+                    except Exception:
+                        connexion.record_outcome(None)
+                        raise
+                    else:
+                        connexion.record_outcome(True)
+                        delay = connexion.get_throttle_delay(response, deadline)
+                        if delay is not None:
+                            connexion.rate_limiter.pause(delay)
+                            close_response(response)
+                            continue
+                        if span is not None:
+                            span.set_attribute('status', response.status_code)
+                            span.set_attribute('retries', error)
+                        connexion.raise_on_forbidden(response)
+                        return response
+                if span is not None:
+                    span.set_attribute('retries', error - 1)
+                raise connexion.connection_error(last_exception, error)
+        finally:
+            # the sync queries are logged by the debug cursor, which can't be used here
+            if self.backend is not None and self.backend.queries_logged:
+                log_query(self.backend, method, url, kwargs, time.time() - start, response)
@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+from urllib.parse import urlparse, urlunparse
+
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('least_outstanding', 'latency')
+"""
+the ways to choose the endpoint of a query:
+
+- least_outstanding: the endpoint with the fewest queries in flight
+- latency: the endpoint with the lowest average latency, weighted by its queries in flight
+"""
+
+
+class Endpoint(object):
+    """
+    a replica of the api, with its load and health
+    """
+
+    def __init__(self, url):
+        """
+        :param str url: the base url of the replica
+        """
+        if not url.endswith('/'):
+            url = url + '/'
+        self.url = url
+        self.parsed = urlparse(url)
+        # the number of queries in flight
+        self.outstanding = 0
+        # the moving average of the latency, in seconds. None until a query has succeeded
+        self.latency = None
+        self.consecutive_failures = 0
+        # the time (monotonic) until which the endpoint is not used
+        self.ejected_until = 0.
+        self.counters = {
+            'requests': 0,
+            'failures': 0,
+            'ejected': 0,
+        }
+
+    def get_url(self, url, base_url):
+        """
+        return the url of the query on this endpoint
+        :param str url: the url of the query on the api
+        :param str base_url: the base url of the api, replaced by the one of the endpoint
+        :rtype: str
+        """
+        if url.startswith(base_url):
+            return self.url + url[len(base_url):]
+        parsed = urlparse(url)
+        base = urlparse(base_url)
+        if parsed[:2] == base[:2]:
+            # an absolute path on the api host
+            return urlunparse(self.parsed[:2] + parsed[2:])
+        return url
+
+    def as_dict(self, now):
+        stats = dict(self.counters)
+        stats['outstanding'] = self.outstanding
+        stats['latency'] = self.latency
+        stats['healthy'] = self.ejected_until <= now
+        return stats
+
+
+class LoadBalancer(object):
+    """
+    spread the queries to an api over its replicas, shared by all the connexions to the same api.
+
+    the endpoints which fail ``eject_failures`` times in a row (unreachable, or a 5xx status) are not used for
+    ``eject_time`` seconds. then, one query probe the endpoint: it is used again if the query succeed, or ejected
+    once more. if all the endpoints are ejected, the one which will come back first is used.
+    """
+
+    def __init__(self, name, urls, strategy='least_outstanding', eject_failures=3, eject_time=30, decay=0.3):
+        """
+        :param str name: the name of the balancer (the alias of the database)
+        :param list[str] urls: the base urls of the replicas of the api
+        :param str strategy: least_outstanding or latency
+        :param int eject_failures: the number of consecutive failures which eject an endpoint. 0 never eject them
+        :param float eject_time: the number of seconds an endpoint stay ejected
+        :param float decay: the weight of the last query in the average latency
+        """
+        if not urls:
+            raise ImproperlyConfigured("the database %s has no ENDPOINTS" % name)
+        self.name = name
+        self._lock = threading.Lock()
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.configure(strategy, eject_failures, eject_time)
+        self.decay = decay
+
+    def configure(self, strategy='least_outstanding', eject_failures=3, eject_time=30):
+        if strategy not in STRATEGIES:
+            raise ImproperlyConfigured("unknown BALANCER_STRATEGY %s for %s. expected one of %s" % (
+                strategy, self.name, ', '.join(STRATEGIES)))
+        self.strategy = strategy
+        self.eject_failures = eject_failures
+        self.eject_time = eject_time
+
+    def get_load(self, endpoint):
+        """
+        return the load of an endpoint: the lowest is chosen
+        :param Endpoint endpoint: the endpoint
+        :rtype: float
+        """
+        if self.strategy == 'latency':
+            # the endpoints without latency yet are tried first
+            return (endpoint.latency or 0.) * (endpoint.outstanding + 1)
+        return endpoint.outstanding
+
+    def acquire(self):
+        """
+        choose the endpoint of a query, and count the query in its load
+        :rtype: Endpoint
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.ejected_until <= now]
+            if not candidates:
+                # no healthy endpoint: use the one which will come back first
+                candidates = [min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)]
+            # at the same load, the endpoint with the fewest queries is used, so they are all used in turn
+            endpoint = min(candidates, key=lambda endpoint: (self.get_load(endpoint), endpoint.counters['requests']))
+            if endpoint.consecutive_failures and endpoint.consecutive_failures >= self.eject_failures > 0:
+                # the endpoint is probed: the other queries don't use it until the probe is finished
+                endpoint.ejected_until = now + self.eject_time
+            endpoint.outstanding += 1
+            endpoint.counters['requests'] += 1
+            return endpoint
+
+    def release(self, endpoint, success, latency=None):
+        """
+        record the end of a query on an endpoint
+        :param Endpoint endpoint: the endpoint used by the query
+        :param bool|None success: True if the endpoint has answered, False if it failed, None if the query was
+            interrupted without telling anything about the endpoint
+        :param float latency: the time taken by the query, in seconds
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if success:
+                if endpoint.consecutive_failures >= self.eject_failures > 0:
+                    logger.info("endpoint %s of %s is back", endpoint.url, self.name)
+                endpoint.consecutive_failures = 0
+                endpoint.ejected_until = 0.
+                if latency is not None:
+                    if endpoint.latency is None:
+                        endpoint.latency = latency
+                    else:
+                        endpoint.latency += self.decay * (latency - endpoint.latency)
+            elif success is False:
+                endpoint.consecutive_failures += 1
+                endpoint.counters['failures'] += 1
+                if endpoint.consecutive_failures >= self.eject_failures > 0:
+                    endpoint.ejected_until = time.monotonic() + self.eject_time
+                    endpoint.counters['ejected'] += 1
+                    logger.warning("endpoint %s of %s ejected for %ss after %d failures", endpoint.url, self.name,
+                                   self.eject_time, endpoint.consecutive_failures)
+
+    def stats(self):
+        """
+        return the load and health of each endpoint, by url
+        :rtype: dict[str, dict]
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {endpoint.url: endpoint.as_dict(now) for endpoint in self.endpoints}
+
+
+_balancers = {}
+_balancers_lock = threading.Lock()
+
+
+def get_load_balancer(name, urls, strategy='least_outstanding', eject_failures=3, eject_time=30):
+    """
+    return the load balancer for the given name, shared by all the threads, creating it if needed.
+    the balancer is created again if its endpoints have changed.
+    :param str name: the name of the balancer (the alias of the database)
+    :param list[str] urls: the base urls of the replicas of the api
+    :param str strategy: least_outstanding or latency
+    :param int eject_failures: the number of consecutive failures which eject an endpoint
+    :param float eject_time: the number of seconds an endpoint stay ejected
+    :rtype: LoadBalancer
+    """
+    with _balancers_lock:
+        balancer = _balancers.get(name)
+        urls = [Endpoint(url).url for url in urls]
+        if balancer is None or [endpoint.url for endpoint in balancer.endpoints] != urls:
+            balancer = _balancers[name] = LoadBalancer(name, urls, strategy, eject_failures, eject_time)
+        else:
+            with balancer._lock:
+                balancer.configure(strategy, eject_failures, eject_time)
+        return balancer
+
+
+def load_balancers_stats():
+    """
+    return the stats of the endpoints of all the load balancers, by name
+    :rtype: dict[str, dict[str, dict]]
+    """
+    with _balancers_lock:
+        balancers = list(_balancers.values())
+    return {balancer.name: balancer.stats() for balancer in balancers}
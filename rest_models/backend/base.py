@@ -1,11 +1,25 @@
 import logging
+import socket
+import time
+from collections import deque
 from importlib import import_module
 
 from django.db.backends.base.base import BaseDatabaseWrapper
 from django.db.backends.base.validation import BaseDatabaseValidation
+from django.utils.functional import cached_property
+from urllib3.connection import HTTPConnection
 
+from rest_models.backend.async_connexion import AsyncApiConnexion
+from rest_models.backend.balancer import get_load_balancer
+from rest_models.backend.circuit_breaker import get_circuit_breaker
 from rest_models.backend.connexion import ApiConnexion, DebugApiConnectionWrapper
 from rest_models.backend.exceptions import FakeDatabaseDbAPI2
+from rest_models.backend.hedging import get_hedger
+from rest_models.backend.json_codecs import get_json_codec
+from rest_models.backend.query_plans import get_query_plan_cache
+from rest_models.backend.rate_limit import get_rate_limiter
+from rest_models.backend.single_flight import get_single_flight
+from rest_models.backend.tracing import get_tracer
 
 from .client import DatabaseClient
 from .creation import DatabaseCreation
@@ -32,6 +46,27 @@ def import_class(path):
     return obj
 
 
+def get_socket_options(options):
+    """
+    build the socket options for the connections to the api from the OPTIONS of the database.
+    return None if no option is given, to keep the default ones.
+    :param dict options: the OPTIONS of the database
+    :rtype: list[tuple]|None
+    """
+    socket_options = list(options.get('SOCKET_OPTIONS', ()))
+    if options.get('KEEP_ALIVE'):
+        socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        for setting, option_name in (('KEEP_ALIVE_IDLE', 'TCP_KEEPIDLE'),
+                                     ('KEEP_ALIVE_INTERVAL', 'TCP_KEEPINTVL'),
+                                     ('KEEP_ALIVE_COUNT', 'TCP_KEEPCNT')):
+            # not all platforms provides these options
+            if setting in options and hasattr(socket, option_name):
+                socket_options.append((socket.IPPROTO_TCP, getattr(socket, option_name), options[setting]))
+    if not socket_options:
+        return None
+    return HTTPConnection.default_socket_options + socket_options
+
+
 class DatabaseWrapper(BaseDatabaseWrapper):
 
     Database = FakeDatabaseDbAPI2
@@ -48,7 +83,12 @@ class DatabaseWrapper(BaseDatabaseWrapper):
 
     def __init__(self, *args, **kwargs):
         self.connection = None  # type: ApiConnexion
+        self.async_connection = None  # type: AsyncApiConnexion
         super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        options = self.settings_dict.get('OPTIONS', {})
+        if 'QUERIES_LOG_LIMIT' in options:
+            self.queries_log = deque(maxlen=options['QUERIES_LOG_LIMIT'])
+        self.queries_log_sampling = float(options.get('QUERIES_LOG_SAMPLING', 1))
 
     def get_connection_params(self):
         authpath = self.settings_dict.get('AUTH', None)
@@ -61,13 +101,130 @@ class DatabaseWrapper(BaseDatabaseWrapper):
             'timeout': self.timeout,
             'backend': self,
             'middlewares': [import_class(path)() for path in self.settings_dict.get('MIDDLEWARES', ())],
-            'ssl_verify': options.get('SSL_VERIFY', True)
+            'ssl_verify': options.get('SSL_VERIFY', True),
+            'pool_options': self.get_pool_options(options),
+            'retry_backoff': options.get('RETRY_BACKOFF', 0),
+            'retry_backoff_max': options.get('RETRY_BACKOFF_MAX', 30),
+            'retry_jitter': options.get('RETRY_JITTER', True),
+            'circuit_breaker': self.get_circuit_breaker(options),
+            'json_codec': self.json_codec,
+            'single_flight': get_single_flight(self.alias) if options.get('SINGLE_FLIGHT') else None,
+            'rate_limiter': self.get_rate_limiter(options),
+            'throttle_deadline': options.get('RATE_LIMIT_DEADLINE', 0),
+            'balancer': self.get_load_balancer(options),
         }
         return params
 
+    def get_circuit_breaker(self, options):
+        """
+        return the circuit breaker of the database, shared by all threads, or None if it is disabled
+        :param dict options: the OPTIONS of the database
+        :rtype: rest_models.backend.circuit_breaker.CircuitBreaker|None
+        """
+        threshold = options.get('CIRCUIT_BREAKER_THRESHOLD', 0)
+        if not threshold:
+            return None
+        return get_circuit_breaker(self.alias, threshold, options.get('CIRCUIT_BREAKER_TIMEOUT', 30))
+
+    def get_rate_limiter(self, options):
+        """
+        return the rate limiter of the database, shared by all threads, or None if it is disabled
+        :param dict options: the OPTIONS of the database
+        :rtype: rest_models.backend.rate_limit.RateLimiter|None
+        """
+        rate = options.get('RATE_LIMIT')
+        if not rate and not options.get('RATE_LIMIT_DEADLINE'):
+            return None
+        return get_rate_limiter(self.alias, rate, options.get('RATE_LIMIT_BURST'))
+
+    def get_load_balancer(self, options):
+        """
+        return the load balancer of the database, shared by all threads, or None if there is no ENDPOINTS
+        :param dict options: the OPTIONS of the database
+        :rtype: rest_models.backend.balancer.LoadBalancer|None
+        """
+        endpoints = options.get('ENDPOINTS')
+        if not endpoints:
+            return None
+        return get_load_balancer(self.alias, endpoints, options.get('BALANCER_STRATEGY', 'least_outstanding'),
+                                 options.get('BALANCER_EJECT_FAILURES', 3), options.get('BALANCER_EJECT_TIME', 30))
+
+    def get_pool_options(self, options):
+        """
+        build the kwargs of the ApiHTTPAdapter from the OPTIONS of the database
+        :param dict options: the OPTIONS of the database
+        :rtype: dict
+        """
+        pool_options = {
+            kwarg: options[setting]
+            for setting, kwarg in (('POOL_CONNECTIONS', 'pool_connections'),
+                                   ('POOL_MAXSIZE', 'pool_maxsize'),
+                                   ('POOL_BLOCK', 'pool_block'),
+                                   ('MAX_RETRIES', 'max_retries'))
+            if setting in options
+        }
+        pool_options['socket_options'] = get_socket_options(options)
+        return pool_options
+
     def get_new_connection(self, conn_params):
         return ApiConnexion(**conn_params)
 
+    def get_async_connection(self):
+        """
+        return the connection to use for the async queries. it share the middlewares of the current connection
+        if there is one. this don't open the sync connection, which is not allowed in an async context.
+        :rtype: AsyncApiConnexion
+        """
+        connexion = self.connection
+        if connexion is not None and self.async_connection is not None:
+            if self.async_connection.connexion is not connexion:
+                self.async_connection = None
+        if self.async_connection is None:
+            if connexion is None:
+                connexion = self.get_new_connection(self.get_connection_params())
+            self.async_connection = AsyncApiConnexion(connexion)
+        return self.async_connection
+
+    @cached_property
+    def json_codec(self):
+        """
+        the codec used to encode the bodies sent to the api and decode its responses
+        :rtype: rest_models.backend.json_codecs.BaseJsonCodec
+        """
+        return get_json_codec(self.settings_dict.get('OPTIONS', {}).get('JSON_CODEC'))
+
+    @cached_property
+    def tracer(self):
+        """
+        the tracer of the queries made on the database, or None if the TRACING_EXPORTER is not set
+        :rtype: rest_models.backend.tracing.Tracer|None
+        """
+        return get_tracer(self.settings_dict.get('OPTIONS', {}).get('TRACING_EXPORTER'))
+
+    @cached_property
+    def hedger(self):
+        """
+        the hedger of the GET queries made by the ORM, shared by all threads, or None if HEDGE_PERCENTILE is not set
+        :rtype: rest_models.backend.hedging.Hedger|None
+        """
+        options = self.settings_dict.get('OPTIONS', {})
+        percentile = options.get('HEDGE_PERCENTILE')
+        if not percentile:
+            return None
+        return get_hedger(self.alias, percentile, options.get('HEDGE_MIN_DELAY', 0.01),
+                          options.get('HEDGE_BUDGET', 0.1))
+
+    @cached_property
+    def query_plan_cache(self):
+        """
+        the plans of the queries compiled for the database, shared by all threads, or None if QUERY_PLAN_CACHE is 0
+        :rtype: rest_models.backend.query_plans.QueryPlanCache|None
+        """
+        size = self.settings_dict.get('OPTIONS', {}).get('QUERY_PLAN_CACHE', 256)
+        if not size:
+            return None
+        return get_query_plan_cache(self.alias, size)
+
     @property
     def timeout(self):
         return self.settings_dict['OPTIONS'].get('TIMEOUT', 10)
@@ -93,6 +250,12 @@ class DatabaseWrapper(BaseDatabaseWrapper):
 
     def is_usable(self):
         c = self.connection
+        ttl = self.settings_dict.get('OPTIONS', {}).get('HEALTH_CHECK_TTL', 10)
+        if ttl and c.health is not None:
+            usable, checked_at = c.health
+            if time.monotonic() - checked_at < ttl:
+                # a query has reached the api (or failed to) recently: no need to check it again
+                return usable
         try:
             c.head('', timeout=self.timeout)
             return True
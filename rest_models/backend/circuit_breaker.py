@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    a circuit breaker shared by all the connexions to the same api.
+
+    while closed, the queries are made as usual. after ``failure_threshold`` consecutive failures, it open and
+    all queries fail fast for ``reset_timeout`` seconds. then it become half-open: one query is allowed to probe the
+    api. if it succeed, the breaker is closed again, otherwise it is opened for another ``reset_timeout``.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        """
+        :param str name: the name of the breaker (the alias of the database)
+        :param int failure_threshold: the number of consecutive failures which open the breaker
+        :param float reset_timeout: the number of seconds the breaker stay open before allowing a probe
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = None
+        self.consecutive_failures = 0
+        self._probing = False
+        self.counters = {
+            'successes': 0,
+            'failures': 0,
+            'rejected': 0,
+            'opened': 0,
+        }
+
+    def allow_request(self):
+        """
+        tell if a query can be made to the api. in half-open state, only one query is allowed at a time.
+        :rtype: bool
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.counters['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.counters['successes'] += 1
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info("circuit breaker %s closed", self.name)
+            self.state = CLOSED
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.counters['failures'] += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.counters['opened'] += 1
+                    logger.warning("circuit breaker %s opened after %d failures", self.name,
+                                   self.consecutive_failures)
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """
+        forget a query allowed by the breaker which has failed for another reason than the api being down
+        """
+        with self._lock:
+            self._probing = False
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.opened_at = None
+            self.consecutive_failures = 0
+            self._probing = False
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def stats(self):
+        """
+        return the state of the breaker and its counters
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats['state'] = self.state
+            stats['consecutive_failures'] = self.consecutive_failures
+            return stats
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name, failure_threshold=5, reset_timeout=30):
+    """
+    return the circuit breaker for the given name, creating it if needed. the breakers are shared by all the
+    threads, since each of them has its own connexion to the database.
+    :param str name: the name of the breaker (the alias of the database)
+    :param int failure_threshold: the number of consecutive failures which open the breaker
+    :param float reset_timeout: the number of seconds the breaker stay open before allowing a probe
+    :rtype: CircuitBreaker
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, failure_threshold, reset_timeout)
+        else:
+            breaker.failure_threshold = failure_threshold
+            breaker.reset_timeout = reset_timeout
+        return breaker
+
+
+def circuit_breakers_stats():
+    """
+    return the stats of all the circuit breakers, by name
+    :rtype: dict[str, dict]
+    """
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
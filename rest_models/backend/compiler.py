@@ -1,12 +1,19 @@
+import asyncio
 import collections
+import contextvars
 import itertools
 import logging
+import queue
 import re
+import threading
+import time
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from json import JSONDecodeError
 
 import django
-from django.core.exceptions import EmptyResultSet, ImproperlyConfigured
+from asgiref.sync import sync_to_async
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, ImproperlyConfigured, SynchronousOnlyOperation
 from django.db.models import FileField, Transform
 from django.db.models.aggregates import Count
 from django.db.models.base import ModelBase
@@ -21,10 +28,14 @@ from django.db.utils import NotSupportedError, OperationalError, ProgrammingErro
 
 from rest_models.backend.connexion import build_url
 from rest_models.backend.exceptions import FakeDatabaseDbAPI2
+from rest_models.backend.query_plans import QueryPlan, bind_filters
+from rest_models.backend.streaming import StreamedPage
+from rest_models.backend.timings import get_collector
+from rest_models.backend.tracing import add_page, traced_execute
 from rest_models.backend.utils import message_from_response
 from rest_models.router import RestModelRouter
 from rest_models.storage import RestFileField
-from rest_models.utils import pgcd
+from rest_models.utils import plan_slice
 
 logger = logging.getLogger(__name__)
 
@@ -63,6 +74,44 @@ def extract_exact_pk_value(where):
     return None
 
 
+def expression_shape(expression):
+    """
+    return the structure of an expression of a query, without its values
+    :param expression: the column, or the transform of a column
+    :rtype: tuple
+    :raise TypeError: if the expression is not supported by the query plans
+    """
+    if isinstance(expression, Col):
+        return 'col', expression.alias, expression.target
+    if isinstance(expression, ColPairs):
+        return 'cols', expression.alias, tuple(expression.targets)
+    if isinstance(expression, RawSQL):
+        return 'raw', expression.sql
+    if isinstance(expression, Transform):
+        return type(expression), getattr(expression, 'key_name', None), expression_shape(expression.lhs)
+    if isinstance(expression, Value):
+        return 'value', expression.value
+    raise TypeError("no shape for %s" % expression.__class__.__name__)
+
+
+def where_shape(node):
+    """
+    return the structure of a where clause: the same filters with other values give the same shape
+    :param WhereNode node: the where clause
+    :rtype: tuple
+    :raise TypeError: if the where clause is not supported by the query plans
+    """
+    if isinstance(node, WhereNode):
+        return node.connector, node.negated, tuple(where_shape(child) for child in node.children)
+    if isinstance(node, Lookup):
+        if not node.rhs_is_direct_value():
+            raise TypeError("no shape for the nested queries")
+        return type(node), expression_shape(node.lhs)
+    if isinstance(node, NothingNode):
+        return 'nothing',
+    raise TypeError("no shape for %s" % node.__class__.__name__)
+
+
 def get_resource_path(model, pk=None):
     """
     return the resource path relative to the base of the api.
@@ -77,6 +126,30 @@ def get_resource_path(model, pk=None):
     return ret
 
 
+PAGINATIONS = ('page', 'cursor', 'keyset')
+"""
+the ways to fetch the pages following the first one, given by APIMeta.pagination:
+
+- page: by their number (page=N), which can be fetched concurrently
+- cursor: with the cursor given in the meta of the previous page (APIMeta.cursor_meta, default to next),
+  sent in the GET parameter APIMeta.cursor_param (default to cursor)
+- keyset: with a filter on the pk of the last row of the previous page (filter{pk.gt}), the rows being sorted by pk
+"""
+
+
+def get_pagination(model):
+    """
+    return the pagination of the model, from its APIMeta.pagination
+    :param model: the model
+    :rtype: str
+    """
+    pagination = getattr(model.APIMeta, 'pagination', 'page')
+    if pagination not in PAGINATIONS:
+        raise ImproperlyConfigured("%s.APIMeta.pagination must be one of %s, not %r" % (
+            model.__name__, ', '.join(PAGINATIONS), pagination))
+    return pagination
+
+
 def get_resource_name(model, many=False):
     """
     return the name of the resource on the server
@@ -133,12 +206,11 @@ class ApiResponseReader(object):
     def __init__(self, json, next_=None, many=True):
         """
         create the read of the response
-        :param json:  the data loaded from the response
+        :param dict|StreamedPage json:  the data loaded from the response, or the page parsed while it is read
         :param next_: the special function to call on iteration for getting the next result
         :param many: if True, the main rows is on a plurial verbose name. (pizzas instead of pizza)
         """
-        self.json = json
-        self.cache = {}
+        self.set_page(json)
         self.many = many
         if next_ is None:
             def nonext():
@@ -158,17 +230,20 @@ class ApiResponseReader(object):
         """
         resource_name = get_resource_name(model, many=self.many)
 
+        iter_next = iter(self.next())
+        rows = None
         try:
-            iter_next = iter(self.next())
             if self.many:
                 # many result in the json.
                 # list of results
                 while True:
-                    for data in self.json[resource_name]:
+                    rows = self.page.rows() if isinstance(self.page, StreamedPage) else self.json[resource_name]
+                    for data in rows:
                         yield data
-
-                    self.json = next(iter_next)
-                    self.cache = {}
+                    # the page is released before the next one is fetched
+                    rows = data = None
+                    self.set_page(None)
+                    self.set_page(next(iter_next))
             else:
                 # on result in the response
                 yield self.json[resource_name]
@@ -180,6 +255,21 @@ class ApiResponseReader(object):
                                        'please check if %s.APIMeta.resource_name_plural is ok. '
                                        'had %s in result' %
                                        (resource_name, model.__name__, list(self.json.keys())))
+        finally:
+            # stop the pending fetch of the next pages if the iteration is interrupted
+            for iterator in (rows, iter_next):
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+
+    def set_page(self, page):
+        """
+        change the page of results read
+        :param dict|StreamedPage page: the data of the page, or the page parsed while it is read
+        """
+        self.page = page
+        self.json = page.data if isinstance(page, StreamedPage) else page
+        self.cache = {}
 
     def __getitem__(self, model):
         """
@@ -207,6 +297,139 @@ class ApiResponseReader(object):
         return res or self.cache[model]
 
 
+def fetch_pages(fetch_page, pages, connection, max_workers=1):
+    """
+    fetch the given pages and yield the data of each one, in the order of the pages.
+    if max_workers is greater than 1, the pages are fetched concurrently by a pool of threads. to keep the memory
+    bounded, no more than max_workers pages are fetched or waiting to be consumed at the same time.
+    :param fetch_page: the callable that take a page number and return the data for this page
+    :param Iterable[int] pages: the pages numbers to fetch, in order
+    :param rest_models.backend.base.DatabaseWrapper connection: the connection used by the workers
+    :param int max_workers: the maximum number of pages fetched at the same time
+    :return: the data for each page
+    :rtype: Iterable[dict]
+    """
+    if max_workers <= 1:
+        for page in pages:
+            yield fetch_page(page)
+        return
+    pages = iter(pages)
+    pending = collections.deque()
+    # the workers will use the connection of the current thread
+    connection.inc_thread_sharing()
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rest_models')
+    try:
+        for page in itertools.islice(pages, max_workers):
+            # the workers run in the context of the caller (timings, etc)
+            pending.append(executor.submit(contextvars.copy_context().run, fetch_page, page))
+        while pending:
+            data = pending.popleft().result()
+            for page in itertools.islice(pages, 1):
+                pending.append(executor.submit(contextvars.copy_context().run, fetch_page, page))
+            yield data
+            data = None
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        connection.dec_thread_sharing()
+
+
+def close_after(rows, source):
+    """
+    yield the given rows, then close their source: the pages it would fetch after the last row are not needed
+    :param Iterable rows: the rows to yield, taken from source
+    :param source: the iterator of the rows, closed once rows are consumed
+    :return: the rows
+    """
+    try:
+        yield from rows
+    finally:
+        close = getattr(source, 'close', None)
+        if close is not None:
+            close()
+
+
+class PagePrefetcher(object):
+    """
+    an iterator that read ahead the pages given by an other iterator in a background thread.
+    the read ahead start as soon as the prefetcher is created, and at most `depth` pages are fetched and waiting
+    to be consumed at the same time.
+    """
+
+    def __init__(self, pages, depth, connection):
+        """
+        :param Iterable[dict] pages: the iterable that fetch the pages
+        :param int depth: the max number of pages fetched ahead of the consumer
+        :param rest_models.backend.base.DatabaseWrapper connection: the connection used by the background thread
+        """
+        self.results = queue.Queue()
+        self.slots = threading.BoundedSemaphore(depth)
+        self.stopped = threading.Event()
+        self.finished = False
+        self.connection = connection
+        # the background thread will use the connection of the current thread
+        connection.inc_thread_sharing()
+        self.thread = threading.Thread(target=contextvars.copy_context().run, args=(self.run, iter(pages)),
+                                       name='rest_models-prefetch', daemon=True)
+        self.thread.start()
+
+    def run(self, pages):
+        """
+        the background thread: fetch the pages while there is a free slot
+        """
+        try:
+            while self.acquire_slot():
+                try:
+                    page = next(pages)
+                except StopIteration:
+                    self.results.put((False, None))
+                    return
+                self.results.put((True, page))
+        except BaseException as e:
+            self.results.put((False, e))
+        finally:
+            close = getattr(pages, 'close', None)
+            if close is not None:
+                close()
+
+    def acquire_slot(self):
+        """
+        wait for a free slot, or for the consumer to stop the prefetching.
+        :return: False if the prefetching was stopped
+        """
+        while not self.stopped.is_set():
+            if self.slots.acquire(timeout=0.1):
+                return True
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration()
+        has_page, result = self.results.get()
+        if has_page:
+            self.slots.release()
+            return result
+        self.close()
+        if result is not None:
+            raise result
+        raise StopIteration()
+
+    def close(self):
+        """
+        stop the background thread and release the connection.
+        """
+        if self.finished:
+            return
+        self.finished = True
+        self.stopped.set()
+        self.thread.join()
+        self.connection.dec_thread_sharing()
+
+
 def ancestors(alias):
     """
     generator the return the list of ancestors of an alias
@@ -518,6 +741,75 @@ def join_aliases(aliases, responsereader, existing_aliases):
                 yield subresult
 
 
+def get_column_converter(alias, db_column, connection=None):
+    """
+    return the function that convert the values of a column given by the api into python values
+    :param Alias alias: the alias of the model of the column
+    :param str db_column: the column, or the name of the reverse related field
+    :param connection: the connection which can release a cursor for further query (like fetching files on the api)
+    :return: the converter, or None if the values are the list of the related pks, each giving a result
+    """
+    # get the field of this model by either the column or the field name if this
+    # is a reverse related field
+    for field in alias.model._meta.concrete_fields:
+        if field.column == db_column:
+            break
+    else:
+        try:
+            field = alias.model._meta.get_field(db_column)
+        except FieldDoesNotExist as e:
+            # the column is not a field: the error is raised only if the api give a value for it
+            def missing_field(raw_val, error=e):
+                raise error
+            return missing_field
+
+    if isinstance(field, FileField) and hasattr(field.storage, 'prepare_result_from_api'):
+        storage = field.storage
+        return lambda raw_val: storage.prepare_result_from_api(raw_val, connection.cursor())
+    elif hasattr(field, "to_python"):
+        return field.to_python
+    return None
+
+
+def get_column_converters(resolved, connection=None):
+    """
+    build the table of the columns to read in the rows, with the converter of their values
+    :param list[tuple[Alias, str]] resolved: the alias and the column of each col in the select
+    :param connection: the connection which can release a cursor for further query (like fetching files on the api)
+    :rtype: list[tuple[Alias, str, callable|None]]
+    """
+    return [(alias, db_column, get_column_converter(alias, db_column, connection)) for alias, db_column in resolved]
+
+
+def convert_row(row, columns):
+    """
+    build the results of a row with the table of the columns. the columns without converter give the list of the
+    related pks: one result is made for each of them.
+    :param dict[Alias, dict] row: the data of each alias
+    :param list[tuple[Alias, str, callable|None]] columns: the table given by get_column_converters
+    :return: the results of the row
+    :rtype: list[list]
+    """
+    results = [[]]
+    for alias, db_column, convert in columns:
+        try:
+            raw_val = row[alias][db_column]
+        except KeyError:
+            value = None
+        else:
+            if convert is not None:
+                value = convert(raw_val)
+            elif isinstance(raw_val, list):
+                results = [res + [val] for res in results for val in raw_val]
+                continue
+            else:
+                raise NotSupportedError("the result from the api for %s.%s is not supported : %s" %
+                                        (alias.model, db_column, raw_val))
+        for res in results:
+            res.append(value)
+    return results
+
+
 def join_results(row, resolved, connection=None):
     """
     a generator that will generate each results possible for the row data and the resolved data
@@ -526,43 +818,72 @@ def join_results(row, resolved, connection=None):
     :param connection: the connection which can release a cursor for further query (like fetching files on the api)
     :return:
     """
-    if not resolved:
-        yield []
-        return
-    resolved = list(resolved)
-    res = []
-    while resolved:
-        alias, db_column = resolved.pop(0)
+    yield from convert_row(row, get_column_converters(resolved, connection))
 
-        try:
-            raw_val = row[alias][db_column]
-        except KeyError:
-            res.append(None)
-            continue
-        # get the field of this model by either the column or the field name if this
-        # is a reverse related field
-        for field in alias.model._meta.concrete_fields:
-            if field.column == db_column:
-                break
 
-        else:
-            field = alias.model._meta.get_field(db_column)
+class RowMaterializer(object):
+    """
+    build the rows of a query from the items of its main resource, prepared once for the query.
+    the related resources are joined in a static order, the parent of each alias being joined before it, and the
+    rows made by the related lists are walked with a stack instead of recursive generators.
+    """
 
-        if isinstance(field, FileField) and hasattr(field.storage, 'prepare_result_from_api'):
-            res.append(field.storage.prepare_result_from_api(raw_val, connection.cursor()))
-        elif hasattr(field, "to_python"):
-            python_val = field.to_python(raw_val)
-            res.append(python_val)
-        elif isinstance(raw_val, list):
-            for val in raw_val:
-                for subresult in join_results(row, resolved[:], connection):
-                    yield res + [val] + subresult
-            return
-        else:
-            raise NotSupportedError("the result from the api for %s.%s is not supported : %s" %
-                                    (alias.model, db_column, raw_val))
+    def __init__(self, columns):
+        """
+        :param list[tuple[Alias, str, callable|None]] columns: the table given by get_column_converters
+        """
+        self.columns = columns
+        if columns:
+            alias_tree = build_aliases_tree({alias for alias, _, _ in columns})
+            order = list(resolve_tree(alias_tree))
+            self.root = alias_tree.alias
+            # the aliases to join to the item, with the key of their pks in the data of their parent
+            self.joins = [
+                (alias, alias.parent, alias.field.concrete and alias.field.db_column or alias.attrname)
+                for alias in order[1:]
+            ]
 
-    yield res
+    def materialize(self, responsereader, item):
+        """
+        return the rows given by an item of the main resource
+        :param ApiResponseReader responsereader: the response which contains the item
+        :param dict item: the data of the item
+        :return: the rows, each being the list of the values of the columns
+        :rtype: list[list]
+        """
+        if not self.columns:
+            # nothing in select. special case in exists()
+            return [[]]
+        joins = self.joins
+        depth_max = len(joins)
+        # the data of each alias for the current row: it is updated in place while the joins are walked
+        row = {self.root: item}
+        # the pks of the related objects for each join, with the position of the next one to use
+        pks = [None] * depth_max
+        positions = [0] * depth_max
+        results = []
+        depth = 0
+        while depth >= 0:
+            if depth == depth_max:
+                results.extend(convert_row(row, self.columns))
+                depth -= 1
+                continue
+            alias, parent, key = joins[depth]
+            if pks[depth] is None:
+                val = row[parent][key]
+                pks[depth] = val if isinstance(val, list) else [val]
+                positions[depth] = 0
+            position = positions[depth]
+            if position == len(pks[depth]):
+                # all the related objects of this join are done: back to the previous one
+                pks[depth] = None
+                depth -= 1
+                continue
+            positions[depth] = position + 1
+            pk = pks[depth][position]
+            row[alias] = responsereader[alias.model][pk] if pk is not None else {}
+            depth += 1
+        return results
 
 
 def simple_count(compiler, result):
@@ -583,7 +904,7 @@ def simple_count(compiler, result):
             params=params
         )
         compiler.raise_on_response(url, params, response)
-        return True, ([] * (len(compiler.select) - 1)) + [response.json()['meta']['total_results']]
+        return True, ([] * (len(compiler.select) - 1)) + [compiler.decode_response(response)['meta']['total_results']]
 
     return False, None
 
@@ -635,7 +956,7 @@ def m2m_through(compiler, result):
                 get_resource_path(rel_model, rex.rhs),
                 params={'exclude[]': '*', 'include[]': rel_m2m.name}
             )
-            pks = response.json()[get_resource_name(rel_model)][rel_m2m.name]
+            pks = compiler.decode_response(response)[get_resource_name(rel_model)][rel_m2m.name]
             if result == MULTI:
                 return True, [[(pk,) for pk in pks]]  # chunk of row of cols
             else:
@@ -672,10 +993,60 @@ class SQLCompiler(BaseSQLCompiler):
         self.klass_info = None
         self.subquery = False
         self.query_parser = QueryParser(query)
+        # the timings of the queries which gave each page of data, while the timings are collected
+        self.page_timings = {}
+        # the number of rows by page asked by QuerySet.iterator(chunk_size=N)
+        self.chunk_size = None
+        # the shape of the query, and its plan if the same shape was compiled before
+        self.query_shape = None
+        self.query_plan = None
+        # the columns of the select with the converters of their values
+        self.column_converters = None
+        self.row_materializer = None
 
     def setup_query(self, with_col_aliases=False):
         super(SQLCompiler, self).setup_query(with_col_aliases)
-        self.check_compatibility()
+        self.column_converters = None
+        self.row_materializer = None
+        # the compilers made without connection (by the tests) don't use the plans
+        cache = getattr(self.connection, 'query_plan_cache', None)
+        self.query_shape = self.get_query_shape() if cache is not None else None
+        self.query_plan = cache.get(self.query_shape) if self.query_shape is not None else None
+        if self.query_plan is None:
+            # the shapes of queries which have a plan are already checked
+            self.check_compatibility()
+
+    def get_query_shape(self):
+        """
+        return the structure of the query: its model, joins, columns, lookups and ordering, without the values of
+        its filters and slice. the queries of the same shape give the same parameters, but the filter values.
+        :return: the shape, or None if the query can't use the query plans
+        :rtype: tuple|None
+        """
+        query = self.query
+        if self.select is None:
+            return None
+        try:
+            shape = (
+                query.model,
+                tuple(
+                    (alias, table.table_name, table.parent_alias, table.join_type, getattr(table, 'join_field', None))
+                    for alias, table in query.alias_map.items()
+                ),
+                tuple(expression_shape(col) for col, _, _ in self.select),
+                where_shape(query.where),
+                tuple(query.order_by),
+                query.standard_ordering,
+                query.distinct,
+                self.connection.settings_dict.get('PREVENT_DISTINCT', False),
+                query.group_by is not None,
+                self.get_pagination(),
+            )
+            hash(shape)
+        except TypeError:
+            # some parts of the query are not supported, or can't be compared
+            return None
+        return shape
 
     def is_api_model(self):
         return RestModelRouter.is_api_model(self.query.model)
@@ -734,31 +1105,26 @@ class SQLCompiler(BaseSQLCompiler):
         :return: the dict to pass to params for requests to filter results
         :rtype: dict[unicode, unicode]
         """
-        res = {}
-        query = self.query
-        list_of_in = {}
-        for negated, _, lookup in self.query_parser.flaten_where_clause(query.where):  # type: bool, Lookup
+        lookups = self.query_parser.flaten_where_clause(self.query.where)
+        return bind_filters(self.build_filter_template(lookups), lookups)
+
+    def build_filter_template(self, lookups):
+        """
+        build the GET parameter of each lookup of the where clause, to which its value is bound.
+        :param list[tuple[bool, bool, Lookup]] lookups: the lookups given by QueryParser.flaten_where_clause
+        :return: the GET parameter and the lookup name for each lookup
+        :rtype: list[tuple[str, str]]
+        """
+        template = []
+        for negated, _, lookup in lookups:  # type: bool, Lookup
             negated_mark = "-" if negated else ""
             field = self.query_parser.get_rest_path_for_col(lookup.lhs)
             if lookup.lookup_name == 'exact':  # implicite lookup is not needed
                 fieldname = field
             else:
                 fieldname = "{field}.{lookup}".format(field=field, lookup=lookup.lookup_name)
-            key = 'filter{%s%s}' % (negated_mark, fieldname)
-            if isinstance(lookup.rhs, (tuple, list)):
-                res.setdefault(key, []).extend(lookup.rhs)
-                if lookup.lookup_name == 'in':
-                    list_of_in[key] = list_of_in.get(key, 0) + len(lookup.rhs)
-            else:
-                if lookup.lookup_name == 'exact' and res.get(key, lookup.rhs) != lookup.rhs:
-                    # a small performance that won't trigger any query if the
-                    # queryset ask for differents exacts values
-                    raise EmptyResultSet()
-                res.setdefault(key, []).append(lookup.rhs)
-        if not all(list_of_in.values()):
-            # if there is one «xxx.in=[]», me should not query the database
-            raise EmptyResultSet()
-        return res
+            template.append(('filter{%s%s}' % (negated_mark, fieldname), lookup.lookup_name))
+        return template
 
     def build_include_exclude_params(self):
         """
@@ -834,6 +1200,10 @@ class SQLCompiler(BaseSQLCompiler):
             if res:
                 resolved_order_by.append(res)
 
+        if not resolved_order_by and self.get_pagination() == 'keyset':
+            # the keyset pagination need a stable order
+            resolved_order_by.append((False, self.query.get_meta().pk.name))
+
         result = {}
         if resolved_order_by:
             result['sort[]'] = [
@@ -842,19 +1212,38 @@ class SQLCompiler(BaseSQLCompiler):
             ]
         return result
 
+    def get_slice_plan(self):
+        """
+        return the pages to fetch for the slice of the query, or None if the query is not sliced.
+        the pages are chosen to make as few queries as possible without fetching too many rows out of the slice,
+        the page size being capped by APIMeta.max_per_page if the api has a limit.
+        :rtype: rest_models.utils.SlicePlan|None
+        """
+        if self.query.high_mark is None and not self.query.low_mark:
+            return None
+        return plan_slice(self.query.low_mark or 0, self.query.high_mark, max_per_page=self.get_page_size())
+
+    def get_page_size(self):
+        """
+        return the max number of rows by page: the chunk_size given to QuerySet.iterator(), capped by
+        APIMeta.max_per_page. None let the api choose the size of the pages.
+        :rtype: int|None
+        """
+        max_per_page = getattr(self.query.model.APIMeta, 'max_per_page', None)
+        if self.chunk_size is None:
+            return max_per_page
+        return min(self.chunk_size, max_per_page or self.chunk_size)
+
     def build_limit(self):
-        if self.query.high_mark is not None:
-            if self.query.low_mark not in (0, None):
-                page_size = pgcd(self.query.high_mark, self.query.low_mark)
-                return {
-                    'per_page': page_size,
-                    'page': (self.query.low_mark // page_size) + 1
-                }
-            else:
-                return {
-                    'per_page': self.query.high_mark,
-                }
-        return {}
+        plan = self.get_slice_plan()
+        if plan is None:
+            return {} if self.chunk_size is None else {'per_page': self.get_page_size()}
+        params = {}
+        if plan.per_page is not None:
+            params['per_page'] = plan.per_page
+        if plan.first_page > 1:
+            params['page'] = plan.first_page
+        return params
 
     def build_extra(self):
         # is_prefetch_related is added by the QueryParser.resolve_path if it seem it's a
@@ -863,11 +1252,38 @@ class SQLCompiler(BaseSQLCompiler):
             return {'filter_to_prefetch': 'true'}
         return {}
 
+    def get_query_plan(self, lookups):
+        """
+        return the plan of the query: the one of the same shape of query if it was compiled before, or the one
+        compiled now, which is kept for the next queries of this shape.
+        :param list[tuple[bool, bool, Lookup]] lookups: the lookups given by QueryParser.flaten_where_clause
+        :rtype: QueryPlan
+        """
+        plan = self.query_plan
+        if plan is not None:
+            if plan.is_prefetch_related:
+                self.query.is_prefetch_related = True
+            return plan
+        filters = self.build_filter_template(lookups)
+        # the filters which can't match any row stop the query before the rest is compiled
+        bind_filters(filters, lookups)
+        plan = self.query_plan = QueryPlan(
+            filters,
+            self.build_include_exclude_params(),
+            self.build_sort_params(),
+            getattr(self.query, 'is_prefetch_related', False),
+        )
+        if self.query_shape is not None:
+            self.connection.query_plan_cache.put(self.query_shape, plan)
+        return plan
+
     def build_params(self):
+        lookups = self.query_parser.flaten_where_clause(self.query.where)
+        plan = self.get_query_plan(lookups)
         params = {}
-        params.update(self.build_filter_params())
-        params.update(self.build_include_exclude_params())
-        params.update(self.build_sort_params())
+        params.update(plan.bind_filters(lookups))
+        params.update(plan.get_include_exclude())
+        params.update(plan.get_sort())
         params.update(self.build_limit())
         params.update(self.build_extra())
         return params
@@ -881,7 +1297,10 @@ class SQLCompiler(BaseSQLCompiler):
         ids = self.query_parser.resolve_ids()
         if ids is not None and len(ids) == 1:
             params = {}
-            params.update(self.build_include_exclude_params())
+            if self.query_plan is not None:
+                params.update(self.query_plan.get_include_exclude())
+            else:
+                params.update(self.build_include_exclude_params())
             return next(iter(ids)), params
         return None, self.build_params()
 
@@ -902,6 +1321,22 @@ class SQLCompiler(BaseSQLCompiler):
                                    (self.connection.connection.url, build_url(url, params),
                                     message_from_response(response)))
 
+    def decode_response(self, response):
+        """
+        decode the json content of the response with the JSON_CODEC of the database
+        :param requests.Response response: the response of the api
+        :return: the decoded data
+        """
+        timings = getattr(response, 'timings', None)
+        if timings is None:
+            return self.connection.json_codec.decode_response(response)
+        start = time.perf_counter()
+        data = self.connection.json_codec.decode_response(response)
+        timings.add('decode', time.perf_counter() - start)
+        if get_collector() is not None:
+            self.page_timings[id(data)] = timings
+        return data
+
     def get_meta(self, json, response):
         """
         small shortcut to get the metadata from a response data.
@@ -938,33 +1373,64 @@ class SQLCompiler(BaseSQLCompiler):
             )
             if result.status_code != 200:
                 raise ProgrammingError("error while querying the database : %s" % result.text)
-            ids = {res['id'] for res in result.json()[get_resource_name(self.query.model, many=True)]}
+            ids = {res['id'] for res in self.decode_response(result)[get_resource_name(self.query.model, many=True)]}
         return ids
 
-    def response_to_table(self, responsereader, item):
+    def get_resolved_columns(self):
         """
-        take the total result, and return flatened data into a list, including all cols in the select.
-        :param ApiResponseReader responsereader: the full response as a convenient ApiResponseReader
-        :param dict item: the current item to parse
-        :return:
+        resolve the alias and the column of each col in the select
+        :rtype: list[tuple[Alias, str]]
         """
-        resolved = [
+        return [
             self.query_parser.resolve_path(col)
             for col, _, _ in self.select
             if (not isinstance(col, RawSQL) or col.sql != '1')
             and (not isinstance(col, Value) or col.value != 1)   # skip special cases with exists()
         ]
+
+    def get_joined_resources(self):
+        """
+        return the names of the resources of the response read to join the related models of the select.
+        the main resource is in it if the model is joined to itself.
+        :rtype: set[str]
+        """
+        resolved = self.get_resolved_columns()
         if not resolved:
-            # nothing in select. special case in exists()
-            yield [[]]
-        else:
-            uniq_aliases = set(list(zip(*resolved))[0])
-            alias_tree = build_aliases_tree(uniq_aliases)
-            alias_list = list(resolve_tree(alias_tree))
+            return set()
+        alias_tree = build_aliases_tree(set(list(zip(*resolved))[0]))
+        return {
+            get_resource_name(alias.model, many=True)
+            for alias in resolve_tree(alias_tree)
+            if alias is not alias_tree.alias
+        }
+
+    def response_to_table(self, responsereader, item):
+        """
+        take the total result, and return flatened data into a list, including all cols in the select.
+        :param ApiResponseReader responsereader: the full response as a convenient ApiResponseReader
+        :param dict item: the current item to parse
+        :return:
+        """
+        return self.get_row_materializer().materialize(responsereader, item)
 
-            for row in join_aliases(alias_list, responsereader, {alias_tree.alias: item}):
-                for subresult in join_results(row, resolved, self.connection):
-                    yield subresult
+    def get_row_materializer(self):
+        """
+        return the builder of the rows of the query, prepared once for the query
+        :rtype: RowMaterializer
+        """
+        if self.row_materializer is None:
+            self.row_materializer = RowMaterializer(self.get_column_converters())
+        return self.row_materializer
+
+    def get_column_converters(self):
+        """
+        return the table of the columns of the select with the converter of their values, resolved once for the
+        query
+        :rtype: list[tuple[Alias, str, callable|None]]
+        """
+        if self.column_converters is None:
+            self.column_converters = get_column_converters(self.get_resolved_columns(), self.connection)
+        return self.column_converters
 
     def result_iter(self, responsereader):
         """
@@ -972,9 +1438,38 @@ class SQLCompiler(BaseSQLCompiler):
         :param ApiResponseReader responsereader:
         :return:
         """
-        for item in responsereader.iterate(self.query.model):
-            for subitem in self.response_to_table(responsereader, item):
-                yield [subitem]
+        if get_collector() is None:
+            for item in responsereader.iterate(self.query.model):
+                for subitem in self.response_to_table(responsereader, item):
+                    yield [subitem]
+            return
+        # the time to build the rows is added to the timings of the query which gave the page
+        page = timings = None
+        try:
+            for item in responsereader.iterate(self.query.model):
+                if responsereader.page is not page:
+                    page = responsereader.page
+                    timings = self.pop_page_timings(page)
+                start = time.perf_counter()
+                rows = [[subitem] for subitem in self.response_to_table(responsereader, item)]
+                if timings is not None:
+                    timings.add('hydration', time.perf_counter() - start)
+                for row in rows:
+                    yield row
+        finally:
+            # the pages not read won't be: their id can be given to other objects once they are freed
+            self.page_timings.clear()
+
+    def pop_page_timings(self, page):
+        """
+        return the timings of the query which gave the page of data, and forget them: the id of the page can be
+        given to another page once it is freed
+        :param dict|StreamedPage page: the page of data
+        :rtype: QueryTimings|None
+        """
+        if isinstance(page, StreamedPage):
+            return getattr(page.response, 'timings', None)
+        return self.page_timings.pop(id(page), None)
 
     def special_cases(self, result_type):
         """
@@ -988,42 +1483,80 @@ class SQLCompiler(BaseSQLCompiler):
                 return True, result
         return False, None
 
+    @traced_execute('select')
     def execute_sql(self, result_type=MULTI, chunked_fetch=False, chunk_size=None):
+        # QuerySet.iterator() fetch the rows by chunks: each chunk is a page. the other queries use the
+        # default chunk_size, and let the api choose the size of the pages
+        self.chunk_size = chunk_size if chunked_fetch and result_type == MULTI else None
         try:
             self.setup_query()
             if not result_type:
                 result_type = NO_RESULTS
+            api_results = getattr(self.query, 'api_results', None)
+            if api_results is not None:
+                # the results was already fetched by aexecute_sql
+                self.query.api_results = None
+                return iter(api_results) if result_type == MULTI else api_results
             is_special, result = self.special_cases(result_type)
             if is_special:
                 return result
 
             pk, params = self.build_params_and_pk()
             url = get_resource_path(self.query.model, pk)
+            if result_type == MULTI and pk is None and self.get_stream_responses() \
+                    and self.get_pagination() != 'keyset':
+                # the keyset of the next page is in the rows, which are not kept by the streamed pages
+                return self.execute_streamed(params, url)
             response = self.make_request(params, url)
 
             try:
-                json = response.json()
+                json = self.decode_response(response)
             except JSONDecodeError:
                 extra = {'params': params, 'response': response}
                 logger.error('json decode error while calling {}; retrying'.format(url), extra=extra)
-                json = self.make_request(params, url).json()
+                json = self.decode_response(self.make_request(params, url))
+            add_page()
 
             meta = self.get_meta(json, response)
             if meta:
                 # pagination and others thing
 
-                high_mark = self.query.high_mark
-                page_to_stop = None if high_mark is None else (high_mark // meta['per_page'])
+                def fetch_page(page):
+                    tmp_params = params.copy()
+                    tmp_params['page'] = page
+                    last_response = self.connection.cursor().get(
+                        url,
+                        params=tmp_params
+                    )
+                    add_page()
+                    return self.decode_response(last_response)
+
+                def fetch_next(next_params):
+                    last_response = self.connection.cursor().get(
+                        url,
+                        params=next_params
+                    )
+                    add_page()
+                    return self.decode_response(last_response)
+
+                # the first page is given once to the following pages, so it is not kept while they are read
+                first_page = [json]
 
                 def next_from_query():
-                    for i in range(meta['page'], page_to_stop or meta['total_pages']):
-                        tmp_params = params.copy()
-                        tmp_params['page'] = i + 1  # + 1 because of range include start and exclude stop
-                        last_response = self.connection.cursor().get(
-                            url,
-                            params=tmp_params
+                    if self.get_pagination() == 'page':
+                        pages = fetch_pages(
+                            fetch_page,
+                            self.get_next_pages(meta),
+                            self.connection,
+                            max_workers=self.get_parallel_pages(),
                         )
-                        yield last_response.json()
+                    else:
+                        # each page give the way to fetch the next one: they are fetched one after the other
+                        pages = self.iter_following_pages(params, first_page.pop(), fetch_next)
+                    prefetch_pages = self.get_prefetch_pages()
+                    if prefetch_pages > 0:
+                        return PagePrefetcher(pages, prefetch_pages, self.connection)
+                    return pages
 
             else:
                 next_from_query = None
@@ -1034,26 +1567,305 @@ class SQLCompiler(BaseSQLCompiler):
             else:
                 return
 
+        return self.read_results(result_type, json, pk, next_from_query)
+
+    def execute_streamed(self, params, url):
+        """
+        execute the query for many results, and read the pages of the response while they are received
+        :param dict params: the params of the query
+        :param str url: the url of the resource
+        :return: the iterator over the rows
+        """
+        resource_name = get_resource_name(self.query.model, many=True)
+        required = self.get_joined_resources()
+        wanted = {self.META_NAME} | {'+' + name for name in required}
+
+        def stream_page(response):
+            add_page()
+            if not hasattr(response, 'iter_content'):
+                return self.decode_response(response)  # response given by a middleware
+            return StreamedPage(response, resource_name, required, wanted)
+
+        first_page = stream_page(self.make_request(params, url, stream=True))
+
+        def next_pages():
+            # the meta is at the end of the page: it is read once the rows of the first page are consumed
+            data = first_page.data if isinstance(first_page, StreamedPage) else first_page
+            meta = self.get_meta(data, None)
+            if not meta:
+                return
+            if self.get_pagination() == 'cursor':
+                yield from self.iter_following_pages(
+                    params, first_page,
+                    lambda next_params: stream_page(self.connection.cursor().get(url, params=next_params, stream=True))
+                )
+                return
+            for page in self.get_next_pages(meta):
+                tmp_params = params.copy()
+                tmp_params['page'] = page
+                yield stream_page(self.connection.cursor().get(url, params=tmp_params, stream=True))
+
+        return self.read_results(MULTI, first_page, None, next_pages)
+
+    @traced_execute('select')
+    async def aexecute_sql(self, result_type=MULTI):
+        """
+        the asyncio counterpart of execute_sql. the queries are made by the AsyncApiConnexion of the database, on the
+        running event loop, and the following pages are fetched concurrently (up to PARALLEL_PAGES at the same time).
+        unlike execute_sql, all the results are fetched before returning.
+        :param result_type: the result type (MULTI, SINGLE or NO_RESULTS)
+        :return: the list of chunks of rows for MULTI, the row for SINGLE.
+        """
+        try:
+            self.setup_query()
+            if not result_type:
+                result_type = NO_RESULTS
+            try:
+                is_special, result = self.special_cases(result_type)
+            except SynchronousOnlyOperation:
+                # the special cases use the sync connection: they are made in a thread
+                is_special, result = await self.async_special_cases(result_type)
+            if is_special:
+                return result
+
+            connexion = self.connection.get_async_connection()
+            pk, params = self.build_params_and_pk()
+            url = get_resource_path(self.query.model, pk)
+            response = await connexion.get(url, params=params)
+            self.raise_on_response(url, params, response)
+            json = self.decode_response(response)
+            add_page()
+
+            meta = self.get_meta(json, response)
+            pages = []
+            if meta:
+                semaphore = asyncio.Semaphore(self.get_parallel_pages())
+
+                async def fetch_page(page):
+                    tmp_params = params.copy()
+                    tmp_params['page'] = page
+                    async with semaphore:
+                        last_response = await connexion.get(url, params=tmp_params)
+                    add_page()
+                    return self.decode_response(last_response)
+
+                if self.get_pagination() == 'page':
+                    pages = await asyncio.gather(*(fetch_page(page) for page in self.get_next_pages(meta)))
+                else:
+                    data = json
+                    read = self.count_rows(data)
+                    next_params = self.get_next_page_params(params, data, read)
+                    while next_params is not None:
+                        last_response = await connexion.get(url, params=next_params)
+                        add_page()
+                        data = self.decode_response(last_response)
+                        pages.append(data)
+                        read += self.count_rows(data)
+                        next_params = self.get_next_page_params(params, data, read)
+
+        except EmptyResultSet:
+            if result_type == MULTI:
+                return []
+            else:
+                return
+
+        result = self.read_results(result_type, json, pk, lambda: pages)
+        if result_type == MULTI:
+            return list(result)
+        return result
+
+    async def async_special_cases(self, result_type):
+        """
+        run the special cases in a thread, sharing the connection with it.
+        :param result_type:
+        :return: a tupel, with bool and result. the bool is meant to say if there was a special case that matched
+        """
+        self.connection.inc_thread_sharing()
+        try:
+            return await sync_to_async(self.special_cases, thread_sensitive=False)(result_type)
+        finally:
+            self.connection.dec_thread_sharing()
+
+    def read_results(self, result_type, json, pk, next_=None):
+        """
+        return the results of the query from the data of the response, in the format expected for result_type
+        :param result_type: the result type asked to execute_sql
+        :param dict json: the data of the first response
+        :param pk: the pk if the query was made on one resource
+        :param next_: the callable that give the data of the following pages
+        :return:
+        """
         if result_type == CURSOR:
             # Caller didn't specify a result_type, so just give them back the
             # cursor to process (and close).
             raise ProgrammingError("returning a cursor for this database is not supported")
+        plan = self.get_slice_plan() if pk is None else None
         if result_type == SINGLE:
             response_reader = ApiResponseReader(json, many=pk is None)
-            for result in self.result_iter(response_reader):
+            for result in self.trim_results(self.result_iter(response_reader), plan):
                 return result
             return
         if result_type == NO_RESULTS:
             return
-        response_reader = ApiResponseReader(json, next_=next_from_query, many=pk is None)
-        result = self.result_iter(response_reader)
+        response_reader = ApiResponseReader(json, next_=next_, many=pk is None)
+        result = self.trim_results(self.result_iter(response_reader), plan)
         return result
 
-    def make_request(self, params, url):
-        response = self.connection.cursor().get(
-            url,
-            params=params
-        )
+    def trim_results(self, results, plan):
+        """
+        drop the rows fetched out of the slice of the query
+        :param results: the iterator of the rows of the pages fetched
+        :param rest_models.utils.SlicePlan plan: the pages fetched for the slice
+        :return: the rows of the slice
+        """
+        if plan is None:
+            return results
+        stop = None if self.query.high_mark is None else plan.skip + self.query.high_mark - self.query.low_mark
+        return close_after(itertools.islice(results, plan.skip, stop), results)
+
+    def get_next_pages(self, meta):
+        """
+        return the numbers of the pages to fetch after the first one
+        :param dict meta: the meta of the first page
+        :rtype: Iterable[int]
+        """
+        plan = self.get_slice_plan()
+        last_page = meta['total_pages']
+        if plan is not None and plan.last_page is not None:
+            last_page = min(last_page, plan.last_page)
+        # + 1 because the first page is already fetched, and range exclude stop
+        return range(meta['page'] + 1, last_page + 1)
+
+    def get_pagination(self):
+        """
+        return the pagination used to fetch the pages following the first one (see PAGINATIONS).
+        the keyset and cursor paginations can't start at an offset: the sliced queries use the page numbers, as
+        well as the keyset pagination of the rows not sorted by pk.
+        :rtype: str
+        """
+        pagination = get_pagination(self.query.model)
+        if pagination != 'page' and self.query.low_mark:
+            return 'page'
+        if pagination == 'keyset' and self.get_keyset_order() is None:
+            return 'page'
+        return pagination
+
+    def get_keyset_order(self):
+        """
+        return the order of the rows for the keyset pagination: False if they are sorted by ascending pk (or not
+        sorted), True by descending pk, and None if they are sorted by other fields. the order is flipped by
+        QuerySet.reverse(), like the sort[] sent by build_sort_params.
+        :rtype: bool|None
+        """
+        order_by = self.query.order_by
+        if not order_by:
+            return False
+        pk = self.query.get_meta().pk
+        if len(order_by) == 1 and isinstance(order_by[0], str) and \
+                order_by[0].lstrip('-') in ('pk', pk.name, pk.attname):
+            return order_by[0].startswith('-') != (not self.query.standard_ordering)
+        return None
+
+    def count_rows(self, page):
+        """
+        return the number of rows of the main resource in a page. the rows of the streamed pages are not kept:
+        they are counted as a full page.
+        :param dict|StreamedPage page: the page of data
+        :rtype: int
+        """
+        if isinstance(page, StreamedPage):
+            return (self.get_meta(page.data, None) or {}).get('per_page', 0)
+        return len(page.get(get_resource_name(self.query.model, many=True)) or ())
+
+    def get_next_page_params(self, params, page, read):
+        """
+        return the params of the page following the given one, for the cursor and keyset paginations
+        :param dict params: the params of the first page
+        :param dict|StreamedPage page: the data of the last page fetched
+        :param int read: the number of rows read so far
+        :return: the params of the next page, or None if the given page is the last one
+        :rtype: dict|None
+        """
+        data = page.data if isinstance(page, StreamedPage) else page
+        meta = self.get_meta(data, None)
+        if not meta:
+            return None
+        plan = self.get_slice_plan()
+        if plan is not None and self.query.high_mark is not None and \
+                read >= plan.skip + self.query.high_mark - self.query.low_mark:
+            return None
+        api_meta = self.query.model.APIMeta
+        next_params = params.copy()
+        next_params.pop('page', None)
+        if self.get_pagination() == 'cursor':
+            cursor = meta.get(getattr(api_meta, 'cursor_meta', 'next'))
+            if not cursor:
+                return None
+            next_params[getattr(api_meta, 'cursor_param', 'cursor')] = cursor
+            return next_params
+        rows = data.get(get_resource_name(self.query.model, many=True)) or []
+        if not rows or meta.get('total_pages', 2) <= 1 or len(rows) < meta.get('per_page', 0):
+            return None
+        pk = self.query.get_meta().pk.name
+        next_params['filter{%s.%s}' % (pk, 'lt' if self.get_keyset_order() else 'gt')] = rows[-1][pk]
+        return next_params
+
+    def iter_following_pages(self, params, page, fetch):
+        """
+        fetch the pages following the given one with the cursor or keyset pagination. each page is fetched
+        once the previous one is received, since it give the way to fetch the next one.
+        :param dict params: the params of the first page
+        :param dict|StreamedPage page: the data of the first page
+        :param fetch: the callable that take the params of a page, and return its data
+        :return: the data of each page
+        :rtype: Iterable[dict|StreamedPage]
+        """
+        read = self.count_rows(page)
+        while True:
+            next_params = self.get_next_page_params(params, page, read)
+            if next_params is None:
+                return
+            # the consumed page is not kept while the next one is fetched
+            page = None
+            page = fetch(next_params)
+            yield page
+            read += self.count_rows(page)
+
+    def get_parallel_pages(self):
+        """
+        return the number of pages that can be fetched at the same time for a paginated query
+        :rtype: int
+        """
+        return int(self.connection.settings_dict['OPTIONS'].get('PARALLEL_PAGES', 1))
+
+    def get_prefetch_pages(self):
+        """
+        return the number of pages to read ahead while the current one is consumed. 0 disable the read ahead.
+        :rtype: int
+        """
+        return int(self.connection.settings_dict['OPTIONS'].get('PREFETCH_PAGES', 0))
+
+    def get_stream_responses(self):
+        """
+        return True if the responses with many results must be read while they are received
+        :rtype: bool
+        """
+        return bool(self.connection.settings_dict['OPTIONS'].get('STREAM_RESPONSES', False))
+
+    def make_request(self, params, url, **kwargs):
+        def request():
+            return self.connection.cursor().get(
+                url,
+                params=params,
+                **kwargs
+            )
+
+        hedger = self.connection.hedger
+        if hedger is not None and not kwargs.get('stream'):
+            # the response is used once fully received: the slow queries can be sent twice
+            response = hedger.request(request, self.connection)
+        else:
+            response = request()
         self.raise_on_response(url, params, response)
         return response
 
@@ -1126,7 +1938,8 @@ class SQLInsertCompiler(SQLCompiler):
                     "error while solving m2m final value at %s [%d]\n%s" %
                     (url, response.status_code, response.text)
                 )
-            final_vals = set(new_vals) | set(response.json()[get_resource_name(rel_model)][rel_m2m.name])
+            current_vals = self.decode_response(response)[get_resource_name(rel_model)][rel_m2m.name]
+            final_vals = set(new_vals) | set(current_vals)
             response_update = self.connection.cursor().patch(
                 url,
                 json={get_resource_name(rel_model): {rel_m2m.name: list(final_vals)}}
@@ -1137,6 +1950,7 @@ class SQLInsertCompiler(SQLCompiler):
                     (url, response_update.status_code, response.text)
                 )
 
+    @traced_execute('insert')
     def execute_sql(self, return_id=False, chunk_size=None):
         query = self.query
         """:type: django.db.models.sql.subqueries.InsertQuery"""
@@ -1167,7 +1981,7 @@ class SQLInsertCompiler(SQLCompiler):
                     "error while creating %d %s.\n%s" %
                     (len(query_objs), opts.verbose_name, response.text)
                 )
-            result_json = response.json()
+            result_json = self.decode_response(response)
             for old, new in zip(query_objs, result_json[get_resource_name(query.model, many=True)]):
                 for field in opts.concrete_fields:
                     setattr(old, field.attname, field.to_python(new[field.concrete and field.db_column or field.name]))
@@ -1190,7 +2004,7 @@ class SQLInsertCompiler(SQLCompiler):
                             "error while creating (uploading files and data) %s with data=%s ; files=%s.\n%s" % (
                                 obj, obj_data, files, message_from_response(response_files)))
                     # update with json formated
-                    new_id = response_files.json()[get_resource_name(query.model, many=False)]['id']
+                    new_id = self.decode_response(response_files)[get_resource_name(query.model, many=False)]['id']
                     response = self.connection.cursor().patch(
                         url=get_resource_path(query.model, pk=new_id),
                         json={get_resource_name(query.model, many=False): obj_data}
@@ -1208,7 +2022,7 @@ class SQLInsertCompiler(SQLCompiler):
                         raise FakeDatabaseDbAPI2.ProgrammingError("error while creating %s with json=%s.\n%s" % (
                             obj, obj_data, message_from_response(response)))
 
-                result_json = response.json()
+                result_json = self.decode_response(response)
                 new = result_json[get_resource_name(query.model, many=False)]
 
                 for field in opts.concrete_fields:
@@ -1249,6 +2063,7 @@ class FakeCursor(object):
 
 
 class SQLDeleteCompiler(SQLCompiler):
+    @traced_execute('delete')
     def execute_sql(self, result_type=MULTI, chunk_size=None):
         opts = self.query.get_meta()
         if self.is_api_model():
@@ -1305,7 +2120,7 @@ class SQLDeleteCompiler(SQLCompiler):
                         get_resource_path(rel_model, rex.rhs),
                         params={'exclude[]': '*', 'include[]': rel_m2m.name}
                     )
-                    pks = response.json()[get_resource_name(rel_model)][rel_m2m.name]
+                    pks = self.decode_response(response)[get_resource_name(rel_model)][rel_m2m.name]
                     final_pks = set(pks) - set(rin.rhs)
                 response = self.connection.cursor().patch(
                     get_resource_path(rel_model, rex.rhs),
@@ -1350,6 +2165,7 @@ class SQLUpdateCompiler(SQLCompiler):
 
         return data, (files or None)
 
+    @traced_execute('update')
     def execute_sql(self, result_type=MULTI, chunk_size=None):
         updated = 0
         if self.is_api_model():
@@ -1375,7 +2191,7 @@ class SQLUpdateCompiler(SQLCompiler):
                         )
 
                     # update object instance using result data if possible
-                    result_json.update(result.json()[get_resource_name(query.model, many=False)])
+                    result_json.update(self.decode_response(result)[get_resource_name(query.model, many=False)])
 
                 instance_data = {}
                 obj = None
@@ -1400,6 +2216,7 @@ class SQLUpdateCompiler(SQLCompiler):
 
 class SQLAggregateCompiler(SQLCompiler):
 
+    @traced_execute('aggregate')
     def execute_sql(self, result_type=MULTI, chunk_size=None):
         self.setup_query()
         if not result_type:
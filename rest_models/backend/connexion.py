@@ -1,24 +1,49 @@
 import collections
+import collections.abc
 import itertools
 import logging
+import random
+import threading
 import time
 from urllib.parse import urlparse, urlunparse
 
 import requests
+from django.conf import settings
 from django.core.handlers.base import BaseHandler
 from django.test.client import RequestFactory
-from requests.adapters import BaseAdapter
+from requests.adapters import BaseAdapter, HTTPAdapter
 from requests.cookies import extract_cookies_to_jar
 from requests.exceptions import ConnectionError, Timeout
 from requests.models import RequestEncodingMixin, Response
 from requests.structures import CaseInsensitiveDict
 from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
+from rest_models.backend.deadline import check_deadline, get_deadline, shrink_timeout
 from rest_models.backend.exceptions import FakeDatabaseDbAPI2
+from rest_models.backend.hedging import is_hedge
+from rest_models.backend.json_codecs import JsonCodec
+from rest_models.backend.middlewares import MiddlewarePipeline
+from rest_models.backend.rate_limit import parse_retry_after
+from rest_models.backend.single_flight import get_request_key, get_wait_timeout
+from rest_models.backend.timings import get_query_timings, measure_phase, measure_query
+from rest_models.backend.tracing import trace_request
 from rest_models.backend.utils import message_from_response
 
 logger = logging.getLogger("django.db.backends")
 
+THROTTLE_STATUS_CODES = (429, 503)
+"""
+the status codes of the responses which ask to retry later
+"""
+
+MIN_THROTTLE_DELAY = 0.1
+"""
+the min delay before retrying a throttled query, if RETRY_BACKOFF is not greater: a Retry-After of 0 or in the past
+must not make all the queries retry at once
+"""
+
 
 def build_url(url, params):
     """
@@ -41,8 +66,24 @@ class LocalApiAdapter(BaseAdapter):
 
     def __init__(self):
         self.request_factory = RequestFactory()
+        self._handler = None
+        self._handler_middleware = None
         super(LocalApiAdapter, self).__init__()
 
+    def get_handler(self):
+        """
+        return the django handler which serve the requests. it is built once and reused while the
+        MIDDLEWARE setting don't change, since loading the middlewares is the costly part of the handler.
+        :rtype: BaseHandler
+        """
+        middleware_setting = settings.MIDDLEWARE
+        handler = self._handler
+        if handler is None or self._handler_middleware is not middleware_setting:
+            handler = BaseHandler()
+            handler.load_middleware()
+            self._handler, self._handler_middleware = handler, middleware_setting
+        return handler
+
     def prepared_request_to_wsgi_request(self, prepared_request):
         """
         transform a PreparedRequest into a WsgiRequest for django to use
@@ -103,10 +144,8 @@ class LocalApiAdapter(BaseAdapter):
 
     def send(self, request, stream=False, timeout=None, verify=True,
              cert=None, proxies=None):
-        handler = BaseHandler()
-        handler.load_middleware()
         wsgi_request = self.prepared_request_to_wsgi_request(request)
-        http_response = handler.get_response(wsgi_request)
+        http_response = self.get_handler().get_response(wsgi_request)
         requests_response = self.http_response_to_response(http_response, request)
         return requests_response
 
@@ -114,6 +153,99 @@ class LocalApiAdapter(BaseAdapter):
         pass
 
 
+class TimedHTTPConnection(HTTPConnection):
+    """
+    a http connection which add the time to open it to the connect timing of the query
+    """
+
+    def connect(self):
+        with measure_phase('connect'):
+            super(TimedHTTPConnection, self).connect()
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """
+    a https connection which add the time to open it to the connect timing of the query
+    """
+
+    def connect(self):
+        with measure_phase('connect'):
+            super(TimedHTTPSConnection, self).connect()
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    """
+    a pool of http connections which add the time to get a connection to the connect timing of the query
+    """
+    ConnectionCls = TimedHTTPConnection
+
+    def _get_conn(self, timeout=None):
+        with measure_phase('connect'):
+            return super(TimedHTTPConnectionPool, self)._get_conn(timeout)
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    """
+    a pool of https connections which add the time to get a connection to the connect timing of the query
+    """
+    ConnectionCls = TimedHTTPSConnection
+
+    def _get_conn(self, timeout=None):
+        with measure_phase('connect'):
+            return super(TimedHTTPSConnectionPool, self)._get_conn(timeout)
+
+
+class ApiHTTPAdapter(HTTPAdapter):
+    """
+    the adapter used for the real http/https connections to the api.
+    it allow to give the socket options for the connections (keep-alive, nodelay, etc) and can report
+    the usage of its pools.
+    """
+    __attrs__ = HTTPAdapter.__attrs__ + ['socket_options']
+
+    def __init__(self, socket_options=None, **kwargs):
+        """
+        :param list[tuple] socket_options: the options to set on each new socket (as for socket.setsockopt).
+            None keep the default options of urllib3.
+        :param kwargs: the pool_connections, pool_maxsize, pool_block and max_retries of the HTTPAdapter
+        """
+        self.socket_options = socket_options
+        super(ApiHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.socket_options is not None:
+            pool_kwargs['socket_options'] = self.socket_options
+        super(ApiHTTPAdapter, self).init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+    def pool_stats(self):
+        """
+        return the usage of each pool of connections, by host.
+        :return: a dict with, for each host, the connections in use, the idle connections,
+            the size of the pool and the number of requests made
+        :rtype: dict[str, dict[str, int]]
+        """
+        stats = {}
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:  # pragma: no cover
+                continue  # the pool was dropped in the meantime
+            # the queue is filled with None placeholders or idle connections. each connection
+            # in use has taken one item from the queue
+            idle_queue = list(pool.pool.queue) if pool.pool is not None else []
+            stats['%s://%s:%s' % (pool.scheme, pool.host, pool.port)] = {
+                'in_use': max(0, self._pool_maxsize - len(idle_queue)),
+                'idle': sum(1 for conn in idle_queue if conn is not None),
+                'maxsize': self._pool_maxsize,
+                'requests': pool.num_requests,
+            }
+        return stats
+
+
 class ApiVerbShortcutMixin(object):
 
     def get(self, url, params=None, json=None, **kwargs):
@@ -224,22 +356,98 @@ class DebugApiConnectionWrapper(ApiVerbShortcutMixin):
         try:
             response = self.connection.request(method, url, **kwargs)
         finally:
-            stop = time.time()
-            duration = stop - start
-            sql = build_url(url, kwargs['params'])
-            elapsed_sec = response.elapsed.total_seconds() if response else 0.
-            self.db.queries_log.append({
-                'sql': "%s %s ||| %s" % (method, sql, kwargs),
-                'time': "%.3f " % elapsed_sec
-            })
-            logger.debug('(%.3f) (backend:%.3f) %s %s; args=%s' % (duration, elapsed_sec,
-                                                                   method, sql, kwargs),
-                         extra={'duration': duration, 'backend': elapsed_sec,
-                                'sql': sql, 'params': kwargs, 'method': method}
-                         )
+            log_query(self.db, method, url, kwargs, time.time() - start, response)
         return response
 
 
+class QueryLogEntry(collections.abc.Mapping):
+    """
+    an entry of the queries log of a database, as a read-only dict with the keys sql and time.
+    the raw query is stored, and the sql is rendered only when it is read.
+    """
+    __slots__ = ('method', 'url', 'kwargs', 'duration', 'elapsed', '_sql')
+
+    KEYS = ('sql', 'time')
+
+    def __init__(self, method, url, kwargs, duration, elapsed):
+        """
+        :param str method: the http verb
+        :param str url: the url given to the query
+        :param dict kwargs: the other arguments of the query (params, json, etc)
+        :param float duration: the total time taken by the query, in seconds
+        :param float elapsed: the time taken by the api to respond, in seconds
+        """
+        self.method = method
+        self.url = url
+        self.kwargs = kwargs
+        self.duration = duration
+        self.elapsed = elapsed
+        self._sql = None
+
+    @property
+    def url_with_params(self):
+        return build_url(self.url, self.kwargs.get('params'))
+
+    @property
+    def sql(self):
+        if self._sql is None:
+            self._sql = "%s %s ||| %s" % (self.method, self.url_with_params, self.kwargs)
+        return self._sql
+
+    def __getitem__(self, key):
+        if key == 'sql':
+            return self.sql
+        if key == 'time':
+            return "%.3f " % self.elapsed
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def log_query(db, method, url, kwargs, duration, response):
+    """
+    record a query made to the api in the queries log of the database, and in the logger.
+    if the database has a sampling rate, only some queries are recorded, except while the queries are counted
+    (force_debug_cursor, used by assertNumQueries).
+    :param DatabaseWrapper db: the database which made the query
+    :param str method: the http verb
+    :param str url: the url given to the query
+    :param dict kwargs: the other arguments of the query (params, json, etc)
+    :param float duration: the total time taken by the query, in seconds
+    :param response: the response, or None if the query has failed
+    """
+    sampling = db.queries_log_sampling
+    if sampling < 1 and not db.force_debug_cursor and random.random() >= sampling:
+        return
+    elapsed_sec = response.elapsed.total_seconds() if response else 0.
+    entry = QueryLogEntry(method, url, dict(kwargs), duration, elapsed_sec)
+    db.queries_log.append(entry)
+    if logger.isEnabledFor(logging.DEBUG):
+        sql = entry.url_with_params
+        timings = getattr(response, 'timings', None)
+        logger.debug('(%.3f) (backend:%.3f) %s %s; args=%s', duration, elapsed_sec, method, sql, entry.kwargs,
+                     extra={'duration': duration, 'backend': elapsed_sec,
+                            'sql': sql, 'params': entry.kwargs, 'method': method,
+                            'timings': dict(timings.phases) if timings is not None else {}}
+                     )
+
+
+def close_response(response):
+    """
+    release the connection of a response which will not be read
+    """
+    close = getattr(response, 'close', None)
+    if close is not None:
+        close()
+
+
 def get_basic_session():
     session = requests.Session()
     session.mount(LocalApiAdapter.SPECIAL_URL, LocalApiAdapter())
@@ -252,7 +460,9 @@ class ApiConnexion(ApiVerbShortcutMixin):
     wrapper for request.Session that in fact implement useless methods like rollback which
     is not possible with a rest API
     """
-    def __init__(self, url, auth=None, retry=3, timeout=3, backend=None, middlewares=(), ssl_verify=None):
+    def __init__(self, url, auth=None, retry=3, timeout=3, backend=None, middlewares=(), ssl_verify=None,
+                 pool_options=None, retry_backoff=0, retry_backoff_max=30, retry_jitter=True, circuit_breaker=None,
+                 json_codec=None, single_flight=None, rate_limiter=None, throttle_deadline=0, balancer=None):
         """
         create a persistent connection to the api
         :param str url: the base url for the api (host + port + start path)
@@ -261,20 +471,50 @@ class ApiConnexion(ApiVerbShortcutMixin):
         :param int|(int, int) timeout: the timeout to pass to the api
         :param DatabaseWrapper backend: the backend
         :param list[Middleware]|tuple[Middleware] middlewares:the list of middleware to execute for each query.
+        :param dict pool_options: the kwargs for the ApiHTTPAdapter used for the http and https connections
+        :param float retry_backoff: the delay before the first retry, doubled at each following retry.
+            0 retry immediately
+        :param float retry_backoff_max: the max delay between two retries
+        :param bool retry_jitter: if True, wait a random delay between 0 and the backoff delay
+        :param CircuitBreaker circuit_breaker: the circuit breaker which stop the queries while the api is down
+        :param BaseJsonCodec json_codec: the codec which encode the json bodies. default to the json module
+        :param SingleFlight single_flight: if given, the identical GET made at the same time by many threads
+            are made once
+        :param RateLimiter rate_limiter: the rate limiter which space the queries, and pause them when the api
+            ask to slow down
+        :param float throttle_deadline: the max number of seconds to retry the queries throttled by the api
+            (429, or 503 with a Retry-After). 0 does not retry them
+        :param LoadBalancer balancer: if given, the queries are spread over the replicas of the api
         """
         if not url.endswith('/'):
             # fix the miss configured url in the api (must end with a /)
             url = url + '/'
         self.session = requests.Session()
+        self.adapter = ApiHTTPAdapter(**(pool_options or {}))
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
         self.session.mount(LocalApiAdapter.SPECIAL_URL, LocalApiAdapter())
         self.session.mount('http://testserver', LocalApiAdapter())  # for special host used by django for unittests
         self.session.auth = self.auth = auth
         self.url = url
         self.retry = retry
+        self.retry_backoff = retry_backoff
+        self.retry_backoff_max = retry_backoff_max
+        self.retry_jitter = retry_jitter
+        self.circuit_breaker = circuit_breaker
+        # the result of the last query which has reached the api (or not), and its time
+        self.health = None
+        self.json_codec = json_codec or JsonCodec()
+        self.single_flight = single_flight
+        self.rate_limiter = rate_limiter
+        self.throttle_deadline = throttle_deadline
+        self.balancer = balancer
         self.timeout = timeout
         self.backend = backend
         self._middlewares_scheduler = collections.defaultdict(list)
+        self.pipeline = MiddlewarePipeline()
         self._requestid = 0
+        self._requestid_lock = threading.Lock()
         if ssl_verify is not None:
             self.session.verify = ssl_verify
         for middleware in middlewares:
@@ -286,7 +526,7 @@ class ApiConnexion(ApiVerbShortcutMixin):
         the list of middleware to iterate over. ordered by priority from 1 to 10
         :return:
         """
-        return list(itertools.chain(*(v for k, v in sorted(self._middlewares_scheduler.items()))))
+        return list(self.pipeline.middlewares)
 
     def push_middleware(self, middleware, priority=5):
         """
@@ -295,6 +535,7 @@ class ApiConnexion(ApiVerbShortcutMixin):
         :return:
         """
         self._middlewares_scheduler[priority].insert(0, middleware)
+        self.compile_middlewares()
 
     def pop_middleware(self, middleware):
         for middlewares in self._middlewares_scheduler.values():
@@ -302,10 +543,27 @@ class ApiConnexion(ApiVerbShortcutMixin):
                 middlewares.remove(middleware)
             except ValueError:
                 pass
+        self.compile_middlewares()
+
+    def compile_middlewares(self):
+        """
+        build the pipeline of middlewares used by the requests, ordered by priority
+        """
+        self.pipeline = MiddlewarePipeline(
+            itertools.chain(*(v for k, v in sorted(self._middlewares_scheduler.items())))
+        )
 
     def close(self):
         self.session.close()
 
+    def pool_stats(self):
+        """
+        return the usage of the pools of connections to the api.
+        see ApiHTTPAdapter.pool_stats
+        :rtype: dict[str, dict[str, int]]
+        """
+        return self.adapter.pool_stats()
+
     def __exit__(self, *args):
         self.close()
 
@@ -317,8 +575,9 @@ class ApiConnexion(ApiVerbShortcutMixin):
         increment the request id and then return it
         :return:
         """
-        self._requestid += 1
-        return self._requestid
+        with self._requestid_lock:
+            self._requestid += 1
+            return self._requestid
 
     def execute(self, sql, params=None):
         """
@@ -337,17 +596,73 @@ class ApiConnexion(ApiVerbShortcutMixin):
         :return:
         """
         requestid = self.inc_request_id()
-        middlewares = self.middlewares
-        i = 0
-        for i, middleware in enumerate(middlewares):
-            response = middleware.process_request(params, requestid, self)
-            if response is not None:
-                break
-        else:
-            # if the middleware did not override the real response, we make the query
-            response = self.session.request(**params)
-        for middleware in middlewares[i::-1]:  # iterate over all previously executed middlewares
-            response = middleware.process_response(params, response, requestid) or response
+        pipeline = self.pipeline
+        with measure_query(params.get('method'), params.get('url')) as timings:
+            with measure_phase('middlewares'):
+                response, last = pipeline.process_request(params, requestid, self)
+            if response is None:
+                # if the middleware did not override the real response, we make the query
+                try:
+                    response = self.send(params)
+                except Exception as e:
+                    pipeline.process_exception(params, e, requestid, last)
+                    raise
+            # iterate over all previously executed middlewares
+            with measure_phase('middlewares'):
+                response = pipeline.process_response(params, response, requestid, last)
+        response.timings = timings
+        return response
+
+    def send(self, params):
+        """
+        send the query to the api, once the middlewares are passed
+        :param dict params: the params of the query, as given to requests.Session.request
+        :rtype: requests.Response
+        """
+        # a hedge would wait for the slow query it duplicate
+        key = get_request_key(params) if self.single_flight is not None and not is_hedge() else None
+        encoded = self.json_codec.encode_request(params)
+        session_request = self.session_request if self.balancer is None else self.balanced_request
+        if key is None:
+            return session_request(encoded)
+        return self.single_flight.do(key, lambda: session_request(encoded), get_wait_timeout(params.get('timeout')))
+
+    def balanced_request(self, params):
+        """
+        make the query on the endpoint chosen by the load balancer, and record its health and latency
+        :param dict params: the params of the query, as given to requests.Session.request
+        :rtype: requests.Response
+        """
+        endpoint = self.balancer.acquire()
+        params = dict(params, url=endpoint.get_url(params['url'], self.url))
+        start = time.perf_counter()
+        try:
+            response = self.session_request(params)
+        except (Timeout, ConnectionError):
+            self.balancer.release(endpoint, False)
+            raise
+        except BaseException:
+            self.balancer.release(endpoint, None)
+            raise
+        self.balancer.release(endpoint, response.status_code < 500, time.perf_counter() - start)
+        return response
+
+    def session_request(self, params):
+        """
+        make the query with the session of requests, and record its time to first byte and download time
+        :param dict params: the params of the query, as given to requests.Session.request
+        :rtype: requests.Response
+        """
+        timings = get_query_timings()
+        if timings is None:
+            return self.session.request(**params)
+        start = time.perf_counter()
+        response = self.session.request(**params)
+        duration = time.perf_counter() - start
+        # requests measure the time until the headers are received, before the body is read
+        elapsed = response.elapsed.total_seconds()
+        timings.add('ttfb', max(0., elapsed - timings.phases.get('connect', 0.)))
+        timings.add('download', max(0., duration - elapsed))
         return response
 
     def rollback(self):  # pragma: no cover
@@ -386,42 +701,164 @@ class ApiConnexion(ApiVerbShortcutMixin):
         kwargs.setdefault("timeout", self.get_timeout())
         kwargs.setdefault('stream', False)
         real_url = self.get_final_url(url)
+        timeout = kwargs['timeout']
 
         error = 0
         last_exception = None
-
-        while error <= self.retry:
-            try:
-                # to stay compatible with django_debug_toolbar, we must
-                # call execute on the cursor return by the backend, since this one is replaced
-                # by django-debug-toolbar to state the query.
-                if self.backend:
-                    execute = self.backend.cursor().execute
-                else:
-                    execute = self.execute
-                response = execute("%s %s" % (method.upper(), real_url), dict(method=method, url=real_url, **kwargs))
-
-            except Timeout as e:
-                error += 1
-                last_exception = e
-            except ConnectionError as e:
-                error += 1
-                last_exception = e
-            else:
-
-                if self.auth and hasattr(self.auth, 'raise_on_response_forbidden'):
-                    self.auth.raise_on_response_forbidden(response)
+        deadline = self.get_throttle_deadline()
+
+        with trace_request(self.tracer, method, real_url, kwargs.get('params')) as span:
+            while error <= self.retry:
+                self.check_circuit_breaker()
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                # the query can't last longer than the time left to the current request
+                kwargs['timeout'] = shrink_timeout(timeout)
+                try:
+                    # to stay compatible with django_debug_toolbar, we must
+                    # call execute on the cursor return by the backend, since this one is replaced
+                    # by django-debug-toolbar to state the query.
+                    if self.backend:
+                        execute = self.backend.cursor().execute
+                    else:
+                        execute = self.execute
+                    response = execute("%s %s" % (method.upper(), real_url),
+                                       dict(method=method, url=real_url, **kwargs))
+
+                except (Timeout, ConnectionError) as e:
+                    error += 1
+                    last_exception = e
+                    self.record_outcome(False)
+                    if error <= self.retry:
+                        delay = self.get_retry_delay(error)
+                        check_deadline(delay)
+                        time.sleep(delay)
+                except Exception:
+                    self.record_outcome(None)
+                    raise
                 else:
-                    if response.status_code in (403, 401):
-                        raise FakeDatabaseDbAPI2.ProgrammingError(
-                            "Access to database is Forbidden for user %s.\n%s" %
-                            (self.auth[0] if isinstance(self.auth, tuple) else self.auth,
-                             message_from_response(response))
-                        )
-                return response
-        raise FakeDatabaseDbAPI2.OperationalError(
+                    self.record_outcome(True)
+                    delay = self.get_throttle_delay(response, deadline)
+                    if delay is not None:
+                        # the api ask to slow down: all the queries wait before this one is retried
+                        self.rate_limiter.pause(delay)
+                        close_response(response)
+                        continue
+                    if span is not None:
+                        span.set_attribute('status', response.status_code)
+                        span.set_attribute('retries', error)
+                    self.raise_on_forbidden(response)
+                    return response
+            if span is not None:
+                span.set_attribute('retries', error - 1)
+            raise self.connection_error(last_exception, error)
+
+    def get_throttle_deadline(self):
+        """
+        return the time (monotonic) after which the queries throttled by the api are not retried: after the
+        RATE_LIMIT_DEADLINE, or the deadline of the current request
+        :rtype: float
+        """
+        deadline = time.monotonic() + self.throttle_deadline
+        request_deadline = get_deadline()
+        if request_deadline is not None:
+            deadline = min(deadline, request_deadline)
+        return deadline
+
+    def get_throttle_delay(self, response, deadline):
+        """
+        return the time to wait before retrying a query throttled by the api (429, or 503 with a Retry-After),
+        or None if the response must be returned as is.
+        :param response: the response of the api
+        :param float deadline: the time (monotonic) after which the query is not retried
+        :rtype: float|None
+        """
+        if self.rate_limiter is None or response.status_code not in THROTTLE_STATUS_CODES:
+            return None
+        delay = parse_retry_after((getattr(response, 'headers', None) or {}).get('Retry-After'))
+        if delay is None:
+            if response.status_code != 429:
+                return None  # the api is down, not throttling us
+            delay = max(self.retry_backoff, 1.)
+        delay = max(delay, self.retry_backoff, MIN_THROTTLE_DELAY)
+        if time.monotonic() + delay > deadline:
+            return None
+        return delay
+
+    @property
+    def tracer(self):
+        """
+        the tracer of the database, or None if the queries are not traced
+        :rtype: rest_models.backend.tracing.Tracer|None
+        """
+        return self.backend.tracer if self.backend is not None else None
+
+    def get_retry_delay(self, tries):
+        """
+        return the time to wait before the next try, with an exponential backoff and an optional jitter
+        :param int tries: the number of failed tries
+        :rtype: float
+        """
+        if not self.retry_backoff:
+            return 0
+        delay = min(self.retry_backoff_max, self.retry_backoff * 2 ** (tries - 1))
+        if self.retry_jitter:
+            # "full jitter": spread the retries of all the clients over the whole delay
+            delay = random.uniform(0, delay)
+        return delay
+
+    def check_circuit_breaker(self):
+        """
+        raise an OperationalError without querying the api if the circuit breaker is open
+        """
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow_request():
+            raise FakeDatabaseDbAPI2.OperationalError(
+                "the circuit breaker is open for %s: the API on %s is considered down" %
+                (self.circuit_breaker.name, self.url))
+
+    def record_outcome(self, success):
+        """
+        give the result of a query to the circuit breaker, and keep it as the health of the connection
+        :param bool|None success: True if the api has answered, False if it could not be reached, None if the query
+            has failed for another reason
+        """
+        if success is not None:
+            self.health = (success, time.monotonic())
+        breaker = self.circuit_breaker
+        if breaker is None:
+            return
+        if success:
+            breaker.record_success()
+        elif success is None:
+            breaker.release()
+        else:
+            breaker.record_failure()
+
+    def raise_on_forbidden(self, response):
+        """
+        raise a ProgrammingError if the response tell us that the access to the api is forbidden
+        :param response: the response of the api
+        """
+        if self.auth and hasattr(self.auth, 'raise_on_response_forbidden'):
+            self.auth.raise_on_response_forbidden(response)
+        else:
+            if response.status_code in (403, 401):
+                raise FakeDatabaseDbAPI2.ProgrammingError(
+                    "Access to database is Forbidden for user %s.\n%s" %
+                    (self.auth[0] if isinstance(self.auth, tuple) else self.auth,
+                     message_from_response(response))
+                )
+
+    def connection_error(self, last_exception, tries):
+        """
+        build the error raised when the api could not be reached
+        :param Exception last_exception: the last error while connecting to the api
+        :param int tries: the number of tries made
+        :rtype: OperationalError
+        """
+        return FakeDatabaseDbAPI2.OperationalError(
             "cound not connect to server: %s\nIs the API running on %s ? tried %d times" %
-            (last_exception, self.url, error))
+            (last_exception, self.url, tries))
 
     def get_final_url(self, url):
         if url.startswith("/"):
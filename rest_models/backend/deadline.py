@@ -0,0 +1,96 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from rest_models.backend.exceptions import OperationalError
+
+_deadline = contextvars.ContextVar('rest_models_deadline', default=None)
+
+
+class DeadlineExceeded(OperationalError):
+    """
+    raised when a query to the api is made after the deadline of the current request
+    """
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    give a time budget to all the queries to the api made in the block: the timeout of each query is shrunk to the
+    time left, and the queries made once the budget is spent raise DeadlineExceeded without reaching the api.
+    a nested deadline can't extend the budget of the outer one.
+    :param float seconds: the time budget, in seconds
+    """
+    end = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None and current < end:
+        end = current
+    token = _deadline.set(end)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def get_deadline():
+    """
+    return the time (monotonic) after which the queries to the api fail, or None if there is no deadline
+    :rtype: float|None
+    """
+    return _deadline.get()
+
+
+def get_remaining():
+    """
+    return the number of seconds left before the deadline, or None if there is no deadline
+    :rtype: float|None
+    """
+    end = _deadline.get()
+    if end is None:
+        return None
+    return end - time.monotonic()
+
+
+def check_deadline(delay=0):
+    """
+    raise DeadlineExceeded if the deadline is passed, or will be after the given delay
+    :param float delay: the time which will be waited before the next query
+    """
+    remaining = get_remaining()
+    if remaining is not None and remaining <= delay:
+        raise DeadlineExceeded("the deadline of the queries to the api is passed by %.3fs" % (delay - remaining))
+
+
+def shrink_timeout(timeout):
+    """
+    shrink the timeout of a query to the time left before the deadline
+    :param float|tuple[float, float]|None timeout: the timeout, or the tuple (connect timeout, read timeout)
+    :return: the timeout to use for the query
+    :raise DeadlineExceeded: if the deadline is passed
+    """
+    remaining = get_remaining()
+    if remaining is None:
+        return timeout
+    check_deadline()
+    if isinstance(timeout, (tuple, list)):
+        return tuple(remaining if value is None else min(value, remaining) for value in timeout)
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+class DeadlineMiddleware(object):
+    """
+    a django middleware which give a time budget to all the queries to the api made while handling each request.
+    the budget is given in seconds by the setting REST_API_DEADLINE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.budget = getattr(settings, 'REST_API_DEADLINE', None)
+
+    def __call__(self, request):
+        if not self.budget:
+            return self.get_response(request)
+        with deadline(self.budget):
+            return self.get_response(request)
@@ -0,0 +1,247 @@
+import collections
+import contextvars
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_hedge = contextvars.ContextVar('rest_models_hedge', default=False)
+
+
+def is_hedge():
+    """
+    return True if the current query is a hedge: the copy of a slow query sent to get a faster response.
+    the hedges must not be coalesced with the query they duplicate.
+    :rtype: bool
+    """
+    return _hedge.get()
+
+
+class HedgedCall(object):
+    """
+    a query sent once, and once more if the first try is too slow. the first response received is used, and the
+    other one is closed when it arrives.
+    """
+
+    def __init__(self, hedger, func, connection):
+        """
+        :param Hedger hedger: the hedger which record the latency of the tries
+        :param func: the function which make the query and return its response
+        :param rest_models.backend.base.DatabaseWrapper connection: the connection used by the tries
+        """
+        self.hedger = hedger
+        self.func = func
+        self.connection = connection
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+        self.done = False
+
+    def start(self, hedge=False):
+        """
+        send a try in a background thread
+        :param bool hedge: True if the try is the hedge of the first one
+        """
+        # the thread will use the connection of the current thread
+        self.connection.inc_thread_sharing()
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(self.run, hedge),
+                                  name='rest_models-hedge', daemon=True)
+        thread.start()
+
+    def run(self, hedge):
+        _hedge.set(hedge)
+        start = time.perf_counter()
+        try:
+            response = self.func()
+        except BaseException as e:
+            self.results.put((hedge, None, e))
+            return
+        finally:
+            self.connection.dec_thread_sharing()
+        self.hedger.observe(time.perf_counter() - start)
+        with self.lock:
+            if not self.done:
+                self.results.put((hedge, response, None))
+                return
+        # the other try has won
+        close_response(response)
+
+    def get(self, timeout=None):
+        """
+        wait for the result of a try
+        :return: the try is the hedge, the response and the exception raised by the try
+        :raise queue.Empty: if no try has finished before the timeout
+        """
+        return self.results.get(timeout=timeout)
+
+    def finish(self):
+        """
+        stop waiting for the tries: the responses of the tries still in flight are closed
+        """
+        with self.lock:
+            self.done = True
+        while True:
+            try:
+                hedge, response, error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            if response is not None:
+                close_response(response)
+
+
+def close_response(response):
+    close = getattr(response, 'close', None)
+    if close is not None:
+        close()
+
+
+class Hedger(object):
+    """
+    send a second identical query when the first one is slower than most of the previous ones, and use the first
+    response received. this cut the tail latency caused by a slow node of the api, for a few more queries.
+
+    the delay before the hedge is the given percentile of the latencies of the last queries, and no more than
+    ``budget`` hedges are sent for each query, so a slow api is not flooded.
+    """
+
+    def __init__(self, name, percentile=95, min_delay=0.01, budget=0.1, window=100, min_samples=20):
+        """
+        :param str name: the name of the hedger (the alias of the database)
+        :param float percentile: the percentile of the latencies after which the hedge is sent
+        :param float min_delay: the min delay before sending the hedge, in seconds
+        :param float budget: the max ratio of hedges sent by query
+        :param int window: the number of latencies kept to compute the percentile
+        :param int min_samples: the number of latencies needed before sending hedges
+        """
+        self.name = name
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'hedged': 0,
+            'won': 0,
+        }
+
+    def observe(self, latency):
+        """
+        record the latency of a query
+        :param float latency: the time taken by the query, in seconds
+        """
+        with self._lock:
+            self.latencies.append(latency)
+
+    def get_delay(self):
+        """
+        return the time to wait for a response before sending the hedge, or None if there is not enough latencies
+        to compute it
+        :rtype: float|None
+        """
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100.))
+        return max(self.min_delay, latencies[index])
+
+    def take_budget(self):
+        """
+        count a hedge if the budget allow it
+        :return: False if too many hedges were sent
+        :rtype: bool
+        """
+        with self._lock:
+            if self.counters['hedged'] >= self.counters['requests'] * self.budget:
+                return False
+            self.counters['hedged'] += 1
+            return True
+
+    def request(self, func, connection):
+        """
+        make the query with func, and make it again if no response is received before the delay. the first
+        response received is returned.
+        :param func: the function which make the query and return its response. it must be idempotent
+        :param rest_models.backend.base.DatabaseWrapper connection: the connection used by func
+        :return: the response of the fastest try
+        """
+        with self._lock:
+            self.counters['requests'] += 1
+        delay = self.get_delay()
+        if delay is None:
+            start = time.perf_counter()
+            response = func()
+            self.observe(time.perf_counter() - start)
+            return response
+        call = HedgedCall(self, func, connection)
+        call.start()
+        try:
+            try:
+                hedge, response, error = call.get(timeout=delay)
+            except queue.Empty:
+                if not self.take_budget():
+                    hedge, response, error = call.get()
+                else:
+                    logger.debug("query slower than %.3fs: sending a hedge", delay)
+                    call.start(hedge=True)
+                    hedge, response, error = call.get()
+                    if error is not None:
+                        # the other try may still succeed
+                        hedge, response, error = call.get()
+            if error is not None:
+                raise error
+            if hedge:
+                with self._lock:
+                    self.counters['won'] += 1
+            return response
+        finally:
+            call.finish()
+
+    def reset(self):
+        with self._lock:
+            self.latencies.clear()
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def stats(self):
+        """
+        return the number of queries, of hedges sent and of hedges whose response was used
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self.counters)
+
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(name, percentile=95, min_delay=0.01, budget=0.1):
+    """
+    return the hedger for the given name, shared by all the threads, creating it if needed
+    :param str name: the name of the hedger (the alias of the database)
+    :param float percentile: the percentile of the latencies after which the hedge is sent
+    :param float min_delay: the min delay before sending the hedge, in seconds
+    :param float budget: the max ratio of hedges sent by query
+    :rtype: Hedger
+    """
+    with _hedgers_lock:
+        hedger = _hedgers.get(name)
+        if hedger is None:
+            hedger = _hedgers[name] = Hedger(name, percentile, min_delay, budget)
+        else:
+            hedger.percentile, hedger.min_delay, hedger.budget = percentile, min_delay, budget
+        return hedger
+
+
+def hedging_stats():
+    """
+    return the stats of all the hedgers, by name
+    :rtype: dict[str, dict[str, int]]
+    """
+    with _hedgers_lock:
+        hedgers = list(_hedgers.values())
+    return {hedger.name: hedger.stats() for hedger in hedgers}
@@ -0,0 +1,149 @@
+import json
+import logging
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BaseJsonCodec(object):
+    """
+    encode the bodies sent to the api and decode its responses.
+    a codec must implement loads and dumps.
+    """
+    name = None
+
+    def loads(self, data):
+        """
+        decode a json document
+        :param bytes|str data: the document
+        :raise json.JSONDecodeError: if the document is not valid
+        """
+        raise NotImplementedError()
+
+    def dumps(self, obj):
+        """
+        encode the object into a json document
+        :param obj: the data to encode
+        :rtype: bytes|None
+        :return: the encoded document, or None to let requests encode it
+        """
+        raise NotImplementedError()
+
+    def decode_response(self, response):
+        """
+        decode the content of a response from the api
+        :param requests.Response response: the response to decode
+        :raise json.JSONDecodeError: if the content is not valid json
+        """
+        content = getattr(response, 'content', None)
+        if content is None:
+            # the responses given by the middlewares (FakeApiResponse) are already decoded
+            return response.json()
+        if isinstance(content, bytes) and response.encoding not in (None, 'utf-8', 'UTF-8', 'utf8'):
+            content = content.decode(response.encoding)
+        return self.loads(content)
+
+    def encode_request(self, params):
+        """
+        encode the json body of a query with this codec
+        :param dict params: the params of the query, as given to requests.Session.request
+        :return: the params with the encoded body in data instead of json
+        :rtype: dict
+        """
+        if params.get('json') is None:
+            return params
+        body = self.dumps(params['json'])
+        if body is None:
+            return params
+        params = dict(params)
+        params['json'] = None
+        params['data'] = body
+        headers = dict(params.get('headers') or {})
+        headers.setdefault('Content-Type', 'application/json')
+        params['headers'] = headers
+        return params
+
+
+class JsonCodec(BaseJsonCodec):
+    """
+    the default codec, which use the json module of the standard library as requests does.
+    """
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return None
+
+    def decode_response(self, response):
+        return response.json()
+
+
+class OrjsonCodec(BaseJsonCodec):
+    """
+    the codec using orjson (https://github.com/ijl/orjson)
+    """
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        self.options = orjson.OPT_NON_STR_KEYS
+
+    def loads(self, data):
+        # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+        return self.orjson.loads(data)
+
+    def dumps(self, obj):
+        return self.orjson.dumps(obj, option=self.options)
+
+
+class MsgspecCodec(BaseJsonCodec):
+    """
+    the codec using msgspec (https://jcristharif.com/msgspec/)
+    """
+    name = 'msgspec'
+
+    def __init__(self):
+        import msgspec
+        self.msgspec = msgspec
+        self.decoder = msgspec.json.Decoder()
+        self.encoder = msgspec.json.Encoder()
+
+    def loads(self, data):
+        try:
+            return self.decoder.decode(data)
+        except self.msgspec.DecodeError as e:
+            raise json.JSONDecodeError(str(e), data if isinstance(data, str) else repr(data[:100]), 0)
+
+    def dumps(self, obj):
+        return self.encoder.encode(obj)
+
+
+CODECS = {
+    'json': JsonCodec,
+    'orjson': OrjsonCodec,
+    'msgspec': MsgspecCodec,
+}
+
+
+def get_json_codec(name=None):
+    """
+    return the codec for the JSON_CODEC option. if the library of the codec is not installed,
+    the json module of the standard library is used.
+    :param str|None name: json, orjson, msgspec, or the dotted path to a BaseJsonCodec subclass. None for json
+    :rtype: BaseJsonCodec
+    """
+    name = name or 'json'
+    try:
+        codec_class = CODECS[name] if name in CODECS else import_string(name)
+    except ImportError as e:
+        raise ImproperlyConfigured("the JSON_CODEC %s can't be imported: %s" % (name, e))
+    try:
+        return codec_class()
+    except ImportError as e:
+        logger.warning("the JSON_CODEC %s is not available (%s), fallback to json", name, e)
+        return JsonCodec()
@@ -0,0 +1,311 @@
+import bisect
+import threading
+import time
+
+from requests.exceptions import ConnectionError, Timeout
+
+from rest_models.backend.middlewares import ApiMiddleware
+from rest_models.backend.streaming import is_loaded
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+"""
+the upper bounds of the buckets of the latency histograms, in seconds
+"""
+
+
+class Histogram(object):
+    """
+    count the observed values in buckets, as the prometheus histograms.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        :param tuple[float] buckets: the sorted upper bounds of the buckets. the last bucket (+Inf) is added
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        return the number of values less or equal than each bound, the last one being +Inf
+        :rtype: list[tuple[float, int]]
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def as_dict(self):
+        return {
+            'buckets': self.cumulative_counts(),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+class RequestMetrics(object):
+    """
+    the metrics of the queries with the same alias, resource, verb and status class
+    """
+    __slots__ = ('count', 'bytes', 'latency')
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.latency = Histogram()
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'bytes': self.bytes,
+            'latency': self.latency.as_dict(),
+        }
+
+
+class MetricsRegistry(object):
+    """
+    the aggregated metrics of the queries made to the apis, shared by all the threads.
+
+    - requests: by (alias, resource, verb, status class), the number of queries, the bytes received and the
+      latency histogram. the queries which have raised an exception have the status class "error"
+    - errors: by (alias, resource, verb, exception class), the number of queries which have raised
+    - retries: by (alias, resource, verb), the number of queries made again after a failure to reach the api
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.errors = {}
+        self.retries = {}
+
+    def record_response(self, key, status_code, size, latency):
+        """
+        record a query which has received a response
+        :param tuple[str, str, str] key: the alias, resource and verb of the query
+        :param int status_code: the status code of the response
+        :param int size: the size of the body of the response, in bytes
+        :param float latency: the time taken by the query, in seconds
+        """
+        status_class = '%dxx' % (status_code // 100) if status_code else 'unknown'
+        self._record(key + (status_class,), size, latency)
+
+    def record_error(self, key, exception, latency):
+        """
+        record a query which has raised an exception
+        :param tuple[str, str, str] key: the alias, resource and verb of the query
+        :param Exception exception: the exception raised
+        :param float latency: the time taken by the query, in seconds
+        """
+        self._record(key + ('error',), 0, latency)
+        error_key = key + (type(exception).__name__,)
+        with self._lock:
+            self.errors[error_key] = self.errors.get(error_key, 0) + 1
+
+    def record_retry(self, key):
+        """
+        record a query made again after a failure
+        :param tuple[str, str, str] key: the alias, resource and verb of the query
+        """
+        with self._lock:
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    def _record(self, key, size, latency):
+        with self._lock:
+            metrics = self.requests.get(key)
+            if metrics is None:
+                metrics = self.requests[key] = RequestMetrics()
+            metrics.count += 1
+            metrics.bytes += size
+            metrics.latency.observe(latency)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+            self.errors.clear()
+            self.retries.clear()
+
+    def snapshot(self):
+        """
+        return a copy of the metrics, as lists of dicts with the labels and the values of each serie
+        :rtype: dict[str, list[dict]]
+        """
+        with self._lock:
+            return {
+                'requests': [
+                    dict(alias=alias, resource=resource, verb=verb, status=status, **metrics.as_dict())
+                    for (alias, resource, verb, status), metrics in sorted(self.requests.items())
+                ],
+                'errors': [
+                    {'alias': alias, 'resource': resource, 'verb': verb, 'exception': exception, 'count': count}
+                    for (alias, resource, verb, exception), count in sorted(self.errors.items())
+                ],
+                'retries': [
+                    {'alias': alias, 'resource': resource, 'verb': verb, 'count': count}
+                    for (alias, resource, verb), count in sorted(self.retries.items())
+                ],
+            }
+
+
+metrics_registry = MetricsRegistry()
+"""
+the registry used by the MetricsMiddleware
+"""
+
+
+def get_metrics():
+    """
+    return the metrics of all the queries made with the MetricsMiddleware.
+    see MetricsRegistry.snapshot
+    :rtype: dict[str, list[dict]]
+    """
+    return metrics_registry.snapshot()
+
+
+def format_labels(**labels):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels.items())
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def render_metrics(prefix='rest_models'):
+    """
+    render the metrics in the text format of prometheus, to be served by a metrics endpoint
+    :param str prefix: the prefix of the names of the metrics
+    :rtype: str
+    """
+    metrics = get_metrics()
+    lines = [
+        '# HELP %s_requests_total the queries made to the api' % prefix,
+        '# TYPE %s_requests_total counter' % prefix,
+    ]
+    for serie in metrics['requests']:
+        labels = format_labels(alias=serie['alias'], resource=serie['resource'], verb=serie['verb'],
+                               status=serie['status'])
+        lines.append('%s_requests_total{%s} %d' % (prefix, labels, serie['count']))
+    lines += [
+        '# HELP %s_response_bytes_total the bytes received from the api' % prefix,
+        '# TYPE %s_response_bytes_total counter' % prefix,
+    ]
+    for serie in metrics['requests']:
+        labels = format_labels(alias=serie['alias'], resource=serie['resource'], verb=serie['verb'],
+                               status=serie['status'])
+        lines.append('%s_response_bytes_total{%s} %d' % (prefix, labels, serie['bytes']))
+    lines += [
+        '# HELP %s_request_duration_seconds the latency of the queries made to the api' % prefix,
+        '# TYPE %s_request_duration_seconds histogram' % prefix,
+    ]
+    for serie in metrics['requests']:
+        labels = format_labels(alias=serie['alias'], resource=serie['resource'], verb=serie['verb'],
+                               status=serie['status'])
+        latency = serie['latency']
+        for bound, count in latency['buckets']:
+            lines.append('%s_request_duration_seconds_bucket{%s,le="%s"} %d' % (
+                prefix, labels, format_bound(bound), count))
+        lines.append('%s_request_duration_seconds_sum{%s} %r' % (prefix, labels, latency['sum']))
+        lines.append('%s_request_duration_seconds_count{%s} %d' % (prefix, labels, latency['count']))
+    lines += [
+        '# HELP %s_errors_total the queries to the api which have raised an exception' % prefix,
+        '# TYPE %s_errors_total counter' % prefix,
+    ]
+    for serie in metrics['errors']:
+        labels = format_labels(alias=serie['alias'], resource=serie['resource'], verb=serie['verb'],
+                               exception=serie['exception'])
+        lines.append('%s_errors_total{%s} %d' % (prefix, labels, serie['count']))
+    lines += [
+        '# HELP %s_retries_total the queries made again after a failure to reach the api' % prefix,
+        '# TYPE %s_retries_total counter' % prefix,
+    ]
+    for serie in metrics['retries']:
+        labels = format_labels(alias=serie['alias'], resource=serie['resource'], verb=serie['verb'])
+        lines.append('%s_retries_total{%s} %d' % (prefix, labels, serie['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def get_response_size(response):
+    """
+    return the size of the body of the response in bytes, without reading it if it is streamed
+    :rtype: int
+    """
+    if is_loaded(response):
+        return len(response.content or b'')
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return int(headers.get('Content-Length', 0))
+    except ValueError:
+        return 0
+
+
+class MetricsMiddleware(ApiMiddleware):
+    """
+    a middleware which aggregate the metrics of the queries to the api in the registry of rest_models.backend.metrics:
+    the number of queries, the latency, the bytes received, the errors and the retries, by database alias,
+    resource, verb and status class.
+
+    add it to the MIDDLEWARES of the database, and render the metrics with render_metrics() or get_metrics().
+    """
+
+    def __init__(self, registry=None):
+        """
+        :param MetricsRegistry registry: the registry to use. default to metrics_registry
+        """
+        self.registry = registry or metrics_registry
+        # the queries in flight, by request id: the start time and the key of the query
+        self.pending = {}
+        # the key of the last query which could not reach the api, to count it if it is retried
+        self.failed = threading.local()
+
+    def get_resource(self, url, connection):
+        """
+        return the resource queried by the url, which is the path relative to the api (see get_resource_path)
+        without the pk.
+        :param str url: the url of the query
+        :param ApiConnexion connection: the connection used for the query
+        :rtype: str
+        """
+        if url.startswith(connection.url):
+            url = url[len(connection.url):]
+        path = url.split('?', 1)[0]
+        resource = path.rstrip('/')
+        if path.endswith('/') and '/' in resource:
+            # the path of a resource with its pk (pizza/1/)
+            resource = resource.rsplit('/', 1)[0]
+        return resource
+
+    def process_request(self, params, requestid, connection):
+        backend = connection.backend
+        alias = backend.alias if backend is not None else connection.url
+        key = (alias, self.get_resource(params.get('url', ''), connection), params.get('method', '').upper())
+        if getattr(self.failed, 'key', None) == key:
+            self.registry.record_retry(key)
+        self.failed.key = None
+        self.pending[requestid] = (time.perf_counter(), key)
+
+    def process_response(self, params, response, requestid):
+        pending = self.pending.pop(requestid, None)
+        if pending is not None:
+            start, key = pending
+            self.registry.record_response(key, getattr(response, 'status_code', None), get_response_size(response),
+                                          time.perf_counter() - start)
+        return response
+
+    def process_exception(self, params, exception, requestid):
+        pending = self.pending.pop(requestid, None)
+        if pending is not None:
+            start, key = pending
+            self.registry.record_error(key, exception, time.perf_counter() - start)
+            if isinstance(exception, (Timeout, ConnectionError)):
+                # the connexion retry the queries which could not reach the api
+                self.failed.key = key
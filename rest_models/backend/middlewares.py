@@ -56,6 +56,17 @@ class ApiMiddleware(object):
         """
         return response
 
+    def process_exception(self, params, exception, requestid):
+        """
+        called when the query to the api has raised an exception (the api could not be reached, timeout, etc).
+        the exception is raised again once all the middlewares are called.
+
+        :param params: the params finaly given to query the api. same format as for process_request
+        :param Exception exception: the exception raised by the query
+        :param int requestid: the id of the current request done by this connection
+        """
+        return None
+
     @staticmethod
     def make_response(data, status_code):
         """
@@ -83,3 +94,80 @@ class ApiMiddleware(object):
         :return: a FakeApiResponse with the given data
         """
         return self.make_response(data=data, status_code=status_code or 200)
+
+
+def overrides(middleware, hook):
+    """
+    tell if the middleware implement the given hook, instead of inheriting the one of ApiMiddleware which do
+    nothing
+    :param middleware: the middleware
+    :param str hook: the name of the hook (process_request, process_response, process_exception)
+    :rtype: bool
+    """
+    method = getattr(middleware, hook, None)
+    if method is None:
+        return False
+    return getattr(method, '__func__', None) is not getattr(ApiMiddleware, hook)
+
+
+class MiddlewarePipeline(object):
+    """
+    the middlewares of a connexion, ordered by priority, with only the hooks they implement.
+    it is built again each time a middleware is pushed or popped.
+    """
+
+    def __init__(self, middlewares=()):
+        """
+        :param list[ApiMiddleware] middlewares: the middlewares, in the order of execution of process_request
+        """
+        self.middlewares = tuple(middlewares)
+        self.request_middlewares = tuple(
+            (i, middleware) for i, middleware in enumerate(self.middlewares)
+            if overrides(middleware, 'process_request')
+        )
+        # process_response is called in reverse order
+        self.response_middlewares = tuple(
+            (i, middleware) for i, middleware in reversed(list(enumerate(self.middlewares)))
+            if overrides(middleware, 'process_response')
+        )
+        self.exception_middlewares = tuple(
+            (i, middleware) for i, middleware in reversed(list(enumerate(self.middlewares)))
+            if overrides(middleware, 'process_exception')
+        )
+
+    def process_request(self, params, requestid, connection):
+        """
+        call process_request of the middlewares until one of them return a response
+        :return: the response given by a middleware or None, and the index of the last middleware called
+        :rtype: tuple[object, int]
+        """
+        for i, middleware in self.request_middlewares:
+            response = middleware.process_request(params, requestid, connection)
+            if response is not None:
+                return response, i
+        return None, len(self.middlewares) - 1
+
+    def process_response(self, params, response, requestid, last=None):
+        """
+        call process_response of the middlewares, from the last called by process_request to the first
+        :param int last: the index of the last middleware called by process_request
+        :return: the response
+        """
+        if last is None:
+            last = len(self.middlewares) - 1
+        for i, middleware in self.response_middlewares:
+            if i <= last:
+                response = middleware.process_response(params, response, requestid) or response
+        return response
+
+    def process_exception(self, params, exception, requestid, last=None):
+        """
+        call process_exception of the middlewares, from the last called by process_request to the first
+        :param Exception exception: the exception raised by the query
+        :param int last: the index of the last middleware called by process_request
+        """
+        if last is None:
+            last = len(self.middlewares) - 1
+        for i, middleware in self.exception_middlewares:
+            if i <= last:
+                middleware.process_exception(params, exception, requestid)
@@ -0,0 +1,162 @@
+import collections
+import threading
+
+from django.core.exceptions import EmptyResultSet
+
+
+def bind_filters(filters, lookups):
+    """
+    build the filter parameters from their template and the values of the lookups of a query
+    :param list[tuple[str, str]] filters: the GET parameter and the lookup name of each lookup
+    :param list[tuple[bool, bool, Lookup]] lookups: the lookups of the query, as given by
+        QueryParser.flaten_where_clause
+    :return: the dict to pass to params for requests to filter results
+    :rtype: dict[str, list]
+    :raise EmptyResultSet: if the filters can't match any row
+    """
+    res = {}
+    list_of_in = {}
+    for (key, lookup_name), (_, _, lookup) in zip(filters, lookups):
+        if isinstance(lookup.rhs, (tuple, list)):
+            res.setdefault(key, []).extend(lookup.rhs)
+            if lookup_name == 'in':
+                list_of_in[key] = list_of_in.get(key, 0) + len(lookup.rhs)
+        else:
+            if lookup_name == 'exact' and res.get(key, lookup.rhs) != lookup.rhs:
+                # a small performance that won't trigger any query if the
+                # queryset ask for differents exacts values
+                raise EmptyResultSet()
+            res.setdefault(key, []).append(lookup.rhs)
+    if not all(list_of_in.values()):
+        # if there is one «xxx.in=[]», me should not query the database
+        raise EmptyResultSet()
+    return res
+
+
+class QueryPlan(object):
+    """
+    the parameters compiled for a shape of query: the same queryset made with other values give the same plan.
+    the parts which don't depend on the values (the include/exclude and the sort) are kept as is, and the filters
+    are kept as a template which is bound to the values of each query.
+    """
+
+    def __init__(self, filters, include_exclude, sort, is_prefetch_related=False):
+        """
+        :param list[tuple[str, str]] filters: the template of the filters: the GET parameter and the lookup name of
+            each lookup of the where clause, in the order of QueryParser.flaten_where_clause
+        :param dict[str, set] include_exclude: the include[] and exclude[] parameters
+        :param dict[str, list] sort: the sort[] parameter
+        :param bool is_prefetch_related: True if the query is made for a prefetch_related
+        """
+        self.filters = filters
+        self.include_exclude = {key: frozenset(value) for key, value in include_exclude.items()}
+        self.sort = {key: tuple(value) for key, value in sort.items()}
+        self.is_prefetch_related = is_prefetch_related
+
+    def bind_filters(self, lookups):
+        """
+        build the filter parameters with the values of the lookups of a query
+        :param list[tuple[bool, bool, Lookup]] lookups: the lookups of the query, as given by
+            QueryParser.flaten_where_clause
+        :rtype: dict[str, list]
+        """
+        return bind_filters(self.filters, lookups)
+
+    def get_include_exclude(self):
+        return {key: set(value) for key, value in self.include_exclude.items()}
+
+    def get_sort(self):
+        return {key: list(value) for key, value in self.sort.items()}
+
+
+class QueryPlanCache(object):
+    """
+    the plans of the last shapes of queries compiled, shared by all the threads. the least recently used plans are
+    dropped once the cache is full.
+    """
+
+    def __init__(self, name, maxsize=256):
+        """
+        :param str name: the name of the cache (the alias of the database)
+        :param int maxsize: the max number of plans kept
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self.plans = collections.OrderedDict()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+        }
+
+    def get(self, shape):
+        """
+        return the plan of the given shape of query, or None if it was not compiled yet
+        :param tuple shape: the shape of the query
+        :rtype: QueryPlan|None
+        """
+        with self._lock:
+            plan = self.plans.get(shape)
+            if plan is None:
+                self.counters['misses'] += 1
+                return None
+            self.plans.move_to_end(shape)
+            self.counters['hits'] += 1
+            return plan
+
+    def put(self, shape, plan):
+        """
+        keep the plan of a shape of query
+        :param tuple shape: the shape of the query
+        :param QueryPlan plan: its plan
+        """
+        with self._lock:
+            self.plans[shape] = plan
+            self.plans.move_to_end(shape)
+            while len(self.plans) > self.maxsize:
+                self.plans.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.plans.clear()
+            self.counters = dict.fromkeys(self.counters, 0)
+
+    def stats(self):
+        """
+        return the number of plans kept, and the number of queries which found or not their plan
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats['size'] = len(self.plans)
+            return stats
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_query_plan_cache(name, maxsize=256):
+    """
+    return the QueryPlanCache for the given name, shared by all the threads, creating it if needed
+    :param str name: the name of the cache (the alias of the database)
+    :param int maxsize: the max number of plans kept
+    :rtype: QueryPlanCache
+    """
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = _caches[name] = QueryPlanCache(name, maxsize)
+        else:
+            cache.maxsize = maxsize
+        return cache
+
+
+def query_plan_cache_stats():
+    """
+    return the stats of all the QueryPlanCache, by name
+    :rtype: dict[str, dict[str, int]]
+    """
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.stats() for cache in caches}
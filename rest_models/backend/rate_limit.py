@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from rest_models.backend.deadline import check_deadline
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value):
+    """
+    parse the Retry-After header of a response
+    :param str|None value: the value of the header: a number of seconds or a http date
+    :return: the number of seconds to wait, or None if the header is missing or invalid
+    :rtype: float|None
+    """
+    if not value:
+        return None
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    return max(0., date.timestamp() - time.time())
+
+
+class RateLimiter(object):
+    """
+    a token bucket shared by all the connexions to the same api, which space the queries to stay under a rate.
+
+    the bucket hold up to ``burst`` tokens, refilled at ``rate`` tokens per second. each query take a token, and
+    wait for it if the bucket is empty. when the api ask to slow down (429 or 503 with Retry-After), all the queries
+    wait until the given delay is passed.
+    """
+
+    def __init__(self, name, rate=None, burst=None):
+        """
+        :param str name: the name of the limiter (the alias of the database)
+        :param float rate: the max number of queries per second. None to not limit the rate
+        :param int burst: the number of queries which can be made at once. default to the rate
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self.configure(rate, burst)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.
+        self.counters = {
+            'acquired': 0,
+            'delayed': 0,
+            'throttled': 0,
+        }
+
+    def configure(self, rate=None, burst=None):
+        self.rate = rate or None
+        self.burst = burst or max(1, int(rate or 1))
+
+    def reserve(self):
+        """
+        take a token, and return the time to wait before making the query
+        :rtype: float
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.
+            if self.rate is not None:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    # the token is borrowed from the future: wait until it is refilled
+                    wait = -self.tokens / self.rate
+            wait = max(wait, self.paused_until - now)
+            self.counters['acquired'] += 1
+            if wait > 0:
+                self.counters['delayed'] += 1
+            return wait
+
+    def acquire(self):
+        """
+        wait for a token
+        :return: the time waited
+        :rtype: float
+        :raise DeadlineExceeded: if the wait would end after the deadline of the current request
+        """
+        wait = self.reserve()
+        if wait > 0:
+            check_deadline(wait)
+            time.sleep(wait)
+        return wait
+
+    def pause(self, delay):
+        """
+        stop all the queries for the given delay, as asked by the api
+        :param float delay: the number of seconds to wait
+        """
+        with self._lock:
+            self.counters['throttled'] += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        logger.info("rate limiter %s paused for %.3fs by the api", self.name, delay)
+
+    def reset(self):
+        with self._lock:
+            self.tokens = self.burst
+            self.updated_at = time.monotonic()
+            self.paused_until = 0.
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def stats(self):
+        """
+        return the configuration of the limiter and its counters
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats['rate'] = self.rate
+            stats['burst'] = self.burst
+            return stats
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, rate=None, burst=None):
+    """
+    return the rate limiter for the given name, creating it if needed. the limiters are shared by all the
+    threads, since each of them has its own connexion to the database.
+    :param str name: the name of the limiter (the alias of the database)
+    :param float rate: the max number of queries per second. None to not limit the rate
+    :param int burst: the number of queries which can be made at once
+    :rtype: RateLimiter
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = _limiters[name] = RateLimiter(name, rate, burst)
+        else:
+            with limiter._lock:
+                limiter.configure(rate, burst)
+        return limiter
+
+
+def rate_limiters_stats():
+    """
+    return the stats of all the rate limiters, by name
+    :rtype: dict[str, dict]
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
@@ -0,0 +1,155 @@
+import json
+import threading
+from urllib.parse import parse_qsl
+
+from requests.exceptions import Timeout
+from requests.models import RequestEncodingMixin
+
+from rest_models.backend.deadline import check_deadline, get_remaining
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_request_key(params):
+    """
+    return the key which identify a query, or None if the query can't be shared with others.
+    only the idempotent queries, without body and which are not streamed, can be shared. the timeout is not part of
+    the key: it is shrunk by the deadline of each request, and the timeout of the first query applies to all.
+    :param dict params: the params of the query, as given to requests.Session.request
+    :rtype: tuple|None
+    """
+    method = params.get('method', '').upper()
+    if method not in IDEMPOTENT_METHODS or params.get('stream') or params.get('files') or params.get('data'):
+        return None
+    query = params.get('params')
+    if isinstance(query, (str, bytes)):
+        query = parse_qsl(query.decode() if isinstance(query, bytes) else query, keep_blank_values=True)
+    # the order of the GET parameters does not change the result
+    query = tuple(sorted(parse_qsl(RequestEncodingMixin._encode_params(query or {}), keep_blank_values=True)))
+    body = params.get('json')
+    return (
+        method,
+        params.get('url'),
+        query,
+        tuple(sorted((params.get('headers') or {}).items())),
+        None if body is None else json.dumps(body, sort_keys=True, default=str),
+        repr(params.get('auth')),
+    )
+
+
+def get_wait_timeout(timeout):
+    """
+    return the max time a query can wait for the identical query in flight: its own timeout, shrunk to the time
+    left before the deadline of the current request
+    :param float|tuple[float, float]|None timeout: the timeout, or the tuple (connect timeout, read timeout)
+    :rtype: float|None
+    """
+    if isinstance(timeout, (tuple, list)):
+        timeout = None if None in timeout else sum(timeout)
+    remaining = get_remaining()
+    if remaining is not None:
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return timeout
+
+
+class Call(object):
+    """
+    a query in flight, whose result is shared with the threads waiting for it
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    coalesce the identical queries made at the same time by many threads into one: the first thread make the
+    query, and the others wait for its response instead of querying the api.
+    """
+
+    def __init__(self, name):
+        """
+        :param str name: the name of the group of queries (the alias of the database)
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.counters = {
+            'requests': 0,
+            'saved': 0,
+        }
+
+    def do(self, key, func, timeout=None):
+        """
+        call func, or wait for the result of the pending call with the same key
+        :param tuple key: the key of the query
+        :param func: the function which make the query
+        :param float|None timeout: the max time to wait for the pending call, None to wait until it ends
+        :return: the result of func
+        :raise DeadlineExceeded: if the deadline is passed while waiting for the pending call
+        :raise Timeout: if the pending call did not end in time
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                self.counters['requests'] += 1
+                call = self._calls[key] = Call()
+                leader = True
+            else:
+                self.counters['saved'] += 1
+                leader = False
+        if not leader:
+            if not call.done.wait(timeout):
+                # the pending call is slower than this query can wait
+                check_deadline()
+                raise Timeout("the identical query in flight did not end in %.3fs" % timeout)
+            if call.error is not None:
+                raise call.error
+            return call.response
+        try:
+            call.response = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.response
+
+    def stats(self):
+        """
+        return the number of queries made to the api, and the number of queries which shared their response
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self.counters)
+
+
+_single_flights = {}
+_single_flights_lock = threading.Lock()
+
+
+def get_single_flight(name):
+    """
+    return the SingleFlight for the given name, shared by all the threads, creating it if needed
+    :param str name: the name of the group of queries (the alias of the database)
+    :rtype: SingleFlight
+    """
+    with _single_flights_lock:
+        single_flight = _single_flights.get(name)
+        if single_flight is None:
+            single_flight = _single_flights[name] = SingleFlight(name)
+        return single_flight
+
+
+def single_flight_stats():
+    """
+    return the stats of all the SingleFlight, by name
+    :rtype: dict[str, dict[str, int]]
+    """
+    with _single_flights_lock:
+        single_flights = list(_single_flights.values())
+    return {single_flight.name: single_flight.stats() for single_flight in single_flights}
@@ -0,0 +1,221 @@
+import codecs
+import json
+from json import JSONDecodeError
+
+CHUNK_SIZE = 64 * 1024
+"""
+the size of the chunks read from the body of a streamed response
+"""
+
+WHITESPACES = ' \t\n\r'
+
+
+def is_loaded(response):
+    """
+    tell if the body of the response was already read
+    :param requests.Response response: the response
+    :rtype: bool
+    """
+    return getattr(response, '_content', False) is not False
+
+
+def iter_response_chunks(response, chunk_size=CHUNK_SIZE):
+    """
+    iterate over the body of the response by chunks of bytes, without loading it all if the response is streamed
+    :param requests.Response response: the response
+    :param int chunk_size: the size of the chunks
+    :rtype: Iterable[bytes]
+    """
+    if is_loaded(response):
+        # the content was already read (local api or not a streamed response)
+        content = response.content or b''
+        for i in range(0, len(content), chunk_size):
+            yield content[i:i + chunk_size]
+    else:
+        for chunk in response.iter_content(chunk_size):
+            yield chunk
+
+
+class JsonStream(object):
+    """
+    an incremental parser for a json document given by chunks. it read the structure of the containers
+    (the top level object and its arrays) itself and decode each value with the json module, so only the values
+    asked for are kept in memory.
+    """
+
+    def __init__(self, chunks, chunk_size=CHUNK_SIZE):
+        """
+        :param Iterable[bytes] chunks: the chunks of the document, encoded in utf-8
+        :param int chunk_size: the min number of characters to read when a value is not complete
+        """
+        self.chunks = iter(chunks)
+        self.chunk_size = chunk_size
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, min_size=1):
+        """
+        read at least min_size more characters from the chunks into the buffer
+        :return: False if the document is complete
+        """
+        if self.eof:
+            return False
+        read = []
+        size = 0
+        for chunk in self.chunks:
+            text = self.text_decoder.decode(chunk)
+            read.append(text)
+            size += len(text)
+            if size >= min_size:
+                break
+        else:
+            read.append(self.text_decoder.decode(b'', final=True))
+            self.eof = True
+        # drop the parsed part of the buffer
+        self.buffer = self.buffer[self.pos:] + ''.join(read)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        return the next character which is not a whitespace, without consuming it.
+        :raise JSONDecodeError: if the document is complete
+        """
+        while True:
+            buffer, pos = self.buffer, self.pos
+            while pos < len(buffer) and buffer[pos] in WHITESPACES:
+                pos += 1
+            self.pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self.fill():
+                raise JSONDecodeError("Unexpected end of document", self.buffer, self.pos)
+
+    def expect(self, chars):
+        """
+        consume the next character, which must be one of chars
+        :return: the consumed character
+        """
+        char = self.peek()
+        if char not in chars:
+            raise JSONDecodeError("Expecting one of %r" % chars, self.buffer, self.pos)
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        decode the next value of the document
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except JSONDecodeError:
+                # the value is not complete in the buffer. read as much as we already have to stay linear
+                if not self.fill(max(self.chunk_size, len(self.buffer) - self.pos)):
+                    raise
+                continue
+            if end == len(self.buffer) and self.fill():
+                continue  # a number or a literal may be truncated
+            self.pos = end
+            return obj
+
+    def iter_array(self):
+        """
+        decode the next value, which must be an array, and yield its items one by one
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+    def skip(self):
+        """
+        skip the next value. the arrays are skipped item by item to not load them in memory.
+        """
+        if self.peek() == '[':
+            for _ in self.iter_array():
+                pass
+        else:
+            self.value()
+
+    def iter_keys(self):
+        """
+        decode the next value, which must be an object, and yield its keys one by one. the value of each key
+        must be consumed by the caller (via value, iter_array or skip) before the next key is read.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+class StreamedPage(object):
+    """
+    a page of results from the api, parsed while its body is received.
+
+    the rows of the main resource are yielded as soon as they are parsed, while the other keys of the response
+    are stored in data. the rows are yielded only once the required keys (the sideloaded resources used for the
+    joins) are loaded: if they come after the rows in the response, the rows are buffered.
+    the keys which are neither the main resource nor wanted are skipped.
+    """
+
+    def __init__(self, response, resource_name, required=(), wanted=(), chunk_size=CHUNK_SIZE):
+        """
+        :param requests.Response response: the streamed response
+        :param str resource_name: the key of the rows of the main resource
+        :param Iterable[str] required: the keys to load before the rows can be given
+        :param Iterable[str] wanted: the other keys to load. any other key is skipped
+        :param int chunk_size: the size of the chunks read from the response
+        """
+        self.response = response
+        self.resource_name = resource_name
+        self.required = set(required)
+        self.wanted = self.required | set(wanted)
+        self.loaded = is_loaded(response)
+        self.stream = JsonStream(iter_response_chunks(response, chunk_size), chunk_size)
+        self.data = {}
+
+    def rows(self):
+        """
+        iterate over the rows of the main resource. the whole response is parsed once the iteration is complete.
+        :raise KeyError: if the response has no rows for the main resource
+        """
+        stream = self.stream
+        found = False
+        try:
+            for key in stream.iter_keys():
+                if key == self.resource_name:
+                    found = True
+                    if self.required.issubset(self.data):
+                        for row in stream.iter_array():
+                            yield row
+                    else:
+                        # a required key may come later: the rows must wait for it
+                        self.data[key] = list(stream.iter_array())
+                elif key in self.wanted:
+                    self.data[key] = stream.value()
+                else:
+                    stream.skip()
+            if self.resource_name in self.data:
+                for row in self.data[self.resource_name]:
+                    yield row
+        finally:
+            if not self.loaded:
+                # release the connection if the body was not read completly
+                self.response.close()
+        if not found:
+            raise KeyError(self.resource_name)
@@ -0,0 +1,197 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('middlewares', 'connect', 'ttfb', 'download', 'decode', 'hydration')
+"""
+the phases of a query to the api:
+
+- middlewares: the time spent in the ApiMiddleware (process_request and process_response)
+- connect: the time to get a connection from the pool, and to open it if needed
+- ttfb: the time between the sending of the query and the reception of the headers of the response
+- download: the time to read the body of the response
+- decode: the time to decode the json of the response
+- hydration: the time to build the rows of the query from the data of the response
+"""
+
+
+class QueryTimings(object):
+    """
+    the time spent in each phase of one query to the api, in seconds
+    """
+    __slots__ = ('method', 'url', 'phases')
+
+    def __init__(self, method=None, url=None):
+        """
+        :param str method: the http verb of the query
+        :param str url: the url of the query
+        """
+        self.method = method
+        self.url = url
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        """
+        add the given time to a phase of the query
+        :param str phase: the name of the phase (see PHASES)
+        :param float seconds: the time spent
+        """
+        self.phases[phase] = self.phases.get(phase, 0.) + seconds
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        """
+        return the timings as a dict with the method, the url and the time of each phase
+        :rtype: dict
+        """
+        result = {'method': self.method, 'url': self.url}
+        result.update(self.phases)
+        return result
+
+    def __repr__(self):
+        return '<QueryTimings %s %s %s>' % (self.method, self.url, ' '.join(
+            '%s=%.3fms' % (phase, seconds * 1000) for phase, seconds in self.phases.items()
+        ))
+
+
+class TimingsCollector(object):
+    """
+    collect the timings of all the queries made while it is active (see collect_timings).
+    the queries made by the threads started by the compilers (PARALLEL_PAGES, PREFETCH_PAGES) are collected too.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def record(self, timings):
+        """
+        add the timings of a query to the collector
+        :param QueryTimings timings: the timings of the query
+        """
+        with self._lock:
+            self.queries.append(timings)
+
+    def totals(self):
+        """
+        return the time spent in each phase by all the queries
+        :rtype: dict[str, float]
+        """
+        totals = dict.fromkeys(PHASES, 0.)
+        with self._lock:
+            for timings in self.queries:
+                for phase, seconds in timings.phases.items():
+                    totals[phase] = totals.get(phase, 0.) + seconds
+        return totals
+
+    def as_list(self):
+        """
+        return the timings of each query, as dicts
+        :rtype: list[dict]
+        """
+        with self._lock:
+            return [timings.as_dict() for timings in self.queries]
+
+
+_collector = contextvars.ContextVar('rest_models_timings_collector', default=None)
+_current_query = contextvars.ContextVar('rest_models_query_timings', default=None)
+
+
+def get_collector():
+    """
+    return the active collector, or None if the timings are not collected
+    :rtype: TimingsCollector|None
+    """
+    return _collector.get()
+
+
+def get_query_timings():
+    """
+    return the timings of the query being made, or None
+    :rtype: QueryTimings|None
+    """
+    return _current_query.get()
+
+
+@contextmanager
+def collect_timings(collector=None):
+    """
+    collect the timings of the queries made in the block. at the end, the time spent in each phase is logged
+    at the debug level, with the timings of each query in the extra `api_timings`.
+
+        with collect_timings() as collector:
+            list(Pizza.objects.all())
+        collector.totals()
+
+    :param TimingsCollector collector: the collector to use. a new one is created if not given
+    :rtype: TimingsCollector
+    """
+    collector = collector or TimingsCollector()
+    token = _collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _collector.reset(token)
+        if collector.queries and logger.isEnabledFor(logging.DEBUG):
+            totals = collector.totals()
+            logger.debug('%d api queries: %s', len(collector.queries),
+                         ', '.join('%s=%.3f' % (phase, seconds) for phase, seconds in totals.items()),
+                         extra={'api_timings': collector.as_list(), 'api_timings_totals': totals})
+
+
+@contextmanager
+def measure_query(method, url):
+    """
+    measure a query to the api: the timings of the phases made in the block are added to the query.
+    :param str method: the http verb of the query
+    :param str url: the url of the query
+    :rtype: QueryTimings
+    """
+    timings = QueryTimings(method, url)
+    token = _current_query.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_query.reset(token)
+        collector = _collector.get()
+        if collector is not None:
+            collector.record(timings)
+
+
+@contextmanager
+def measure_phase(phase):
+    """
+    add the time spent in the block to the given phase of the query being made, if any
+    :param str phase: the name of the phase (see PHASES)
+    """
+    timings = _current_query.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start)
+
+
+class TimingsMiddleware(object):
+    """
+    a django middleware which collect the timings of the queries to the api made while handling each request.
+    the collector is given in request.api_timings.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect_timings() as collector:
+            request.api_timings = collector
+            return self.get_response(request)
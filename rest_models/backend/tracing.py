@@ -0,0 +1,323 @@
+import asyncio
+import collections.abc
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from requests.models import RequestEncodingMixin
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('rest_models_span', default=None)
+
+
+class Span(object):
+    """
+    an operation traced by rest_models: a query of the ORM, or a query made to the api.
+    the spans of the queries to the api are the children of the span of the ORM query which made them.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        """
+        :param str name: the name of the operation
+        :param Span parent: the span of the operation which started this one
+        :param dict attributes: the attributes of the operation
+        """
+        self.name = name
+        self.parent = parent
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.trace_id = parent.trace_id if parent is not None else '%032x' % random.getrandbits(128)
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.end = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def parent_id(self):
+        return self.parent.span_id if self.parent is not None else None
+
+    @property
+    def duration(self):
+        """
+        the duration of the span in seconds, or None if it is not finished
+        :rtype: float|None
+        """
+        return None if self.end is None else self.end - self.start
+
+    def set_attribute(self, name, value):
+        self.attributes[name] = value
+
+    def increment(self, name, value=1):
+        """
+        increment an attribute of the span. the children of a span can be in other threads
+        """
+        with self._lock:
+            self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def finish(self, exception=None):
+        """
+        end the span
+        :param Exception exception: the exception which has interrupted the operation, if any
+        """
+        if exception is not None:
+            self.attributes['error'] = '%s: %s' % (type(exception).__name__, exception)
+        self.end = self.start + time.perf_counter() - self._start
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'end': self.end,
+            'attributes': dict(self.attributes),
+        }
+
+    def __repr__(self):
+        return '<Span %s %s>' % (self.name, self.attributes)
+
+
+class BaseSpanExporter(object):
+    """
+    receive the spans once they are finished. an exporter is shared by all the threads.
+    """
+
+    def export(self, span):
+        """
+        called when a span is finished
+        :param Span span: the finished span
+        """
+        raise NotImplementedError()
+
+
+class InMemorySpanExporter(BaseSpanExporter):
+    """
+    keep the finished spans in memory, for the tests
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def get_finished_spans(self):
+        """
+        :rtype: list[Span]
+        """
+        with self._lock:
+            return list(self.spans)
+
+    def clear(self):
+        with self._lock:
+            del self.spans[:]
+
+
+class LoggingSpanExporter(BaseSpanExporter):
+    """
+    log the finished spans at the debug level, with the span in the extra `span`
+    """
+
+    def export(self, span):
+        logger.debug('span %s (%.3f): %s', span.name, span.duration, span.attributes, extra={'span': span.as_dict()})
+
+
+class Tracer(object):
+    """
+    create the spans of a database, and give them to its exporter
+    """
+
+    def __init__(self, exporter):
+        """
+        :param BaseSpanExporter exporter: the exporter of the finished spans
+        """
+        self.exporter = exporter
+
+    def start_span(self, name, **attributes):
+        """
+        start a span, child of the current one
+        :param str name: the name of the span
+        :rtype: Span
+        """
+        return Span(name, _current_span.get(), attributes)
+
+    def finish_span(self, span, exception=None):
+        span.finish(exception)
+        try:
+            self.exporter.export(span)
+        except Exception:
+            logger.exception('error while exporting the span %s', span)
+
+    def iterate_in_span(self, span, iterator):
+        """
+        iterate over the iterator with the span as the current one, and finish it once the iteration is complete
+        or interrupted: the pages fetched while the results are read are in the span of the query.
+        """
+        try:
+            while True:
+                token = _current_span.set(span)
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    _current_span.reset(token)
+                yield item
+        except GeneratorExit:
+            # the iteration was interrupted by the consumer
+            self.finish_span(span)
+            raise
+        except BaseException as e:
+            self.finish_span(span, e)
+            raise
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+        self.finish_span(span)
+
+
+def get_current_span():
+    """
+    return the span of the operation being made, or None
+    :rtype: Span|None
+    """
+    return _current_span.get()
+
+
+@contextmanager
+def trace_request(tracer, method, url, params=None):
+    """
+    trace a query to the api in a span, child of the span of the ORM query which made it.
+    :param Tracer|None tracer: the tracer of the database. nothing is traced if None
+    :param str method: the http verb
+    :param str url: the url of the query
+    :param params: the GET parameters of the query
+    :return: the span of the query, or None if it is not traced
+    :rtype: Span|None
+    """
+    if tracer is None:
+        yield None
+        return
+    span = tracer.start_span('rest_models.request', method=method.upper(), url=url,
+                             params_size=len(RequestEncodingMixin._encode_params(params)) if params else 0,
+                             retries=0)
+    if span.parent is not None:
+        span.parent.increment('requests')
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        _current_span.reset(token)
+        tracer.finish_span(span, e)
+        raise
+    _current_span.reset(token)
+    tracer.finish_span(span)
+
+
+_exporters = {}
+_exporters_lock = threading.Lock()
+
+
+def get_span_exporter(path):
+    """
+    return the exporter for the given class, shared by all the threads.
+    :param str path: the dotted path to a BaseSpanExporter subclass
+    :rtype: BaseSpanExporter
+    """
+    with _exporters_lock:
+        exporter = _exporters.get(path)
+        if exporter is None:
+            try:
+                exporter = _exporters[path] = import_string(path)()
+            except ImportError as e:
+                raise ImproperlyConfigured("the TRACING_EXPORTER %s can't be imported: %s" % (path, e))
+        return exporter
+
+
+def get_tracer(path):
+    """
+    return the tracer for the TRACING_EXPORTER option, or None if the tracing is disabled
+    :param str|None path: the dotted path to the exporter class
+    :rtype: Tracer|None
+    """
+    if not path:
+        return None
+    return Tracer(get_span_exporter(path))
+
+
+def traced_execute(operation):
+    """
+    decorate the execute_sql of a compiler to trace it in a span with the model, the number of queries made
+    to the api (requests) and the number of pages of results read (pages).
+    if execute_sql return an iterator, the span end once the iteration is complete.
+    :param str operation: the kind of query (select, insert, update, delete, aggregate)
+    """
+    def decorator(execute_sql):
+        if asyncio.iscoroutinefunction(execute_sql):
+            @functools.wraps(execute_sql)
+            async def wrapper(compiler, *args, **kwargs):
+                tracer = compiler.connection.tracer
+                if tracer is None:
+                    return await execute_sql(compiler, *args, **kwargs)
+                span = start_query_span(tracer, compiler, operation)
+                token = _current_span.set(span)
+                try:
+                    result = await execute_sql(compiler, *args, **kwargs)
+                except BaseException as e:
+                    tracer.finish_span(span, e)
+                    raise
+                finally:
+                    _current_span.reset(token)
+                tracer.finish_span(span)
+                return result
+        else:
+            @functools.wraps(execute_sql)
+            def wrapper(compiler, *args, **kwargs):
+                tracer = compiler.connection.tracer
+                if tracer is None or getattr(compiler.query, 'api_results', None) is not None:
+                    # not traced, or the results were already fetched by the traced aexecute_sql
+                    return execute_sql(compiler, *args, **kwargs)
+                span = start_query_span(tracer, compiler, operation)
+                token = _current_span.set(span)
+                try:
+                    result = execute_sql(compiler, *args, **kwargs)
+                except BaseException as e:
+                    tracer.finish_span(span, e)
+                    raise
+                finally:
+                    _current_span.reset(token)
+                if isinstance(result, collections.abc.Iterator):
+                    return tracer.iterate_in_span(span, result)
+                tracer.finish_span(span)
+                return result
+        return wrapper
+    return decorator
+
+
+def start_query_span(tracer, compiler, operation):
+    """
+    start the span of a query of the ORM
+    :rtype: Span
+    """
+    return tracer.start_span('rest_models.%s' % operation, model=compiler.query.model._meta.label,
+                             alias=compiler.connection.alias, requests=0, pages=0)
+
+
+def add_page():
+    """
+    count a page of results read by the current query
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.increment('pages')
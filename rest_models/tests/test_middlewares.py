@@ -5,7 +5,8 @@ from django.db.utils import ConnectionHandler
 from django.test.testcases import TestCase
 
 from rest_models.backend.connexion import ApiConnexion
-from rest_models.backend.middlewares import ApiMiddleware, FakeApiResponse
+from rest_models.backend.exceptions import FakeDatabaseDbAPI2
+from rest_models.backend.middlewares import ApiMiddleware, FakeApiResponse, MiddlewarePipeline
 from rest_models.test import MockDataApiMiddleware
 
 
@@ -142,6 +143,90 @@ class TestMiddleware(TestCase):
         self.assertEqual(self.ch['empty'].cursor().get('').status_code, 204)
 
 
+class OrderMiddleware(ApiMiddleware):
+    """
+    record the order in which the hooks of the middlewares are called
+    """
+
+    def __init__(self, name, calls, response=None):
+        self.name = name
+        self.calls = calls
+        self.response = response
+
+    def process_request(self, params, requestid, connection):
+        self.calls.append(('request', self.name))
+        return self.response
+
+    def process_response(self, params, response, requestid):
+        self.calls.append(('response', self.name))
+        return response
+
+    def process_exception(self, params, exception, requestid):
+        self.calls.append(('exception', self.name))
+
+
+class RequestOnlyMiddleware(ApiMiddleware):
+    def process_request(self, params, requestid, connection):
+        pass
+
+
+class TestMiddlewarePipeline(TestCase):
+
+    def test_skip_inherited_hooks(self):
+        dummy, request_only, store = DummyMiddleware(), RequestOnlyMiddleware(), StoreMiddleware()
+        pipeline = MiddlewarePipeline([dummy, request_only, store])
+        self.assertEqual(pipeline.middlewares, (dummy, request_only, store))
+        self.assertEqual(pipeline.request_middlewares, ((1, request_only), (2, store)))
+        self.assertEqual(pipeline.response_middlewares, ((2, store),))
+        self.assertEqual(pipeline.exception_middlewares, ())
+
+    def test_order(self):
+        calls = []
+        cnx = ApiConnexion(url='http://localapi/v2/')
+        cnx.push_middleware(OrderMiddleware('last', calls, response=FakeApiResponse({}, 200)), 9)
+        cnx.push_middleware(OrderMiddleware('first', calls), 1)
+        cnx.push_middleware(DummyMiddleware(), 5)
+        cnx.push_middleware(OrderMiddleware('second', calls), 5)
+        self.assertEqual(cnx.get('').status_code, 200)
+        self.assertEqual(calls, [
+            ('request', 'first'), ('request', 'second'), ('request', 'last'),
+            ('response', 'last'), ('response', 'second'), ('response', 'first'),
+        ])
+
+    def test_stop_on_response(self):
+        calls = []
+        cnx = ApiConnexion(url='http://localapi/v2/')
+        cnx.push_middleware(OrderMiddleware('after', calls), 9)
+        cnx.push_middleware(OrderMiddleware('mock', calls, response=FakeApiResponse({}, 200)), 5)
+        cnx.push_middleware(OrderMiddleware('before', calls), 1)
+        cnx.get('')
+        self.assertEqual(calls, [
+            ('request', 'before'), ('request', 'mock'), ('response', 'mock'), ('response', 'before'),
+        ])
+
+    def test_exception(self):
+        calls = []
+        cnx = ApiConnexion(url='http://127.0.0.1:7777/', retry=0)
+        cnx.push_middleware(OrderMiddleware('second', calls), 9)
+        cnx.push_middleware(OrderMiddleware('first', calls), 1)
+        self.assertRaises(FakeDatabaseDbAPI2.OperationalError, cnx.get, '')
+        self.assertEqual(calls, [
+            ('request', 'first'), ('request', 'second'), ('exception', 'second'), ('exception', 'first'),
+        ])
+
+    def test_compiled_on_change(self):
+        calls = []
+        cnx = ApiConnexion(url='http://localapi/v2/')
+        mock = OrderMiddleware('mock', calls, response=FakeApiResponse({}, 200))
+        cnx.push_middleware(mock)
+        pipeline = cnx.pipeline
+        cnx.get('')
+        self.assertIs(cnx.pipeline, pipeline)
+        cnx.pop_middleware(mock)
+        self.assertEqual(cnx.middlewares, [])
+        self.assertEqual(cnx.pipeline.request_middlewares, ())
+
+
 class TestFakeApiResponse(TestCase):
     def test_text_ok(self):
         r = FakeApiResponse({'name': 'darius'}, 200)
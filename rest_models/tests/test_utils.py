@@ -11,7 +11,7 @@ from django.test.testcases import TestCase
 import rest_models.utils
 from rest_models.backend.connexion import ApiConnexion
 from rest_models.test import MockDataApiMiddleware, PrintQueryMiddleware
-from rest_models.utils import JsonFixtures, Path
+from rest_models.utils import JsonFixtures, Path, SlicePlan, plan_slice
 
 
 def load_tests(loader, tests, ignore):
@@ -123,6 +123,29 @@ class TestLoadFixtures(TestCase):
                 pass
 
 
+class TestPlanSlice(TestCase):
+    def test_aligned(self):
+        self.assertEqual(plan_slice(20, 30), SlicePlan(per_page=10, first_page=3, last_page=3, skip=0))
+
+    def test_unaligned(self):
+        # one page with one more row is cheaper than two pages
+        plan = plan_slice(1001, 1011)
+        self.assertEqual(plan, SlicePlan(per_page=11, first_page=92, last_page=92, skip=0))
+        self.assertEqual((plan.first_page - 1) * plan.per_page, 1001)
+
+    def test_bigger_than_max_per_page(self):
+        self.assertEqual(plan_slice(0, 250, max_per_page=100),
+                         SlicePlan(per_page=84, first_page=1, last_page=3, skip=0))
+        # too many pages to compare the plans: pages of max_per_page rows
+        self.assertEqual(plan_slice(3, 1000, max_per_page=50),
+                         SlicePlan(per_page=50, first_page=1, last_page=20, skip=3))
+
+    def test_low_mark_zero(self):
+        self.assertEqual(plan_slice(0, 7), SlicePlan(per_page=7, first_page=1, last_page=1, skip=0))
+        self.assertEqual(plan_slice(0, 10, max_per_page=3), SlicePlan(per_page=3, first_page=1, last_page=4, skip=0))
+        self.assertEqual(plan_slice(0, None), SlicePlan(per_page=None, first_page=1, last_page=None, skip=0))
+
+
 class TestPrintQueryMiddleware(TestCase):
     def setUp(self):
         self.s = io.StringIO()
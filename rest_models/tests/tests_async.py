@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import asyncio
+from unittest import skipIf
+
+from django.db import connections
+from django.db.utils import ProgrammingError
+from django.test.testcases import LiveServerTestCase
+
+from rest_models.aio import aget, alist
+from rest_models.backend import async_connexion
+from rest_models.backend.async_connexion import AsyncApiConnexion
+from rest_models.backend.circuit_breaker import CircuitBreaker
+from rest_models.backend.connexion import ApiConnexion
+from rest_models.backend.exceptions import FakeDatabaseDbAPI2
+from rest_models.test import RestModelTestCase
+from rest_models.tests.tests_compilers import ConcurrencyTrackerMiddleware, pizza_page
+from testapp.models import Pizza
+
+
+@skipIf(async_connexion.httpx is None, 'httpx is not installed')
+class TestAsyncApiConnexion(LiveServerTestCase):
+    fixtures = ['data.json']
+
+    def get_connexion(self, **kwargs):
+        return AsyncApiConnexion(ApiConnexion(self.live_server_url + "/api/v2/", **kwargs))
+
+    def test_api_get(self):
+        r = asyncio.run(self.get_connexion().get("pizza/1/"))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()['pizza']['id'], 1)
+
+    def test_api_filter(self):
+        r = asyncio.run(self.get_connexion().get('pizza/', params={'filter{id}': '1', 'include[]': 'toppings.*'}))
+        data = r.json()
+        self.assertEqual(data['pizzas'][0]['id'], 1)
+        self.assertEqual(len(data['toppings']), len(data['pizzas'][0]['toppings']))
+
+    def test_api_concurrent(self):
+        c = self.get_connexion()
+
+        async def get_all():
+            return await asyncio.gather(*(c.get("pizza/%d/" % i) for i in (1, 2, 3)))
+
+        self.assertEqual([r.json()['pizza']['id'] for r in asyncio.run(get_all())], [1, 2, 3])
+
+    def test_api_timeout(self):
+        self.assertRaisesMessage(FakeDatabaseDbAPI2.OperationalError, 'tried 2 times',
+                                 asyncio.run, self.get_connexion(retry=1).get('wait', timeout=0.2))
+
+    def test_api_connectionerror(self):
+        c = AsyncApiConnexion(ApiConnexion("http://127.0.0.1:7777"))
+        self.assertRaisesMessage(FakeDatabaseDbAPI2.OperationalError, 'Is the API', asyncio.run, c.get(''))
+
+    def test_api_circuit_breaker(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=60)
+        c = AsyncApiConnexion(ApiConnexion("http://127.0.0.1:7777", retry=5, retry_backoff=0.01,
+                                           circuit_breaker=breaker))
+        self.assertRaisesMessage(FakeDatabaseDbAPI2.OperationalError, 'circuit breaker is open',
+                                 asyncio.run, c.get(''))
+        self.assertEqual(breaker.stats()['failures'], 2)
+
+    def test_auth_forbiden(self):
+        self.assertRaises(ProgrammingError, asyncio.run,
+                          self.get_connexion().patch('authpizza/1', json={'pizza': {'price': 0}}))
+
+    def test_auth_admin(self):
+        r = asyncio.run(self.get_connexion(auth=('admin', 'admin')).patch('authpizza/1', json={'pizza': {'price': 0}}))
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.json()['pizza']['price'], 0)
+
+
+@skipIf(async_connexion.httpx is None, 'httpx is not installed')
+class TestAsyncQuerySet(RestModelTestCase):
+    databases = ['default', 'api']
+
+    rest_fixtures = {
+        'pizza/1/': [
+            {'data': {'pizza': {'id': 1, 'name': 'pizza 1'}}},
+        ],
+        'pizza': [
+            {'filter': {'params': {'filter{name}': ['nothing']}}, 'status_code': 204, 'data': None},
+        ] + [
+            {'filter': {'params': {'page': i}}, 'data': pizza_page(i)} for i in range(2, 6)
+        ] + [
+            {'data': pizza_page(1)}
+        ]
+    }
+    database_rest_fixtures = {'api': rest_fixtures}
+
+    def tearDown(self):
+        connections['api'].settings_dict['OPTIONS'].pop('PARALLEL_PAGES', None)
+        super(TestAsyncQuerySet, self).tearDown()
+
+    def run_async(self, coroutine):
+        """
+        run the coroutine with the connexion of the test, which hold the mocked api.
+        the event loop don't see the same database wrapper than the test.
+        """
+        async_connection = connections['api'].get_async_connection()
+
+        async def run():
+            connections['api'].async_connection = async_connection
+            return await coroutine
+        return asyncio.run(run())
+
+    def test_alist(self):
+        with self.assertNumQueries(5, using='api'):
+            res = self.run_async(alist(Pizza.objects.all()))
+        self.assertEqual([p.id for p in res], list(range(1, 11)))
+        self.assertEqual(res[2].name, 'pizza 3')
+
+    def test_alist_values_list(self):
+        res = self.run_async(alist(Pizza.objects.values_list('id', flat=True)))
+        self.assertEqual(res, list(range(1, 11)))
+
+    def test_alist_parallel_pages(self):
+        connections['api'].settings_dict['OPTIONS']['PARALLEL_PAGES'] = 4
+        tracker = ConcurrencyTrackerMiddleware()
+        connections['api'].cursor().push_middleware(tracker, priority=1)
+        try:
+            res = self.run_async(alist(Pizza.objects.values_list('id', flat=True)))
+        finally:
+            connections['api'].cursor().pop_middleware(tracker)
+        self.assertEqual(res, list(range(1, 11)))
+
+    def test_alist_empty(self):
+        self.assertEqual(self.run_async(alist(Pizza.objects.filter(name='nothing'))), [])
+
+    def test_alist_count(self):
+        # special case made in a thread
+        res = self.run_async(alist(Pizza.objects.filter(pk=1).filter(pk=2)))
+        self.assertEqual(res, [])
+
+    def test_aget(self):
+        with self.assertNumQueries(1, using='api'):
+            p = self.run_async(aget(Pizza.objects.all(), pk=1))
+        self.assertEqual(p.name, 'pizza 1')
+
+    def test_aget_many(self):
+        self.assertRaises(Pizza.MultipleObjectsReturned, self.run_async, aget(Pizza.objects.all()))
+
+    def test_aget_none(self):
+        self.assertRaises(Pizza.DoesNotExist, self.run_async, aget(Pizza.objects.all(), name='nothing'))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.utils import ConnectionHandler
+from django.test.testcases import TestCase
+from requests.exceptions import ConnectionError
+
+from rest_models.backend.balancer import Endpoint, LoadBalancer, load_balancers_stats
+from rest_models.backend.connexion import ApiConnexion
+from rest_models.backend.middlewares import FakeApiResponse
+
+
+class FakeSession(object):
+    """
+    a session which record the urls queried, and fail for the given hosts
+    """
+
+    def __init__(self, down=()):
+        self.down = set(down)
+        self.urls = []
+
+    def request(self, method, url, **kwargs):
+        self.urls.append(url)
+        if url.split('/')[2] in self.down:
+            raise ConnectionError("api down")
+        return FakeApiResponse({}, 200)
+
+
+class TestEndpoint(TestCase):
+
+    def test_get_url(self):
+        endpoint = Endpoint('http://b:8000/api')
+        self.assertEqual(endpoint.url, 'http://b:8000/api/')
+        base = 'http://a/api/'
+        self.assertEqual(endpoint.get_url('http://a/api/pizza/1/', base), 'http://b:8000/api/pizza/1/')
+        self.assertEqual(endpoint.get_url('http://a/other/path', base), 'http://b:8000/other/path')
+        self.assertEqual(endpoint.get_url('http://c/api/pizza/', base), 'http://c/api/pizza/')
+
+
+class TestLoadBalancer(TestCase):
+
+    def test_least_outstanding(self):
+        balancer = LoadBalancer('test', ['http://a/', 'http://b/'])
+        first = balancer.acquire()
+        second = balancer.acquire()
+        self.assertNotEqual(first, second)
+        balancer.release(first, True, 0.1)
+        self.assertIs(balancer.acquire(), first)
+
+    def test_latency(self):
+        balancer = LoadBalancer('test', ['http://a/', 'http://b/'], strategy='latency')
+        a, b = balancer.endpoints
+        for endpoint, latency in ((a, 0.1), (b, 0.45)):
+            endpoint.outstanding += 1
+            balancer.release(endpoint, True, latency)
+        # the load of a is 0.1 by query in flight: it is chosen until it has 4 queries in flight
+        self.assertEqual([balancer.acquire() for _ in range(5)], [a, a, a, a, b])
+
+    def test_ejection(self):
+        balancer = LoadBalancer('test', ['http://a/', 'http://b/'], eject_failures=2, eject_time=30)
+        a, b = balancer.endpoints
+        for _ in range(2):
+            a.outstanding += 1
+            balancer.release(a, False)
+        self.assertFalse(balancer.stats()['http://a/']['healthy'])
+        self.assertEqual(balancer.stats()['http://a/']['ejected'], 1)
+        self.assertEqual([balancer.acquire() for _ in range(3)], [b, b, b])
+        with patch('rest_models.backend.balancer.time.monotonic', return_value=a.ejected_until + 1):
+            for _ in range(3):
+                balancer.release(b, True, 0.1)
+            # a is probed once, then not used until the probe succeed
+            self.assertIs(balancer.acquire(), a)
+            self.assertIs(balancer.acquire(), b)
+            balancer.release(a, True, 0.1)
+            self.assertTrue(balancer.stats()['http://a/']['healthy'])
+            self.assertIs(balancer.acquire(), a)
+
+    def test_all_ejected(self):
+        balancer = LoadBalancer('test', ['http://a/', 'http://b/'], eject_failures=1, eject_time=30)
+        a, b = balancer.endpoints
+        for endpoint in (b, a):
+            endpoint.outstanding += 1
+            balancer.release(endpoint, False)
+        # b will be back first
+        self.assertIs(balancer.acquire(), b)
+
+    def test_bad_config(self):
+        self.assertRaises(ImproperlyConfigured, LoadBalancer, 'test', [])
+        self.assertRaises(ImproperlyConfigured, LoadBalancer, 'test', ['http://a/'], strategy='random')
+
+
+class TestBalancedConnexion(TestCase):
+
+    def get_connexion(self, session, **kwargs):
+        balancer = LoadBalancer('test', ['http://a/api/', 'http://b/api/'], **kwargs)
+        c = ApiConnexion('http://api/api/', balancer=balancer, retry=3)
+        c.session = session
+        return c, balancer
+
+    def test_spread(self):
+        session = FakeSession()
+        c, balancer = self.get_connexion(session)
+        for _ in range(4):
+            c.get('pizza/')
+        self.assertEqual(sorted(session.urls), ['http://a/api/pizza/'] * 2 + ['http://b/api/pizza/'] * 2)
+        self.assertEqual(sorted(stats['requests'] for stats in balancer.stats().values()), [2, 2])
+
+    def test_retry_on_other_endpoint(self):
+        session = FakeSession(down=['a'])
+        c, balancer = self.get_connexion(session, eject_failures=1)
+        for _ in range(3):
+            self.assertEqual(c.get('pizza/').status_code, 200)
+        # a failed at most once, then was ejected
+        self.assertLessEqual(session.urls.count('http://a/api/pizza/'), 1)
+        self.assertEqual(session.urls.count('http://b/api/pizza/'), 3)
+
+    def test_database_options(self):
+        ch = ConnectionHandler({
+            'default': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://localapi/api/v2/',
+                'OPTIONS': {
+                    'ENDPOINTS': ['http://a/api/v2/', 'http://b/api/v2/'],
+                    'BALANCER_STRATEGY': 'latency',
+                },
+            },
+        })
+        balancer = ch['default'].get_connection_params()['balancer']
+        self.assertEqual(balancer.strategy, 'latency')
+        self.assertEqual([endpoint.url for endpoint in balancer.endpoints], ['http://a/api/v2/', 'http://b/api/v2/'])
+        self.assertIs(ch['default'].get_connection_params()['balancer'], balancer)
+        self.assertIn('default', load_balancers_stats())
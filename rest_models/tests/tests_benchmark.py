@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import os
+import sys
+import time
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.handlers.base import BaseHandler
+from django.db import connections
+from django.test.testcases import TestCase
+from requests.models import Response
+
+from rest_models.backend.compiler import (ApiResponseReader, SQLCompiler, build_aliases_tree, convert_row,
+                                          get_column_converters, join_aliases, join_results, resolve_tree)
+from rest_models.backend.connexion import ApiConnexion, LocalApiAdapter
+from rest_models.backend.json_codecs import CODECS, JsonCodec, get_json_codec
+from rest_models.backend.middlewares import ApiMiddleware
+from rest_models.utils import pgcd, plan_slice
+from testapp.models import Pizza
+
+BENCHMARK = bool(os.environ.get('BENCHMARK'))
+"""
+the benchmarks are slow and only run if the environment variable BENCHMARK is set:
+BENCHMARK=1 python manage.py test rest_models.tests.tests_benchmark
+"""
+
+
+def benchmark(func, number=100, repeat=5):
+    """
+    run the function number times, and return the mean time of one call, in seconds.
+    the best of the repeated runs is kept to limit the noise.
+    :param func: the function to run, without arguments
+    :param int number: the number of calls in each run
+    :param int repeat: the number of runs
+    :rtype: float
+    """
+    func()  # warm up
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+def report(name, **timings):
+    sys.stdout.write("\n%s: %s\n" % (name, ", ".join(
+        "%s=%.3fms" % (label, timing * 1000) for label, timing in timings.items()
+    )))
+
+
+@skipUnless(BENCHMARK, 'set BENCHMARK=1 to run the benchmarks')
+class BenchmarkLocalApi(TestCase):
+    fixtures = ['data.json']
+
+    def setUp(self):
+        self.client = ApiConnexion(LocalApiAdapter.SPECIAL_URL + "/api/v2/", auth=None)
+        self.adapter = self.client.session.get_adapter(LocalApiAdapter.SPECIAL_URL)
+
+    def run_viewset(self, url, params=None):
+        def query():
+            self.client.get(url, params=params)
+
+        def query_new_handler():
+            # the previous behaviour: a handler loaded for each query
+            self.adapter._handler = None
+            query()
+
+        report('GET %s' % url, new_handler=benchmark(query_new_handler), reused_handler=benchmark(query))
+
+    def test_load_handler(self):
+        def load_handler():
+            BaseHandler().load_middleware()
+        report('load the handler', load_middleware=benchmark(load_handler))
+
+    def test_pizza_detail(self):
+        self.run_viewset('pizza/1/')
+
+    def test_pizza_list(self):
+        self.run_viewset('pizza/', params={'include[]': 'toppings.*'})
+
+    def test_view(self):
+        self.run_viewset('view/')
+
+
+@skipUnless(BENCHMARK, 'set BENCHMARK=1 to run the benchmarks')
+class BenchmarkJsonCodec(TestCase):
+
+    def setUp(self):
+        path = os.path.join(os.path.dirname(__file__), 'rest_fixtures', 'fake_pizza.json')
+        with open(path) as f:
+            pizza = json.load(f)['/pizza/1/']['data']['pizza']
+        # a big page of results, as returned by the api for a large resource
+        self.data = {
+            'pizzas': [dict(pizza, id=i, name='%s %d' % (pizza['name'], i)) for i in range(2000)],
+            'meta': {'page': 1, 'per_page': 2000, 'total_pages': 1, 'total_results': 2000},
+        }
+        self.response = Response()
+        self.response._content = json.dumps(self.data).encode('utf-8')
+        self.response.encoding = 'utf-8'
+        self.response.status_code = 200
+
+    def test_codecs(self):
+        for name in CODECS:
+            codec = get_json_codec(name)
+            if name != 'json' and isinstance(codec, JsonCodec):
+                continue  # not installed
+            encode = codec.dumps if name != 'json' else json.dumps
+            report('JSON_CODEC=%s (%d bytes)' % (name, len(self.response.content)),
+                   decode=benchmark(lambda: codec.decode_response(self.response), number=20),
+                   encode=benchmark(lambda: encode(self.data), number=20))
+
+
+class MockMiddleware(ApiMiddleware):
+    def process_request(self, params, requestid, connection):
+        return self.data_response({})
+
+
+@skipUnless(BENCHMARK, 'set BENCHMARK=1 to run the benchmarks')
+class BenchmarkMiddlewares(TestCase):
+
+    def test_inherited_hooks(self):
+        timings = {}
+        for count in (0, 10, 50):
+            c = ApiConnexion(LocalApiAdapter.SPECIAL_URL + "/api/v2/")
+            c.push_middleware(MockMiddleware(), 9)
+            for _ in range(count):
+                c.push_middleware(ApiMiddleware(), 5)
+            timings['%d_middlewares' % count] = benchmark(lambda: c.get(''), number=2000)
+        report('request with middlewares which do not override the hooks', **timings)
+
+
+@skipUnless(BENCHMARK, 'set BENCHMARK=1 to run the benchmarks')
+class BenchmarkSlicing(TestCase):
+    # the slices of the admin changelists (100 rows by page), of the api paginations, and some unaligned ones
+    slices = [(0, 100), (100, 200), (2000, 2100), (25, 50), (20, 30), (7, 13), (1, 3), (99, 101), (1001, 1011)]
+
+    def test_request_count(self):
+        lines = []
+        for low, high in self.slices:
+            old_per_page = pgcd(high, low) if low else high
+            old = (high - 1) // old_per_page - low // old_per_page + 1
+            plan = plan_slice(low, high)
+            new = plan.last_page - plan.first_page + 1
+            self.assertLessEqual(new, old)
+            lines.append("[%d:%d] pgcd=%d queries of %d rows, planned=%d queries of %d rows (skip %d)" % (
+                low, high, old, old_per_page, new, plan.per_page, plan.skip))
+        sys.stdout.write("\nqueries for the slices:\n%s\n" % "\n".join(lines))
+
+
+@skipUnless(BENCHMARK, 'set BENCHMARK=1 to run the benchmarks')
+class BenchmarkQueryPlans(TestCase):
+    databases = ['default', 'api']
+
+    def test_build_params(self):
+        connection = connections['api']
+
+        def build_params():
+            queryset = Pizza.objects.filter(menu__name='menu', cost__gt=2).exclude(name='pizza').order_by(
+                '-cost', 'menu__code').values('name', 'menu__code', 'toppings__name')
+            compiler = SQLCompiler(queryset.query, connection, 'api')
+            compiler.setup_query()
+            compiler.build_params()
+
+        cache = connection.query_plan_cache
+        cached = benchmark(build_params, number=500)
+        connection.query_plan_cache = None
+        try:
+            compiled = benchmark(build_params, number=500)
+        finally:
+            connection.query_plan_cache = cache
+        report('build_params of the same shape of query', compiled=compiled, cached=cached)
+
+
+@skipUnless(BENCHMARK, 'set BENCHMARK=1 to run the benchmarks')
+class BenchmarkHydration(TestCase):
+    databases = ['default', 'api']
+
+    def setUp(self):
+        path = os.path.join(os.path.dirname(__file__), 'rest_fixtures', 'fake_pizza.json')
+        with open(path) as f:
+            pizza = json.load(f)['/pizza/1/']['data']['pizza']
+        # 2000 pizzas with 5 toppings each: 10000 rows once the toppings are joined
+        self.data = {
+            'pizzas': [dict(pizza, id=i, name='%s %d' % (pizza['name'], i)) for i in range(2000)],
+            'menus': [{'id': 1, 'name': 'menu', 'code': 'mn'}],
+            'toppings': [{'id': i, 'name': 'topping %d' % i, 'taxed_cost': i} for i in pizza['toppings']],
+            'meta': {'page': 1, 'per_page': 2000, 'total_pages': 1, 'total_results': 2000},
+        }
+
+    def test_rows(self):
+        queryset = Pizza.objects.values('name', 'cost', 'from_date', 'to_date', 'menu__name', 'toppings__name')
+        compiler = SQLCompiler(queryset.query, connections['api'], 'api')
+        compiler.setup_query()
+
+        def hydrate():
+            rows = list(compiler.result_iter(ApiResponseReader(self.data)))
+            self.assertEqual(len(rows), 10000)
+
+        def convert_row_by_fields(row, columns):
+            # the previous behaviour: the fields of the columns are found for each row
+            resolved = [(alias, db_column) for alias, db_column, _ in columns]
+            return convert_row(row, get_column_converters(resolved, compiler.connection))
+
+        table = benchmark(hydrate, number=5, repeat=3)
+        with patch('rest_models.backend.compiler.convert_row', convert_row_by_fields):
+            per_row = benchmark(hydrate, number=5, repeat=3)
+        report('hydrate 10000 rows', fields_by_row=per_row, converters_table=table)
+
+    def test_materializer(self):
+        queryset = Pizza.objects.values('name', 'price', 'cost', 'from_date', 'to_date', 'menu__name', 'menu__code',
+                                        'toppings__name', 'toppings__cost')
+        compiler = SQLCompiler(queryset.query, connections['api'], 'api')
+        compiler.setup_query()
+
+        def hydrate():
+            rows = list(compiler.result_iter(ApiResponseReader(self.data)))
+            self.assertEqual(len(rows), 10000)
+
+        def response_to_table_by_item(responsereader, item):
+            # the previous behaviour: the aliases are resolved for each item, and joined by recursive generators
+            resolved = compiler.get_resolved_columns()
+            alias_tree = build_aliases_tree({alias for alias, _ in resolved})
+            for row in join_aliases(list(resolve_tree(alias_tree)), responsereader, {alias_tree.alias: item}):
+                yield from join_results(row, resolved, compiler.connection)
+
+        materializer = benchmark(hydrate, number=5, repeat=3)
+        with patch.object(compiler, 'response_to_table', response_to_table_by_item):
+            by_item = benchmark(hydrate, number=5, repeat=3)
+        report('hydrate 10000 rows of a wide select', joins_by_item=by_item, materializer=materializer)
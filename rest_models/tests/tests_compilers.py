@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, unicode_literals
 
+import threading
+import time
+
 from django.core.exceptions import ImproperlyConfigured
 from django.db import connections
 from django.db.models.sql.constants import CURSOR, NO_RESULTS, SINGLE
@@ -8,6 +11,7 @@ from django.db.utils import OperationalError, ProgrammingError
 from django.test.testcases import TestCase
 
 from rest_models.backend.compiler import SQLCompiler
+from rest_models.backend.middlewares import ApiMiddleware
 from rest_models.test import RestModelTestCase
 from testapp.models import Pizza
 
@@ -114,3 +118,165 @@ class TestErrorResponseFormat(RestModelTestCase):
                 list,
                 Pizza.objects.all().select_related('menu')
             )
+
+
+class ConcurrencyTrackerMiddleware(ApiMiddleware):
+    """
+    a middleware that slow down each query and record the max number of queries running at the same time
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def process_request(self, params, requestid, connection):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+
+    def process_response(self, params, response, requestid):
+        with self.lock:
+            self.running -= 1
+        return response
+
+
+def pizza_page(page, per_page=2, total_pages=5):
+    """
+    build the mocked response for the given page of pizzas
+    """
+    ids = range((page - 1) * per_page + 1, page * per_page + 1)
+    return {
+        'pizzas': [{'id': i, 'name': 'pizza %d' % i} for i in ids],
+        'meta': {'page': page, 'per_page': per_page, 'total_pages': total_pages,
+                 'total_results': per_page * total_pages},
+    }
+
+
+class TestParallelPages(RestModelTestCase):
+    databases = ['default', 'api']
+
+    rest_fixtures = {
+        'pizza': [
+            {'filter': {'params': {'page': i}}, 'data': pizza_page(i)} for i in range(2, 6)
+        ] + [
+            {'data': pizza_page(1)}
+        ]
+    }
+    database_rest_fixtures = {'api': rest_fixtures}
+
+    def setUp(self):
+        super(TestParallelPages, self).setUp()
+        self.options = connections['api'].settings_dict['OPTIONS']
+        self.tracker = ConcurrencyTrackerMiddleware()
+        connections['api'].cursor().push_middleware(self.tracker, priority=1)
+
+    def tearDown(self):
+        connections['api'].cursor().pop_middleware(self.tracker)
+        self.options.pop('PARALLEL_PAGES', None)
+        super(TestParallelPages, self).tearDown()
+
+    def test_serial_pages(self):
+        with self.assertNumQueries(5, using='api'):
+            res = list(Pizza.objects.values_list('id', flat=True))
+        self.assertEqual(res, list(range(1, 11)))
+        self.assertEqual(self.tracker.max_running, 1)
+
+    def test_parallel_pages(self):
+        self.options['PARALLEL_PAGES'] = 3
+        with self.assertNumQueries(5, using='api'):
+            res = list(Pizza.objects.values_list('id', flat=True))
+        self.assertEqual(res, list(range(1, 11)))
+        self.assertGreater(self.tracker.max_running, 1)
+        self.assertLessEqual(self.tracker.max_running, 3)
+
+    def test_parallel_pages_stop_early(self):
+        self.options['PARALLEL_PAGES'] = 2
+        iterator = Pizza.objects.values_list('id', flat=True).iterator()
+        self.assertEqual([next(iterator) for _ in range(3)], [1, 2, 3])
+        iterator.close()
+        self.assertEqual(connections['api'].allow_thread_sharing, False)
+
+
+class PageTrackerMiddleware(ApiMiddleware):
+    """
+    a middleware that record the pages requested
+    """
+
+    def __init__(self):
+        self.pages = []
+        self.failing_page = None
+
+    def process_request(self, params, requestid, connection):
+        page = params['params'].get('page', 1)
+        self.pages.append(page)
+        if page == self.failing_page:
+            raise Exception('page %s failed' % page)
+
+
+class TestPrefetchPages(RestModelTestCase):
+    databases = ['default', 'api']
+
+    rest_fixtures = TestParallelPages.rest_fixtures
+    database_rest_fixtures = {'api': rest_fixtures}
+
+    def setUp(self):
+        super(TestPrefetchPages, self).setUp()
+        self.options = connections['api'].settings_dict['OPTIONS']
+        self.tracker = PageTrackerMiddleware()
+        connections['api'].cursor().push_middleware(self.tracker, priority=1)
+
+    def tearDown(self):
+        connections['api'].cursor().pop_middleware(self.tracker)
+        self.options.pop('PREFETCH_PAGES', None)
+        self.options.pop('PARALLEL_PAGES', None)
+        super(TestPrefetchPages, self).tearDown()
+
+    def wait_for_pages(self, count):
+        for _ in range(100):
+            if len(self.tracker.pages) >= count:
+                return
+            time.sleep(0.01)
+
+    def test_no_prefetch(self):
+        iterator = Pizza.objects.values_list('id', flat=True).iterator()
+        self.assertEqual(next(iterator), 1)
+        time.sleep(0.05)
+        self.assertEqual(self.tracker.pages, [1])
+        self.assertEqual(list(iterator), list(range(2, 11)))
+        self.assertEqual(self.tracker.pages, [1, 2, 3, 4, 5])
+
+    def test_prefetch_next_page(self):
+        self.options['PREFETCH_PAGES'] = 1
+        iterator = Pizza.objects.values_list('id', flat=True).iterator()
+        self.assertEqual(next(iterator), 1)
+        self.wait_for_pages(2)
+        time.sleep(0.05)
+        # only one page is fetched ahead of the current one
+        self.assertEqual(self.tracker.pages, [1, 2])
+        self.assertEqual(list(iterator), list(range(2, 11)))
+        self.assertEqual(self.tracker.pages, [1, 2, 3, 4, 5])
+        self.assertEqual(connections['api'].allow_thread_sharing, False)
+
+    def test_prefetch_depth(self):
+        self.options['PREFETCH_PAGES'] = 3
+        iterator = Pizza.objects.values_list('id', flat=True).iterator()
+        self.assertEqual(next(iterator), 1)
+        self.wait_for_pages(4)
+        time.sleep(0.05)
+        self.assertEqual(self.tracker.pages, [1, 2, 3, 4])
+        iterator.close()
+        self.assertEqual(connections['api'].allow_thread_sharing, False)
+
+    def test_prefetch_with_parallel_pages(self):
+        self.options['PREFETCH_PAGES'] = 2
+        self.options['PARALLEL_PAGES'] = 2
+        with self.assertNumQueries(5, using='api'):
+            self.assertEqual(list(Pizza.objects.values_list('id', flat=True)), list(range(1, 11)))
+
+    def test_prefetch_error(self):
+        self.options['PREFETCH_PAGES'] = 1
+        self.tracker.failing_page = 3
+        self.assertRaisesMessage(Exception, 'page 3 failed', list, Pizza.objects.values_list('id', flat=True))
+        self.assertEqual(connections['api'].allow_thread_sharing, False)
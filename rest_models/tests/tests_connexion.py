@@ -1,15 +1,40 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, print_function, unicode_literals
 
+import datetime
+import json
 import logging
-
+import socket
+import sys
+import threading
+import time
+from email.utils import formatdate
+from unittest import skipIf
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
 from django.db.utils import ConnectionHandler, ProgrammingError
 from django.test.testcases import LiveServerTestCase, TestCase
+from django.test.utils import override_settings
+from requests.exceptions import ConnectionError, Timeout
 
 from rest_models.backend.auth import OAuthToken
-from rest_models.backend.connexion import ApiConnexion, LocalApiAdapter
+from rest_models.backend.circuit_breaker import CircuitBreaker, circuit_breakers_stats
+from rest_models.backend.connexion import MIN_THROTTLE_DELAY, ApiConnexion, LocalApiAdapter, build_url
+from rest_models.backend.deadline import DeadlineExceeded, deadline
 from rest_models.backend.exceptions import FakeDatabaseDbAPI2
+from rest_models.backend.json_codecs import JsonCodec, OrjsonCodec, get_json_codec
+from rest_models.backend.middlewares import ApiMiddleware, FakeApiResponse
+from rest_models.backend.rate_limit import RateLimiter, get_rate_limiter, parse_retry_after, rate_limiters_stats
+from rest_models.backend.single_flight import SingleFlight, get_request_key, get_wait_timeout, single_flight_stats
 from testapi.viewset import custom, queries
+from testapp.models import Pizza
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
@@ -112,6 +137,16 @@ class TestApiConnexion(LiveServerTestCase):
         r = c.get('/other/view/', json={'result': 'ok'})
         self.assertEqual(r.status_code, 200)
 
+    def test_pool_stats(self):
+        c = ApiConnexion(self.live_server_url + "/api/v2/", pool_options={'pool_maxsize': 4})
+        self.assertEqual(c.pool_stats(), {})
+        c.get("pizza/1/")
+        c.get("pizza/2/")
+        stats = c.pool_stats()
+        self.assertEqual(len(stats), 1)
+        host_stats = list(stats.values())[0]
+        self.assertEqual(host_stats, {'in_use': 0, 'idle': 1, 'maxsize': 4, 'requests': 2})
+
 
 class TestApiConnexionUrlReslving(TestCase):
 
@@ -220,6 +255,16 @@ class TestLocalApiHandler(TestCase):
         self.assertEqual(data['pizzas'][0]['id'], 1)
         self.assertEqual(len(data['toppings']), len(data['pizzas'][0]['toppings']))
 
+    def test_handler_reused(self):
+        adapter = self.client.session.get_adapter(self.live_server_url)
+        self.client.get("pizza/1/")
+        handler = adapter.get_handler()
+        self.client.get("pizza/2/")
+        self.assertIs(adapter.get_handler(), handler)
+        with override_settings(MIDDLEWARE=[]):
+            self.assertEqual(self.client.get("pizza/1/").status_code, 200)
+            self.assertIsNot(adapter.get_handler(), handler)
+
     def test_api_post(self):
 
         r = self.client.post('pizza/', json=dict(pizza={
@@ -352,8 +397,565 @@ class TestDatabaseWrapper(TestCase):
         wrapper._start_transaction_under_autocommit()  # does nothing as expeced
         self.assertTrue(wrapper.is_usable())
 
+    def test_default_pool_options(self):
+        adapter = self.ch['default'].cursor().adapter
+        self.assertEqual(adapter._pool_maxsize, 10)
+        self.assertIsNone(adapter.socket_options)
+        self.assertIs(self.ch['default'].cursor().session.get_adapter('https://api.example.com/'), adapter)
+
+    def test_pool_options(self):
+        ch = ConnectionHandler({
+            'default': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://localapi/api/v2/',
+                'OPTIONS': {
+                    'POOL_CONNECTIONS': 2,
+                    'POOL_MAXSIZE': 32,
+                    'POOL_BLOCK': True,
+                    'MAX_RETRIES': 2,
+                    'KEEP_ALIVE': True,
+                    'KEEP_ALIVE_IDLE': 30,
+                }
+            },
+        })
+        adapter = ch['default'].cursor().adapter
+        self.assertEqual(adapter._pool_connections, 2)
+        self.assertEqual(adapter._pool_maxsize, 32)
+        self.assertTrue(adapter._pool_block)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1), adapter.socket_options)
+        self.assertEqual(adapter.poolmanager.connection_pool_kw['socket_options'], adapter.socket_options)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            self.assertIn((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30), adapter.socket_options)
+
     def test_unavailable(self):
         wrapper = self.ch['unavailable']
         wrapper.init_connection_state = lambda: None  # this method will check connectivity at connect time, we skip it
         wrapper.connect()
         self.assertFalse(wrapper.is_usable())
+
+    def test_health_cached(self):
+        wrapper = self.ch['default']
+        wrapper.connect()
+        wrapper.cursor().get('')
+        with patch.object(ApiConnexion, 'head') as mock_head:
+            self.assertTrue(wrapper.is_usable())
+            mock_head.assert_not_called()
+            # the connection is idle: the api is checked again
+            wrapper.connection.health = (True, time.monotonic() - 11)
+            self.assertTrue(wrapper.is_usable())
+            mock_head.assert_called_once_with('', timeout=wrapper.timeout)
+
+    def test_health_failure(self):
+        wrapper = self.ch['unavailable']
+        wrapper.init_connection_state = lambda: None
+        wrapper.connect()
+        wrapper.connection.record_outcome(False)
+        with patch.object(ApiConnexion, 'head') as mock_head:
+            self.assertFalse(wrapper.is_usable())
+            mock_head.assert_not_called()
+
+    def test_health_no_ttl(self):
+        wrapper = self.ch['default']
+        wrapper.settings_dict['OPTIONS']['HEALTH_CHECK_TTL'] = 0
+        wrapper.connect()
+        wrapper.cursor().get('')
+        with patch.object(ApiConnexion, 'head') as mock_head:
+            self.assertTrue(wrapper.is_usable())
+            mock_head.assert_called_once_with('', timeout=wrapper.timeout)
+
+    def test_queries_log_lazy(self):
+        wrapper = self.ch['default']
+        wrapper.force_debug_cursor = True
+        with patch('rest_models.backend.connexion.build_url', wraps=build_url) as mock_build_url:
+            wrapper.cursor().get('pizza/', params={'filter{name}': 'suprème'})
+            self.assertEqual(len(wrapper.queries_log), 1)
+            mock_build_url.assert_not_called()
+            entry = wrapper.queries_log[0]
+            self.assertRegex(entry['sql'], r"^get pizza/\?filter%7Bname%7D=supr%C3%A8me \|\|\| ")
+            self.assertEqual(entry['sql'], entry['sql'])
+            self.assertEqual(mock_build_url.call_count, 1)
+        self.assertRegex(entry['time'], r'^\d+\.\d{3} $')
+        self.assertEqual(set(dict(entry)), {'sql', 'time'})
+
+    def test_queries_log_logger(self):
+        wrapper = self.ch['default']
+        wrapper.force_debug_cursor = True
+        with self.assertLogs('django.db.backends', logging.DEBUG) as logs:
+            wrapper.cursor().get('pizza/', params={'page': 2})
+        self.assertIn('get pizza/?page=2; args=', logs.output[0])
+        self.assertEqual(logs.records[0].sql, 'pizza/?page=2')
+
+    def test_queries_log_options(self):
+        ch = ConnectionHandler({
+            'default': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://localapi/api/v2/',
+                'USER': 'user1',
+                'PASSWORD': 'user1',
+                'AUTH': 'rest_models.backend.auth.BasicAuth',
+                'OPTIONS': {
+                    'QUERIES_LOG_LIMIT': 3,
+                    'QUERIES_LOG_SAMPLING': 0.5,
+                }
+            },
+        })
+        wrapper = ch['default']
+        wrapper.force_debug_cursor = True
+        with patch('rest_models.backend.connexion.random.random', return_value=0.9):
+            for i in range(5):
+                wrapper.cursor().get('pizza/', params={'page': i})
+            # the queries are all logged while they are counted
+            self.assertEqual([entry['sql'][:17] for entry in wrapper.queries_log], [
+                'get pizza/?page=%d' % i for i in range(2, 5)
+            ])
+            wrapper.force_debug_cursor = False
+            with override_settings(DEBUG=True):
+                wrapper.cursor().get('pizza/', params={'page': 5})
+            self.assertEqual(wrapper.queries_log[-1]['sql'][:17], 'get pizza/?page=4')
+        with patch('rest_models.backend.connexion.random.random', return_value=0.1), override_settings(DEBUG=True):
+            wrapper.cursor().get('pizza/', params={'page': 6})
+        self.assertEqual(wrapper.queries_log[-1]['sql'][:17], 'get pizza/?page=6')
+
+
+class UnreachableApiMiddleware(ApiMiddleware):
+    """
+    a middleware that fail to reach the api for the first queries
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def process_request(self, params, requestid, connection):
+        self.calls.append(time.monotonic())
+        if len(self.calls) <= self.failures:
+            raise ConnectionError("api down")
+        return FakeApiResponse({}, 200)
+
+
+class TestRetry(TestCase):
+
+    def get_connexion(self, failures, **kwargs):
+        middleware = UnreachableApiMiddleware(failures)
+        return ApiConnexion('http://localapi/api/v2/', middlewares=[middleware], **kwargs), middleware
+
+    def test_no_backoff(self):
+        c, middleware = self.get_connexion(2)
+        self.assertEqual(c.get('').status_code, 200)
+        self.assertEqual(len(middleware.calls), 3)
+        self.assertEqual(c.get_retry_delay(3), 0)
+
+    def test_retry_delay(self):
+        c, middleware = self.get_connexion(0, retry_backoff=0.1, retry_backoff_max=0.3, retry_jitter=False)
+        self.assertEqual([c.get_retry_delay(i) for i in range(1, 5)], [0.1, 0.2, 0.3, 0.3])
+
+    def test_retry_delay_jitter(self):
+        c, middleware = self.get_connexion(0, retry_backoff=0.1)
+        for i in range(1, 5):
+            self.assertTrue(0 <= c.get_retry_delay(i) <= 0.1 * 2 ** (i - 1))
+
+    def test_backoff(self):
+        c, middleware = self.get_connexion(2, retry_backoff=0.05, retry_jitter=False)
+        self.assertEqual(c.get('').status_code, 200)
+        self.assertGreaterEqual(middleware.calls[1] - middleware.calls[0], 0.05)
+        self.assertGreaterEqual(middleware.calls[2] - middleware.calls[1], 0.1)
+
+    def test_retry_exhausted(self):
+        c, middleware = self.get_connexion(10, retry=2)
+        self.assertRaisesMessage(FakeDatabaseDbAPI2.OperationalError, 'tried 3 times', c.get, '')
+        self.assertEqual(len(middleware.calls), 3)
+
+
+class TestCircuitBreaker(TestCase):
+
+    def get_connexion(self, failures, breaker, retry=0):
+        middleware = UnreachableApiMiddleware(failures)
+        c = ApiConnexion('http://localapi/api/v2/', middlewares=[middleware], retry=retry, circuit_breaker=breaker)
+        return c, middleware
+
+    def test_open_after_threshold(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+        c, middleware = self.get_connexion(10, breaker, retry=5)
+        self.assertRaisesMessage(FakeDatabaseDbAPI2.OperationalError, 'circuit breaker is open', c.get, '')
+        # the retries stop as soon as the breaker is open
+        self.assertEqual(len(middleware.calls), 3)
+        self.assertRaisesMessage(FakeDatabaseDbAPI2.OperationalError, 'circuit breaker is open', c.get, '')
+        self.assertEqual(len(middleware.calls), 3)
+        self.assertEqual(breaker.stats(), {
+            'state': 'open', 'consecutive_failures': 3, 'failures': 3, 'successes': 0, 'rejected': 2, 'opened': 1,
+        })
+
+    def test_success_reset_failures(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+        c, middleware = self.get_connexion(2, breaker, retry=2)
+        self.assertEqual(c.get('').status_code, 200)
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(breaker.consecutive_failures, 0)
+
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+        c, middleware = self.get_connexion(1, breaker)
+        self.assertRaises(FakeDatabaseDbAPI2.OperationalError, c.get, '')
+        self.assertEqual(breaker.state, 'open')
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, 'half-open')
+        # only one probe at a time
+        self.assertFalse(breaker.allow_request())
+        breaker.release()
+        self.assertEqual(c.get('').status_code, 200)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_half_open_probe_failed(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+        c, middleware = self.get_connexion(2, breaker)
+        self.assertRaises(FakeDatabaseDbAPI2.OperationalError, c.get, '')
+        time.sleep(0.06)
+        self.assertRaisesMessage(FakeDatabaseDbAPI2.OperationalError, 'tried 1 times', c.get, '')
+        self.assertEqual(breaker.state, 'open')
+        self.assertEqual(breaker.stats()['opened'], 2)
+        self.assertRaisesMessage(FakeDatabaseDbAPI2.OperationalError, 'circuit breaker is open', c.get, '')
+
+    def test_shared_by_alias(self):
+        ch = ConnectionHandler({
+            'default': {'ENGINE': 'rest_models.backend', 'NAME': 'http://localapi/api/v2/'},
+            'breaker': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://localapi/api/v2/',
+                'OPTIONS': {
+                    'CIRCUIT_BREAKER_THRESHOLD': 4,
+                    'CIRCUIT_BREAKER_TIMEOUT': 10,
+                    'RETRY_BACKOFF': 0.5,
+                }
+            },
+        })
+        params = ch['breaker'].get_connection_params()
+        breaker = params['circuit_breaker']
+        self.assertEqual(breaker.failure_threshold, 4)
+        self.assertEqual(breaker.reset_timeout, 10)
+        self.assertEqual(params['retry_backoff'], 0.5)
+        self.assertIs(ch['breaker'].get_connection_params()['circuit_breaker'], breaker)
+        self.assertIn('breaker', circuit_breakers_stats())
+        self.assertIsNone(ch['default'].get_connection_params()['circuit_breaker'])
+
+
+class ThrottledApiMiddleware(ApiMiddleware):
+    """
+    a middleware that answer the first queries with the given throttled response
+    """
+
+    def __init__(self, throttled, status_code=429, retry_after=None):
+        self.throttled = throttled
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.calls = []
+
+    def process_request(self, params, requestid, connection):
+        self.calls.append(time.monotonic())
+        if len(self.calls) <= self.throttled:
+            response = FakeApiResponse({}, self.status_code)
+            response.headers = {'Retry-After': self.retry_after} if self.retry_after is not None else {}
+            return response
+        return FakeApiResponse({}, 200)
+
+
+class TestRateLimit(TestCase):
+
+    def get_connexion(self, middleware, limiter=None, deadline=5, retry_backoff=0):
+        c = ApiConnexion('http://localapi/api/v2/', middlewares=[middleware],
+                         rate_limiter=limiter or RateLimiter('test'), throttle_deadline=deadline,
+                         retry_backoff=retry_backoff)
+        return c
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('2'), 2)
+        self.assertEqual(parse_retry_after('0.5'), 0.5)
+        self.assertEqual(parse_retry_after('-1'), 0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
+        date = formatdate(time.time() + 30, usegmt=True)
+        self.assertTrue(28 <= parse_retry_after(date) <= 30)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+
+    def test_token_bucket(self):
+        limiter = RateLimiter('test', rate=10, burst=2)
+        with patch('rest_models.backend.rate_limit.time.monotonic', return_value=100.):
+            limiter.reset()
+            self.assertEqual([limiter.reserve() for _ in range(2)], [0, 0])
+            self.assertAlmostEqual(limiter.reserve(), 0.1)
+            self.assertAlmostEqual(limiter.reserve(), 0.2)
+        with patch('rest_models.backend.rate_limit.time.monotonic', return_value=101.):
+            # the bucket is full again after 1s, but can't hold more than the burst
+            self.assertEqual([limiter.reserve() for _ in range(2)], [0, 0])
+            self.assertAlmostEqual(limiter.reserve(), 0.1)
+        self.assertEqual(limiter.stats(), {'acquired': 7, 'delayed': 3, 'throttled': 0, 'rate': 10, 'burst': 2})
+
+    def test_pause(self):
+        limiter = RateLimiter('test')
+        self.assertEqual(limiter.reserve(), 0)
+        limiter.pause(5)
+        self.assertTrue(4 < limiter.reserve() <= 5)
+
+    def test_retry_after(self):
+        middleware = ThrottledApiMiddleware(2, retry_after='0.05')
+        c = self.get_connexion(middleware)
+        self.assertEqual(c.get('').status_code, 200)
+        self.assertEqual(len(middleware.calls), 3)
+        self.assertGreaterEqual(middleware.calls[1] - middleware.calls[0], 0.05)
+        self.assertEqual(c.rate_limiter.stats()['throttled'], 2)
+
+    def test_retry_after_zero(self):
+        # the api must not be hammered with a Retry-After of 0 or in the past
+        for retry_after in ('0', 'Wed, 21 Oct 2015 07:28:00 GMT'):
+            middleware = ThrottledApiMiddleware(1, retry_after=retry_after)
+            self.assertEqual(self.get_connexion(middleware).get('').status_code, 200)
+            self.assertGreaterEqual(middleware.calls[1] - middleware.calls[0], MIN_THROTTLE_DELAY)
+        # nor faster than the regular backoff
+        middleware = ThrottledApiMiddleware(1, retry_after='0')
+        self.assertEqual(self.get_connexion(middleware, retry_backoff=0.2).get('').status_code, 200)
+        self.assertGreaterEqual(middleware.calls[1] - middleware.calls[0], 0.2)
+
+    def test_retry_503(self):
+        middleware = ThrottledApiMiddleware(1, status_code=503, retry_after='0')
+        self.assertEqual(self.get_connexion(middleware).get('').status_code, 200)
+        # without Retry-After, the api is considered down
+        middleware = ThrottledApiMiddleware(1, status_code=503)
+        self.assertEqual(self.get_connexion(middleware).get('').status_code, 503)
+        self.assertEqual(len(middleware.calls), 1)
+
+    def test_deadline(self):
+        middleware = ThrottledApiMiddleware(10, retry_after='10')
+        c = self.get_connexion(middleware, deadline=5)
+        self.assertEqual(c.get('').status_code, 429)
+        self.assertEqual(len(middleware.calls), 1)
+        # not retried without deadline
+        middleware = ThrottledApiMiddleware(10, retry_after='0')
+        self.assertEqual(self.get_connexion(middleware, deadline=0).get('').status_code, 429)
+        self.assertEqual(len(middleware.calls), 1)
+
+    def test_database_options(self):
+        ch = ConnectionHandler({
+            'default': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://localapi/api/v2/',
+            },
+            'limited': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://localapi/api/v2/',
+                'OPTIONS': {
+                    'RATE_LIMIT': 20,
+                    'RATE_LIMIT_DEADLINE': 10,
+                }
+            },
+        })
+        self.assertIsNone(ch['default'].cursor().rate_limiter)
+        c = ch['limited'].cursor()
+        self.assertEqual(c.throttle_deadline, 10)
+        self.assertEqual(rate_limiters_stats()['limited']['rate'], 20)
+        self.assertEqual(rate_limiters_stats()['limited']['burst'], 20)
+        # the limiter is shared by the threads
+        self.assertIs(c.rate_limiter, get_rate_limiter('limited', 20))
+
+
+class TestJsonCodec(TestCase):
+
+    def test_default_codec(self):
+        self.assertIsInstance(get_json_codec(None), JsonCodec)
+        params = {'method': 'post', 'json': {'a': 1}}
+        self.assertIs(get_json_codec('json').encode_request(params), params)
+
+    def test_codec_not_installed(self):
+        with patch.dict(sys.modules, {'msgspec': None}):
+            self.assertIsInstance(get_json_codec('msgspec'), JsonCodec)
+
+    def test_bad_codec(self):
+        self.assertRaises(ImproperlyConfigured, get_json_codec, 'rest_models.nothing.Codec')
+
+    def test_decode_fake_response(self):
+        self.assertEqual(JsonCodec().decode_response(FakeApiResponse({'a': 1}, 200)), {'a': 1})
+
+    @skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson(self):
+        codec = get_json_codec('orjson')
+        self.assertIsInstance(codec, OrjsonCodec)
+        params = codec.encode_request({'method': 'post', 'json': {'a': [1, 2], 3: 'b'}, 'headers': {'X-A': 'a'}})
+        self.assertIsNone(params['json'])
+        self.assertEqual(json.loads(params['data']), {'a': [1, 2], '3': 'b'})
+        self.assertEqual(params['headers'], {'X-A': 'a', 'Content-Type': 'application/json'})
+        self.assertEqual(codec.encode_request({'method': 'get', 'json': None}), {'method': 'get', 'json': None})
+        self.assertRaises(json.JSONDecodeError, codec.loads, b'{bad')
+
+
+@skipIf(orjson is None, 'orjson is not installed')
+class TestJsonCodecQueries(TestCase):
+    fixtures = ['user.json']
+    databases = ['default', 'api']
+
+    def setUp(self):
+        self.codec = OrjsonCodec()
+        connections['api'].__dict__['json_codec'] = self.codec
+        connections['api'].cursor().json_codec = self.codec
+
+    def tearDown(self):
+        del connections['api'].__dict__['json_codec']
+        connections['api'].cursor().json_codec = connections['api'].json_codec
+
+    def test_create_and_get(self):
+        with patch.object(self.codec, 'loads', wraps=self.codec.loads) as loads, \
+                patch.object(self.codec, 'dumps', wraps=self.codec.dumps) as dumps:
+            p = Pizza.objects.create(name='savoyarde', price=13.3, from_date=datetime.date.today())
+            self.assertEqual(Pizza.objects.get(pk=p.pk).name, 'savoyarde')
+            self.assertEqual(list(Pizza.objects.filter(pk=p.pk).values_list('name', flat=True)), ['savoyarde'])
+        self.assertTrue(dumps.called)
+        self.assertEqual(loads.call_count, 3)
+
+
+class TestSingleFlight(TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight('test')
+        self.sent = []
+        self.lock = threading.Lock()
+        self.delay = 0.1
+
+    def fake_request(self, **params):
+        with self.lock:
+            self.sent.append(params)
+        time.sleep(self.delay)
+        if params['url'].endswith('fail'):
+            raise ConnectionError('api down')
+        return FakeApiResponse({'url': params['url']}, 200)
+
+    def get_connexion(self):
+        c = ApiConnexion('http://localapi/api/v2/', retry=0, single_flight=self.single_flight)
+        c.session.request = self.fake_request
+        return c
+
+    def run_threads(self, queries):
+        """
+        run each query in its own thread, with its own connexion, at the same time
+        """
+        results = [None] * len(queries)
+        barrier = threading.Barrier(len(queries))
+
+        def run(i, method, url, params):
+            c = self.get_connexion()
+            barrier.wait()
+            try:
+                results[i] = c.request(method, url, params=params)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=run, args=(i,) + query) for i, query in enumerate(queries)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_request_key(self):
+        key = get_request_key({'method': 'get', 'url': 'u', 'params': {'b': '1', 'a': ['2', '1']}})
+        self.assertEqual(key, get_request_key({'method': 'GET', 'url': 'u', 'params': [('a', '1'), ('a', '2'),
+                                                                                       ('b', '1')]}))
+        self.assertEqual(key, get_request_key({'method': 'GET', 'url': 'u', 'params': 'a=1&b=1&a=2'}))
+        self.assertNotEqual(key, get_request_key({'method': 'get', 'url': 'u', 'params': {'a': '1', 'b': '1'}}))
+        self.assertNotEqual(key, get_request_key({'method': 'get', 'url': 'v', 'params': {'b': '1', 'a': ['2', '1']}}))
+        self.assertIsNone(get_request_key({'method': 'post', 'url': 'u', 'json': {}}))
+        self.assertIsNone(get_request_key({'method': 'get', 'url': 'u', 'stream': True}))
+
+    def test_coalesce(self):
+        results = self.run_threads([('get', 'pizza/', {'filter{id}': '1', 'include[]': ['a', 'b']})] * 3 + [
+            ('get', 'pizza/', {'include[]': ['b', 'a'], 'filter{id}': '1'}),
+        ])
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual({id(r) for r in results}, {id(results[0])})
+        self.assertEqual(self.single_flight.stats(), {'requests': 1, 'saved': 3})
+
+    def test_coalesce_deadlines(self):
+        # the timeouts shrunk by the deadlines differ, the first query is shared anyway, but a query doesn't wait
+        # for it longer than its own deadline
+        self.delay = 0.6
+        results = {}
+
+        def run(name, seconds, start_after):
+            time.sleep(start_after)
+            c = self.get_connexion()
+            start = time.monotonic()
+            with deadline(seconds):
+                try:
+                    results[name] = c.request('get', 'pizza/', params={'filter{id}': '1'})
+                except Exception as e:
+                    results[name] = e
+            results[name + ' time'] = time.monotonic() - start
+
+        threads = [
+            threading.Thread(target=run, args=('leader', 2, 0)),
+            threading.Thread(target=run, args=('late', 0.2, 0.05)),
+            threading.Thread(target=run, args=('patient', 1, 0.05)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.single_flight.stats(), {'requests': 1, 'saved': 2})
+        self.assertEqual(results['leader'].status_code, 200)
+        self.assertIs(results['patient'], results['leader'])
+        self.assertIsInstance(results['late'], FakeDatabaseDbAPI2.OperationalError)
+        self.assertLess(results['late time'], 0.4)
+        self.assertGreaterEqual(results['leader time'], 0.6)
+
+    def test_wait_timeout(self):
+        self.delay = 0.3
+        single_flight = SingleFlight('test')
+        started = threading.Event()
+
+        def leader():
+            single_flight.do('key', lambda: started.set() or time.sleep(self.delay))
+
+        thread = threading.Thread(target=leader)
+        thread.start()
+        started.wait()
+        self.assertRaises(Timeout, single_flight.do, 'key', lambda: None, 0.05)
+        with deadline(0.05):
+            self.assertRaises(DeadlineExceeded, single_flight.do, 'key', lambda: None, get_wait_timeout(3))
+        thread.join()
+
+    def test_different_queries(self):
+        results = self.run_threads([
+            ('get', 'pizza/', {'filter{id}': '1'}),
+            ('get', 'pizza/', {'filter{id}': '2'}),
+            ('get', 'menu/', {'filter{id}': '1'}),
+            ('post', 'pizza/', None),
+            ('post', 'pizza/', None),
+        ])
+        self.assertEqual(len(self.sent), 5)
+        self.assertEqual([r.status_code for r in results], [200] * 5)
+        self.assertEqual(self.single_flight.stats(), {'requests': 3, 'saved': 0})
+
+    def test_error_shared(self):
+        results = self.run_threads([('get', 'fail', None)] * 3)
+        self.assertEqual(len(self.sent), 1)
+        for result in results:
+            self.assertIsInstance(result, FakeDatabaseDbAPI2.OperationalError)
+
+    def test_sequential_not_coalesced(self):
+        c = self.get_connexion()
+        c.get('pizza/')
+        c.get('pizza/')
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(self.single_flight.stats(), {'requests': 2, 'saved': 0})
+
+    def test_option(self):
+        ch = ConnectionHandler({
+            'default': {'ENGINE': 'rest_models.backend', 'NAME': 'http://localapi/api/v2/'},
+            'coalesced': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://localapi/api/v2/',
+                'OPTIONS': {'SINGLE_FLIGHT': True},
+            },
+        })
+        self.assertIsNone(ch['default'].cursor().single_flight)
+        self.assertIs(ch['coalesced'].cursor().single_flight, ch['coalesced'].get_connection_params()['single_flight'])
+        self.assertIn('coalesced', single_flight_stats())
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import asyncio
+import time
+from unittest import skipIf
+
+from django.test.client import RequestFactory
+from django.test.testcases import TestCase
+from django.test.utils import override_settings
+
+from rest_models.backend import async_connexion
+from rest_models.backend.async_connexion import AsyncApiConnexion
+from rest_models.backend.connexion import ApiConnexion
+from rest_models.backend.deadline import DeadlineExceeded, DeadlineMiddleware, deadline, get_remaining, shrink_timeout
+from rest_models.backend.exceptions import FakeDatabaseDbAPI2
+from rest_models.backend.middlewares import ApiMiddleware, FakeApiResponse
+from rest_models.backend.rate_limit import RateLimiter
+from rest_models.tests.tests_connexion import UnreachableApiMiddleware
+
+
+class TimeoutRecorderMiddleware(ApiMiddleware):
+    """
+    a middleware that record the timeout of each query
+    """
+
+    def __init__(self):
+        self.timeouts = []
+
+    def process_request(self, params, requestid, connection):
+        self.timeouts.append(params['timeout'])
+        return FakeApiResponse({}, 200)
+
+
+class TestDeadline(TestCase):
+
+    def test_nested(self):
+        self.assertIsNone(get_remaining())
+        with deadline(1):
+            self.assertTrue(0.9 < get_remaining() <= 1)
+            with deadline(10):
+                # a nested deadline can't extend the budget
+                self.assertTrue(get_remaining() <= 1)
+            with deadline(0.5):
+                self.assertTrue(get_remaining() <= 0.5)
+            self.assertTrue(0.5 < get_remaining() <= 1)
+        self.assertIsNone(get_remaining())
+
+    def test_shrink_timeout(self):
+        self.assertEqual(shrink_timeout(3), 3)
+        with deadline(1):
+            self.assertEqual(shrink_timeout(0.5), 0.5)
+            self.assertTrue(0.9 < shrink_timeout(3) <= 1)
+            self.assertTrue(0.9 < shrink_timeout(None) <= 1)
+            connect, read = shrink_timeout((0.5, 3))
+            self.assertEqual(connect, 0.5)
+            self.assertTrue(0.9 < read <= 1)
+        with deadline(0):
+            self.assertRaises(DeadlineExceeded, shrink_timeout, 3)
+
+
+class TestDeadlineQueries(TestCase):
+
+    def test_timeout_shrunk(self):
+        middleware = TimeoutRecorderMiddleware()
+        c = ApiConnexion('http://localapi/api/v2/', middlewares=[middleware], timeout=3)
+        c.get('')
+        with deadline(1):
+            c.get('')
+            c.get('', timeout=0.5)
+        self.assertEqual(middleware.timeouts[0], 3)
+        self.assertTrue(0.9 < middleware.timeouts[1] <= 1)
+        self.assertEqual(middleware.timeouts[2], 0.5)
+
+    def test_fail_fast(self):
+        middleware = TimeoutRecorderMiddleware()
+        c = ApiConnexion('http://localapi/api/v2/', middlewares=[middleware])
+        with deadline(0):
+            self.assertRaises(DeadlineExceeded, c.get, '')
+        self.assertEqual(middleware.timeouts, [])
+        # the deadline is an OperationalError, as the other failures to reach the api
+        self.assertTrue(issubclass(DeadlineExceeded, FakeDatabaseDbAPI2.OperationalError))
+
+    def test_no_retry_after_deadline(self):
+        middleware = UnreachableApiMiddleware(10)
+        c = ApiConnexion('http://localapi/api/v2/', middlewares=[middleware], retry=3, retry_backoff=0.5,
+                         retry_jitter=False)
+        start = time.monotonic()
+        with deadline(0.2):
+            self.assertRaises(DeadlineExceeded, c.get, '')
+        # the retry would have waited 0.5s: it fails at once
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(len(middleware.calls), 1)
+
+    def test_rate_limiter_paused(self):
+        middleware = TimeoutRecorderMiddleware()
+        limiter = RateLimiter('test')
+        c = ApiConnexion('http://localapi/api/v2/', middlewares=[middleware], rate_limiter=limiter)
+        limiter.pause(2)
+        start = time.monotonic()
+        with deadline(0.2):
+            self.assertRaises(DeadlineExceeded, c.get, '')
+        # the pause of the limiter would have lasted 2s: it fails at once
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(middleware.timeouts, [])
+
+    @skipIf(async_connexion.httpx is None, 'httpx is not installed')
+    def test_rate_limiter_paused_async(self):
+        middleware = TimeoutRecorderMiddleware()
+        limiter = RateLimiter('test')
+        c = AsyncApiConnexion(ApiConnexion('http://localapi/api/v2/', middlewares=[middleware], rate_limiter=limiter))
+        limiter.pause(2)
+        start = time.monotonic()
+        with deadline(0.2):
+            self.assertRaises(DeadlineExceeded, asyncio.run, c.get(''))
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(middleware.timeouts, [])
+
+    def test_middleware(self):
+        remaining = []
+
+        def view(request):
+            remaining.append(get_remaining())
+
+        with override_settings(REST_API_DEADLINE=2):
+            DeadlineMiddleware(view)(RequestFactory().get('/'))
+        DeadlineMiddleware(view)(RequestFactory().get('/'))
+        self.assertTrue(1.9 < remaining[0] <= 2)
+        self.assertIsNone(remaining[1])
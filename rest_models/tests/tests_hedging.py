@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+
+from django.db import connections
+from django.test.testcases import TestCase
+
+from rest_models.backend.hedging import Hedger, get_hedger, hedging_stats, is_hedge
+from rest_models.backend.middlewares import ApiMiddleware
+from rest_models.test import RestModelTestCase
+from testapp import models as client_models
+
+
+class SlowApiMiddleware(ApiMiddleware):
+    """
+    a middleware that hold the first query until it is released
+    """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.finished = threading.Event()
+        self.calls = 0
+
+    def process_request(self, params, requestid, connection):
+        self.calls += 1
+        if self.calls == 1:
+            self.release.wait(5)
+            self.finished.set()
+
+
+class TestHedger(TestCase):
+    databases = ['default', 'api']
+
+    def get_hedger(self, budget=1.):
+        hedger = Hedger('test', percentile=90, min_delay=0.01, budget=budget, min_samples=10)
+        for _ in range(100):
+            hedger.observe(0.001)
+        return hedger
+
+    def test_delay(self):
+        hedger = Hedger('test', percentile=90, min_delay=0.01, min_samples=10)
+        for i in range(1, 10):
+            hedger.observe(i / 10.)
+        self.assertIsNone(hedger.get_delay())
+        hedger.observe(1.)
+        self.assertEqual(hedger.get_delay(), 1.)
+        hedger.reset()
+        for _ in range(10):
+            hedger.observe(0.001)
+        self.assertEqual(hedger.get_delay(), 0.01)
+
+    def test_fast_query(self):
+        hedger = self.get_hedger()
+        self.assertEqual(hedger.request(lambda: 'response', connections['api']), 'response')
+        self.assertEqual(hedger.stats(), {'requests': 1, 'hedged': 0, 'won': 0})
+
+    def test_hedge_won(self):
+        hedger = self.get_hedger()
+        release = threading.Event()
+
+        def request():
+            if is_hedge():
+                return 'hedge'
+            release.wait(5)
+            return 'first'
+
+        try:
+            self.assertEqual(hedger.request(request, connections['api']), 'hedge')
+        finally:
+            release.set()
+        self.assertEqual(hedger.stats(), {'requests': 1, 'hedged': 1, 'won': 1})
+
+    def test_hedge_failed(self):
+        hedger = self.get_hedger()
+
+        def request():
+            if is_hedge():
+                raise ValueError('bad')
+            time.sleep(0.05)
+            return 'first'
+
+        self.assertEqual(hedger.request(request, connections['api']), 'first')
+        self.assertEqual(hedger.stats(), {'requests': 1, 'hedged': 1, 'won': 0})
+
+    def test_budget(self):
+        hedger = self.get_hedger(budget=0.5)
+        results = [hedger.request(lambda: time.sleep(0.03) or 'slow', connections['api']) for _ in range(4)]
+        self.assertEqual(results, ['slow'] * 4)
+        self.assertEqual(hedger.stats()['requests'], 4)
+        self.assertEqual(hedger.stats()['hedged'], 2)
+
+
+class TestHedgedQueries(RestModelTestCase):
+    databases = ['default', 'api']
+    database_rest_fixtures = {'api': {
+        'pizza/1/': [
+            {'data': {'pizza': {'id': 1, 'name': 'supreme', 'price': 10., 'from_date': '2016-11-15',
+                                'to_date': '2016-11-20T08:46:02.016000', 'cost': 2., 'menu': None,
+                                'toppings': []}}},
+        ],
+    }}
+
+    def setUp(self):
+        super(TestHedgedQueries, self).setUp()
+        self.options = connections['api'].settings_dict['OPTIONS']
+        self.options['HEDGE_PERCENTILE'] = 90
+        connections['api'].__dict__.pop('hedger', None)
+        self.hedger = connections['api'].hedger
+        self.hedger.reset()
+        for _ in range(self.hedger.min_samples):
+            self.hedger.observe(0.001)
+        self.middleware = SlowApiMiddleware()
+        connections['api'].cursor().push_middleware(self.middleware, 1)
+
+    def tearDown(self):
+        self.middleware.release.set()
+        if self.middleware.calls:
+            self.middleware.finished.wait(5)
+        connections['api'].cursor().pop_middleware(self.middleware)
+        del self.options['HEDGE_PERCENTILE']
+        connections['api'].__dict__.pop('hedger', None)
+        super(TestHedgedQueries, self).tearDown()
+
+    def test_hedged_get(self):
+        self.assertEqual(client_models.Pizza.objects.get(pk=1).name, 'supreme')
+        self.assertEqual(self.middleware.calls, 2)
+        self.assertEqual(hedging_stats()['api'], {'requests': 1, 'hedged': 1, 'won': 1})
+        self.assertIs(get_hedger('api', 90), self.hedger)
+
+    def test_disabled(self):
+        del self.options['HEDGE_PERCENTILE']
+        connections['api'].__dict__.pop('hedger', None)
+        try:
+            self.assertIsNone(connections['api'].hedger)
+        finally:
+            self.options['HEDGE_PERCENTILE'] = 90
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.db import connections
+from django.test.testcases import TestCase
+
+from rest_models.backend.connexion import ApiConnexion
+from rest_models.backend.exceptions import FakeDatabaseDbAPI2
+from rest_models.backend.metrics import Histogram, MetricsMiddleware, get_metrics, metrics_registry, render_metrics
+from testapp.models import Pizza
+
+
+class TestHistogram(TestCase):
+
+    def test_observe(self):
+        histogram = Histogram(buckets=(0.1, 1.))
+        for value in (0.05, 0.1, 0.5, 2, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 2])
+        self.assertEqual(histogram.cumulative_counts(), [(0.1, 2), (1., 3), (float('inf'), 5)])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.sum, 5.65)
+
+
+class TestMetricsMiddleware(TestCase):
+    fixtures = ['data.json']
+    databases = ['default', 'api']
+
+    def setUp(self):
+        metrics_registry.reset()
+        self.middleware = MetricsMiddleware()
+        connections['api'].cursor().push_middleware(self.middleware, 1)
+
+    def tearDown(self):
+        connections['api'].cursor().pop_middleware(self.middleware)
+        metrics_registry.reset()
+
+    def get_serie(self, name, **labels):
+        for serie in get_metrics()[name]:
+            if all(serie[label] == value for label, value in labels.items()):
+                return serie
+        self.fail('no serie %s for %s in %s' % (name, labels, get_metrics()[name]))
+
+    def test_requests(self):
+        list(Pizza.objects.all())
+        Pizza.objects.get(pk=1)
+        self.assertRaises(Pizza.DoesNotExist, Pizza.objects.get, pk=9999)
+        serie = self.get_serie('requests', alias='api', resource='pizza', verb='GET', status='2xx')
+        self.assertEqual(serie['count'], 2)
+        self.assertGreater(serie['bytes'], 0)
+        self.assertEqual(serie['latency']['count'], 2)
+        self.assertEqual(serie['latency']['buckets'][-1], (float('inf'), 2))
+        self.assertEqual(self.get_serie('requests', resource='pizza', status='4xx')['count'], 1)
+        self.assertEqual(len(self.middleware.pending), 0)
+
+    def test_resource(self):
+        connexion = connections['api'].cursor()
+        for url, resource in (('pizza', 'pizza'), ('pizza/', 'pizza'), ('pizza/1/', 'pizza'),
+                              ('menulol/3/?a=b', 'menulol'), (connexion.url + 'topping/2/', 'topping')):
+            self.assertEqual(self.middleware.get_resource(url, connexion), resource)
+
+    def test_errors_and_retries(self):
+        c = ApiConnexion("http://127.0.0.1:7777", retry=2)
+        c.push_middleware(self.middleware)
+        self.assertRaises(FakeDatabaseDbAPI2.OperationalError, c.get, 'pizza/')
+        labels = dict(alias='http://127.0.0.1:7777/', resource='pizza', verb='GET')
+        self.assertEqual(self.get_serie('errors', exception='ConnectionError', **labels)['count'], 3)
+        self.assertEqual(self.get_serie('retries', **labels)['count'], 2)
+        self.assertEqual(self.get_serie('requests', status='error', **labels)['count'], 3)
+
+    def test_render(self):
+        list(Pizza.objects.all())
+        text = render_metrics()
+        labels = 'alias="api",resource="pizza",verb="GET",status="2xx"'
+        self.assertIn('# TYPE rest_models_requests_total counter\n', text)
+        self.assertIn('rest_models_requests_total{%s} 1\n' % labels, text)
+        self.assertIn('rest_models_request_duration_seconds_bucket{%s,le="+Inf"} 1\n' % labels, text)
+        self.assertIn('rest_models_request_duration_seconds_count{%s} 1\n' % labels, text)
+        self.assertIn('rest_models_response_bytes_total{%s} ' % labels, text)
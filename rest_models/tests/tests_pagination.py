@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import asyncio
+from unittest import skipIf
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.test.testcases import TestCase
+
+from rest_models.aio import alist
+from rest_models.backend import async_connexion
+from rest_models.test import RestModelTestCase, TrackRequestMiddleware
+from testapp import models as client_models
+
+
+def keyset_page(after, per_page=2, last=5, total_pages=None):
+    """
+    build the mocked response for the pizzas after the given pk
+    """
+    ids = range(after + 1, min(after + per_page, last) + 1)
+    remaining = last - after
+    return {
+        'pizzas': [{'id': i, 'name': 'pizza %d' % i} for i in ids],
+        'meta': {'page': 1, 'per_page': per_page, 'total_results': remaining,
+                 'total_pages': total_pages or -(-remaining // per_page)},
+    }
+
+
+def cursor_page(cursor, per_page=2, last=5):
+    """
+    build the mocked response for the pizzas after the given cursor (the pk of the last pizza)
+    """
+    ids = range(cursor + 1, min(cursor + per_page, last) + 1)
+    return {
+        'pizzas': [{'id': i, 'name': 'pizza %d' % i} for i in ids],
+        'meta': {'per_page': per_page, 'next': 'c%d' % ids[-1] if ids[-1] < last else None},
+    }
+
+
+class PaginationMixin(object):
+    pagination = None
+
+    def setUp(self):
+        super(PaginationMixin, self).setUp()
+        patcher = patch.object(client_models.Pizza.APIMeta, 'pagination', self.pagination, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.options = connections['api'].settings_dict['OPTIONS']
+
+    def tearDown(self):
+        for option in ('PREFETCH_PAGES', 'STREAM_RESPONSES'):
+            self.options.pop(option, None)
+        super(PaginationMixin, self).tearDown()
+
+
+class TestKeysetPagination(PaginationMixin, RestModelTestCase):
+    databases = ['default', 'api']
+    pagination = 'keyset'
+    database_rest_fixtures = {'api': {
+        'pizza': [
+            {'filter': {'params': {'filter{id.gt}': i}}, 'data': keyset_page(i)} for i in (2, 4)
+        ] + [
+            {'filter': {'params': {'filter{id.lt}': 4}}, 'data': {
+                'pizzas': [{'id': 3, 'name': 'pizza 3'}],
+                'meta': {'page': 1, 'per_page': 2, 'total_pages': 1, 'total_results': 1}}},
+            {'filter': {'params': {'sort[]': ['-id']}}, 'data': {
+                'pizzas': [{'id': 5, 'name': 'pizza 5'}, {'id': 4, 'name': 'pizza 4'}],
+                'meta': {'page': 1, 'per_page': 2, 'total_pages': 2, 'total_results': 3}}},
+            {'filter': {'params': {'sort[]': ['id']}}, 'data': keyset_page(0)},
+            {'filter': {'params': {'page': 2}}, 'data': {
+                'pizzas': [{'id': 3, 'name': 'pizza 3'}],
+                'meta': {'page': 2, 'per_page': 2, 'total_pages': 2, 'total_results': 3}}},
+            {'data': {
+                'pizzas': [{'id': 2, 'name': 'pizza 2'}, {'id': 1, 'name': 'pizza 1'}],
+                'meta': {'page': 1, 'per_page': 2, 'total_pages': 2, 'total_results': 3}}},
+        ]
+    }}
+
+    def assert_ids(self, queryset, expected):
+        with self.track_query('api') as tracker:
+            self.assertEqual(list(queryset.values_list('id', flat=True)), expected)
+        return [query['params']['params'] for query in tracker.queries.values()]
+
+    def test_iterate(self):
+        params = self.assert_ids(client_models.Pizza.objects.all(), [1, 2, 3, 4, 5])
+        self.assertEqual(len(params), 3)
+        self.assertEqual(params[0]['sort[]'], ['id'])
+        self.assertNotIn('page', params[1])
+        self.assertEqual(params[1]['filter{id.gt}'], 2)
+        self.assertEqual(params[2]['filter{id.gt}'], 4)
+
+    def test_iterator_prefetch(self):
+        self.options['PREFETCH_PAGES'] = 1
+        self.assertEqual([pizza.id for pizza in client_models.Pizza.objects.iterator(chunk_size=2)], [1, 2, 3, 4, 5])
+
+    def test_streamed(self):
+        # the keyset is read in the rows, which are not kept by the streamed pages
+        self.options['STREAM_RESPONSES'] = True
+        self.assert_ids(client_models.Pizza.objects.all(), [1, 2, 3, 4, 5])
+
+    def test_descending(self):
+        params = self.assert_ids(client_models.Pizza.objects.order_by('-pk'), [5, 4, 3])
+        self.assertEqual(params[1]['filter{id.lt}'], 4)
+
+    def test_other_order(self):
+        # the rows are not sorted by pk: the pages are fetched by number
+        params = self.assert_ids(client_models.Pizza.objects.order_by('-name'), [2, 1, 3])
+        self.assertEqual(params[1]['page'], 2)
+
+    @skipIf(async_connexion.httpx is None, 'httpx is not installed')
+    def test_async(self):
+        async_connection = connections['api'].get_async_connection()
+
+        async def run():
+            # the event loop don't see the same database wrapper than the test
+            connections['api'].async_connection = async_connection
+            return await alist(client_models.Pizza.objects.values_list('id', flat=True))
+
+        self.assertEqual(asyncio.run(run()), [1, 2, 3, 4, 5])
+
+
+class TestCursorPagination(PaginationMixin, RestModelTestCase):
+    databases = ['default', 'api']
+    pagination = 'cursor'
+    database_rest_fixtures = {'api': {
+        'pizza': [
+            {'filter': {'params': {'cursor': 'c%d' % i}}, 'data': cursor_page(i)} for i in (2, 4)
+        ] + [
+            {'filter': {'params': {'page': i, 'per_page': 2}}, 'data': keyset_page(2 * i - 2, total_pages=3)}
+            for i in (2, 3)
+        ] + [
+            {'filter': {'params': {'per_page': 2}}, 'data': keyset_page(0, total_pages=3)},
+            {'data': cursor_page(0)},
+        ]
+    }}
+
+    def test_iterate(self):
+        with self.track_query('api') as tracker:
+            self.assertEqual(list(client_models.Pizza.objects.values_list('id', flat=True)), [1, 2, 3, 4, 5])
+        params = [query['params']['params'] for query in tracker.queries.values()]
+        self.assertEqual([p.get('cursor') for p in params], [None, 'c2', 'c4'])
+
+    def test_streamed(self):
+        self.options['STREAM_RESPONSES'] = True
+        self.assertEqual(list(client_models.Pizza.objects.values_list('id', flat=True)), [1, 2, 3, 4, 5])
+
+    def test_sliced(self):
+        # the first page of the slice can't be given by a cursor: all the pages are fetched by their number
+        client_models.Pizza.APIMeta.max_per_page = 2
+        self.addCleanup(delattr, client_models.Pizza.APIMeta, 'max_per_page')
+        with self.track_query('api') as tracker:
+            self.assertEqual(list(client_models.Pizza.objects.values_list('id', flat=True)[1:5]), [2, 3, 4, 5])
+        params = [query['params']['params'] for query in tracker.queries.values()]
+        self.assertEqual([p.get('page') for p in params], [None, 2, 3])
+        self.assertEqual([p.get('cursor') for p in params], [None, None, None])
+
+    def test_bad_pagination(self):
+        client_models.Pizza.APIMeta.pagination = 'offset'
+        self.assertRaises(ImproperlyConfigured, list, client_models.Pizza.objects.all())
+
+
+class TestKeysetPaginationApi(PaginationMixin, TestCase):
+    """
+    the keyset pagination on the api of the tests, by pages of 10 rows
+    """
+    fixtures = ['data.json']
+    databases = ['default', 'api']
+    pagination = 'keyset'
+
+    def setUp(self):
+        super(TestKeysetPaginationApi, self).setUp()
+        client_models.Topping.APIMeta.pagination = 'keyset'
+        self.addCleanup(delattr, client_models.Topping.APIMeta, 'pagination')
+
+    def test_iterate(self):
+        for i in range(15):
+            client_models.Topping.objects.create(name='topping %d' % i, cost=i)
+        expected = list(client_models.Topping.objects.order_by('-pk').values_list('pk', flat=True))[::-1]
+        self.assertEqual(len(expected), 21)
+        tracker = TrackRequestMiddleware()
+        connections['api'].cursor().push_middleware(tracker, priority=6)
+        try:
+            self.assertEqual([topping.pk for topping in client_models.Topping.objects.iterator(chunk_size=10)],
+                             expected)
+        finally:
+            connections['api'].cursor().pop_middleware(tracker)
+        params = [query['params']['params'] for query in tracker.queries.values()]
+        self.assertEqual(len(params), 3)
+        self.assertEqual(params[1]['filter{id.gt}'], expected[9])
+        self.assertEqual(params[2]['filter{id.gt}'], expected[19])
+
+    def iterate_reversed(self, queryset):
+        """
+        iterate over the toppings of the queryset by pages of 10 rows, and return their pks and the params of the
+        queries made
+        """
+        for i in range(15):
+            client_models.Topping.objects.create(name='topping %d' % i, cost=i)
+        tracker = TrackRequestMiddleware()
+        connections['api'].cursor().push_middleware(tracker, priority=6)
+        try:
+            pks = [topping.pk for topping in queryset.iterator(chunk_size=10)]
+        finally:
+            connections['api'].cursor().pop_middleware(tracker)
+        return pks, [query['params']['params'] for query in tracker.queries.values()]
+
+    def test_reverse_ascending(self):
+        pks, params = self.iterate_reversed(client_models.Topping.objects.order_by('pk').reverse())
+        expected = sorted(client_models.Topping.objects.values_list('pk', flat=True), reverse=True)
+        self.assertEqual(pks, expected)
+        self.assertEqual(params[0]['sort[]'], ['-id'])
+        self.assertEqual(params[1]['filter{id.lt}'], expected[9])
+        self.assertNotIn('filter{id.gt}', params[1])
+
+    def test_reverse_descending(self):
+        pks, params = self.iterate_reversed(client_models.Topping.objects.order_by('-pk').reverse())
+        expected = sorted(client_models.Topping.objects.values_list('pk', flat=True))
+        self.assertEqual(pks, expected)
+        self.assertEqual(params[0]['sort[]'], ['id'])
+        self.assertEqual(params[1]['filter{id.gt}'], expected[9])
+        self.assertNotIn('filter{id.lt}', params[1])
+
+
+class TestChunkSize(TestCase):
+    """
+    the chunk_size of QuerySet.iterator() give the size of the pages
+    """
+    fixtures = ['data.json']
+    databases = ['default', 'api']
+
+    def get_params(self, queryset):
+        tracker = TrackRequestMiddleware()
+        connections['api'].cursor().push_middleware(tracker, priority=6)
+        try:
+            self.assertEqual(len(list(queryset)), 3)
+        finally:
+            connections['api'].cursor().pop_middleware(tracker)
+        return [query['params']['params'] for query in tracker.queries.values()]
+
+    def test_chunk_size(self):
+        params = self.get_params(client_models.Pizza.objects.iterator(chunk_size=2))
+        self.assertEqual([(p['per_page'], p.get('page')) for p in params], [(2, None), (2, 2)])
+
+    def test_no_chunk_size(self):
+        # the api choose the size of the pages
+        params = self.get_params(client_models.Pizza.objects.all())
+        self.assertEqual(len(params), 1)
+        self.assertNotIn('per_page', params[0])
+
+    def test_max_per_page(self):
+        with patch.object(client_models.Pizza.APIMeta, 'max_per_page', 1, create=True):
+            params = self.get_params(client_models.Pizza.objects.iterator(chunk_size=2))
+        self.assertEqual([p['per_page'] for p in params], [1, 1, 1])
+
+    def test_sliced(self):
+        # the slice is fetched by pages of at most chunk_size rows
+        params = self.get_params(client_models.Pizza.objects.order_by('pk')[0:3].iterator(chunk_size=2))
+        self.assertEqual([(p['per_page'], p.get('page')) for p in params], [(2, None), (2, 2)])
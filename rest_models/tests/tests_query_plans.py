@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.db import connections
+from django.db.models.query_utils import Q
+from django.db.utils import ConnectionHandler, NotSupportedError
+from django.test.testcases import TestCase
+
+from rest_models.backend.compiler import SQLCompiler
+from rest_models.backend.query_plans import QueryPlan, QueryPlanCache, query_plan_cache_stats
+from testapp.models import Pizza
+
+
+class TestQueryPlanCache(TestCase):
+
+    def test_lru(self):
+        cache = QueryPlanCache('test', maxsize=2)
+        plans = [QueryPlan([], {}, {}) for _ in range(3)]
+        cache.put('a', plans[0])
+        cache.put('b', plans[1])
+        self.assertIs(cache.get('a'), plans[0])
+        cache.put('c', plans[2])
+        # b was the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertIs(cache.get('a'), plans[0])
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'size': 2})
+
+    def test_database_options(self):
+        ch = ConnectionHandler({
+            'default': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://localapi/api/v2/',
+                'OPTIONS': {'QUERY_PLAN_CACHE': 10},
+            },
+            'disabled': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://localapi/api/v2/',
+                'OPTIONS': {'QUERY_PLAN_CACHE': 0},
+            },
+        })
+        self.assertEqual(ch['default'].query_plan_cache.maxsize, 10)
+        self.assertIsNone(ch['disabled'].query_plan_cache)
+        self.assertIn('default', query_plan_cache_stats())
+
+
+class TestQueryPlans(TestCase):
+    fixtures = ['data.json']
+    databases = ['default', 'api']
+
+    def setUp(self):
+        self.cache = connections['api'].query_plan_cache
+        self.cache.clear()
+
+    def build_params(self, queryset):
+        compiler = SQLCompiler(queryset.query, connections['api'], 'api')
+        compiler.setup_query()
+        return compiler.build_params()
+
+    def test_same_shape(self):
+        first = self.build_params(Pizza.objects.filter(name='a', cost__gt=1).order_by('-cost').values('name'))
+        second = self.build_params(Pizza.objects.filter(name='b', cost__gt=2).order_by('-cost').values('name'))
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+        self.assertEqual(first['filter{name}'], ['a'])
+        self.assertEqual(second['filter{name}'], ['b'])
+        self.assertEqual(second['filter{cost.gt}'], [2])
+        for key in ('include[]', 'exclude[]', 'sort[]'):
+            self.assertEqual(first[key], second[key])
+        # the params given are not shared with the plan
+        second['sort[]'].append('name')
+        self.assertEqual(self.build_params(Pizza.objects.filter(name='c', cost__gt=3).order_by('-cost').values(
+            'name'))['sort[]'], ['-cost'])
+
+    def test_other_shapes(self):
+        self.build_params(Pizza.objects.filter(name='a'))
+        self.build_params(Pizza.objects.filter(cost=1))
+        self.build_params(Pizza.objects.filter(name='a').order_by('cost'))
+        self.build_params(Pizza.objects.exclude(name='a'))
+        self.build_params(Pizza.objects.filter(name='a').values('cost'))
+        self.build_params(Pizza.objects.filter(menu__name='a'))
+        self.assertEqual(self.cache.stats(), {'hits': 0, 'misses': 6, 'size': 6})
+
+    def test_empty_result(self):
+        # the values of the filters are still checked once the plan is cached
+        self.assertEqual(list(Pizza.objects.filter(name='a').filter(name__in=['a', 'b'])), [])
+        with self.assertNumQueries(0, using='api'):
+            self.assertEqual(list(Pizza.objects.filter(name='a').filter(name__in=[])), [])
+
+    def test_or_not_cached(self):
+        compiler = SQLCompiler(Pizza.objects.filter(Q(name='a') | Q(name='b')).query, connections['api'], 'api')
+        self.assertRaises(NotSupportedError, compiler.setup_query)
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_queries(self):
+        with self.assertNumQueries(2, using='api'):
+            first = list(Pizza.objects.filter(pk__in=[1, 2]).order_by('pk').values_list('pk', flat=True))
+            second = list(Pizza.objects.filter(pk__in=[2, 3]).order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(first, [1, 2])
+        self.assertEqual(second, [2, 3])
+        self.assertEqual(self.cache.stats()['hits'], 1)
@@ -5,6 +5,7 @@ import datetime
 import json
 from datetime import timezone
 from unittest import skipIf
+from unittest.mock import patch
 
 from django.conf import settings
 from django.db import NotSupportedError, ProgrammingError, connections
@@ -585,12 +586,24 @@ class TestQueryGet(TestCase):
         self.assertEqual(res[0].id, 2)
 
     def test_limited_with_offset_bad_offset_for_perfs(self):
-        with self.assertNumQueries(2, using='api'):
+        # the page of 3 rows is fetched, and the first one dropped
+        with self.assertNumQueries(1, using='api'):
             res = list(client_models.Pizza.objects.all().order_by('id')[1:3])
         self.assertEqual(len(res), 2)
         self.assertEqual(res[0].id, 2)
         self.assertEqual(res[1].id, 3)
 
+    def test_offset_without_limit(self):
+        with self.assertNumQueries(1, using='api'):
+            res = list(client_models.Pizza.objects.all().order_by('id')[1:])
+        self.assertEqual([pizza.id for pizza in res], [2, 3])
+
+    def test_limited_with_max_per_page(self):
+        with patch.object(client_models.Pizza.APIMeta, 'max_per_page', 1, create=True):
+            with self.assertNumQueries(2, using='api'):
+                res = list(client_models.Pizza.objects.all().order_by('id')[1:3])
+        self.assertEqual([pizza.id for pizza in res], [2, 3])
+
     def test_limited_with_offset_good_offset_for_perfs(self):
         with self.assertNumQueries(1, using='api'):
             res = list(client_models.Pizza.objects.all().order_by('id')[2:4])
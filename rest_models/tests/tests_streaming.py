@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+from json import JSONDecodeError
+
+from django.db import connections
+from django.test.testcases import TestCase
+from requests.models import Response
+
+from rest_models.backend.streaming import JsonStream, StreamedPage
+from rest_models.test import RestModelTestCase
+from rest_models.tests.tests_compilers import pizza_page
+from testapi import models as api_models
+from testapp.models import Pizza, Topping
+
+
+def chunked(data, size):
+    """
+    cut the json document into chunks of bytes of the given size
+    """
+    raw = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+class StreamedResponse(Response):
+    """
+    a response whose body is read by chunks, which record how many chunks were read
+    """
+
+    def __init__(self, data, chunk_size=7):
+        super(StreamedResponse, self).__init__()
+        self.status_code = 200
+        self.chunks = chunked(data, chunk_size)
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class TestJsonStream(TestCase):
+    data = {
+        'toppings': [{'id': 1, 'name': 'crème fraîche'}, {'id': 2, 'name': '日本'}],
+        'pizzas': [{'id': i, 'price': i * 1.5, 'ok': i % 2 == 0, 'menu': None} for i in range(20)],
+        'meta': {'page': 1, 'total_pages': 12345678},
+        'empty': [],
+    }
+
+    def test_values_all_chunk_sizes(self):
+        for size in (1, 2, 3, 5, 64, 100000):
+            stream = JsonStream(chunked(self.data, size))
+            result = {}
+            for key in stream.iter_keys():
+                if key == 'pizzas':
+                    result[key] = list(stream.iter_array())
+                else:
+                    result[key] = stream.value()
+            self.assertEqual(result, self.data, 'chunk size %d' % size)
+
+    def test_skip(self):
+        stream = JsonStream(chunked(self.data, 3))
+        keys = []
+        for key in stream.iter_keys():
+            keys.append(key)
+            stream.skip()
+        self.assertEqual(keys, ['toppings', 'pizzas', 'meta', 'empty'])
+
+    def test_invalid(self):
+        stream = JsonStream([b'{"pizzas": [{"id": 1}, {"id": '])
+        keys = stream.iter_keys()
+        self.assertEqual(next(keys), 'pizzas')
+        items = stream.iter_array()
+        self.assertEqual(next(items), {'id': 1})
+        self.assertRaises(JSONDecodeError, next, items)
+        self.assertRaises(JSONDecodeError, next, JsonStream([b'[1, 2]']).iter_keys())
+
+
+class TestStreamedPage(TestCase):
+
+    def test_rows_before_end(self):
+        response = StreamedResponse({
+            'toppings': [{'id': 1}],
+            'pizzas': [{'id': i, 'toppings': [1]} for i in range(50)],
+            'meta': {'page': 1},
+        })
+        page = StreamedPage(response, 'pizzas', required={'toppings'}, wanted={'meta'}, chunk_size=7)
+        rows = page.rows()
+        self.assertEqual(next(rows), {'id': 0, 'toppings': [1]})
+        self.assertEqual(page.data, {'toppings': [{'id': 1}]})
+        # the first row is given before the whole body is read
+        self.assertLess(response.read, len(response.chunks) / 2)
+        self.assertEqual(len(list(rows)), 49)
+        self.assertEqual(page.data, {'toppings': [{'id': 1}], 'meta': {'page': 1}})
+        self.assertTrue(response.closed)
+
+    def test_required_after_rows(self):
+        response = StreamedResponse({
+            'pizzas': [{'id': 1, 'menu': 1}, {'id': 2, 'menu': 1}],
+            'menus': [{'id': 1}],
+        })
+        page = StreamedPage(response, 'pizzas', required={'menus'})
+        rows = page.rows()
+        self.assertEqual(next(rows), {'id': 1, 'menu': 1})
+        # the rows waited for the menus
+        self.assertEqual(response.read, len(response.chunks))
+        self.assertEqual(page.data['menus'], [{'id': 1}])
+
+    def test_skip_unwanted(self):
+        response = StreamedResponse({
+            'toppings': [{'id': 1}],
+            'menus': [{'id': 1}],
+            'pizzas': [{'id': 1}],
+        })
+        page = StreamedPage(response, 'pizzas', required={'menus'})
+        self.assertEqual(list(page.rows()), [{'id': 1}])
+        self.assertEqual(page.data, {'menus': [{'id': 1}]})
+
+    def test_missing_rows(self):
+        page = StreamedPage(StreamedResponse({'menus': []}), 'pizzas')
+        self.assertRaises(KeyError, list, page.rows())
+
+
+class TestStreamResponses(TestCase):
+    fixtures = ['data.json']
+    databases = ['default', 'api']
+
+    def setUp(self):
+        connections['api'].settings_dict['OPTIONS']['STREAM_RESPONSES'] = True
+
+    def tearDown(self):
+        del connections['api'].settings_dict['OPTIONS']['STREAM_RESPONSES']
+
+    def assertSameResults(self, get_queryset, num_queries=1):
+        with self.assertNumQueries(num_queries, using='api'):
+            streamed = list(get_queryset())
+        del connections['api'].settings_dict['OPTIONS']['STREAM_RESPONSES']
+        try:
+            expected = list(get_queryset())
+        finally:
+            connections['api'].settings_dict['OPTIONS']['STREAM_RESPONSES'] = True
+        self.assertEqual(streamed, expected)
+        self.assertTrue(streamed)
+        return streamed
+
+    def test_all(self):
+        res = self.assertSameResults(lambda: Pizza.objects.all())
+        self.assertEqual(res[0].name, 'suprème')
+
+    def test_values_list(self):
+        self.assertSameResults(lambda: Pizza.objects.values_list('id', 'name', 'price'))
+
+    def test_select_related(self):
+        self.assertSameResults(lambda: Pizza.objects.values_list('name', 'menu__name'))
+
+    def test_m2m(self):
+        self.assertSameResults(lambda: Pizza.objects.values_list('name', 'toppings__name'))
+
+    def test_reverse(self):
+        self.assertSameResults(lambda: Topping.objects.values_list('name', 'pizzas__name', 'pizzas__menu__name'))
+
+    def test_pages(self):
+        api_models.Topping.objects.bulk_create([
+            api_models.Topping(name='topping %d' % i, cost=1) for i in range(15)
+        ])
+        res = self.assertSameResults(lambda: Topping.objects.values_list('id', 'name'), 3)
+        self.assertEqual(len(res), 21)
+
+    def test_single_not_streamed(self):
+        self.assertEqual(Pizza.objects.get(pk=1).name, 'suprème')
+        self.assertEqual(Pizza.objects.order_by('id').first().pk, 1)
+
+    def test_empty(self):
+        self.assertEqual(list(Pizza.objects.filter(name='nothing')), [])
+
+
+class TestStreamMockedResponses(RestModelTestCase):
+    databases = ['default', 'api']
+    database_rest_fixtures = {'api': {
+        'pizza': [
+            {'filter': {'params': {'page': i}}, 'data': pizza_page(i)} for i in range(2, 6)
+        ] + [
+            {'data': pizza_page(1)}
+        ]
+    }}
+
+    def setUp(self):
+        super(TestStreamMockedResponses, self).setUp()
+        connections['api'].settings_dict['OPTIONS']['STREAM_RESPONSES'] = True
+
+    def tearDown(self):
+        del connections['api'].settings_dict['OPTIONS']['STREAM_RESPONSES']
+        super(TestStreamMockedResponses, self).tearDown()
+
+    def test_mocked_pages(self):
+        with self.assertNumQueries(5, using='api'):
+            self.assertEqual(list(Pizza.objects.values_list('id', flat=True)), list(range(1, 11)))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+import itertools
+import logging
+
+from django.db import connections
+from django.db.models.sql.constants import MULTI
+from django.test.client import RequestFactory
+from django.test.testcases import LiveServerTestCase, TestCase
+
+from rest_models.backend.connexion import ApiConnexion
+from rest_models.backend.timings import (PHASES, QueryTimings, TimingsCollector, TimingsMiddleware, collect_timings,
+                                         get_collector, measure_phase, measure_query)
+from rest_models.test import RestModelTestCase
+from rest_models.tests.tests_compilers import pizza_page
+from testapp.models import Pizza
+
+
+class TestQueryTimings(TestCase):
+
+    def test_add(self):
+        timings = QueryTimings('get', 'pizza/')
+        timings.add('decode', 0.5)
+        timings.add('decode', 0.25)
+        timings.add('ttfb', 1)
+        self.assertEqual(timings.total, 1.75)
+        self.assertEqual(timings.as_dict(), {'method': 'get', 'url': 'pizza/', 'decode': 0.75, 'ttfb': 1})
+
+    def test_collector(self):
+        collector = TimingsCollector()
+        for i in range(3):
+            timings = QueryTimings('get', 'pizza/')
+            timings.add('ttfb', i)
+            collector.record(timings)
+        totals = collector.totals()
+        self.assertEqual(set(totals), set(PHASES))
+        self.assertEqual(totals['ttfb'], 3)
+        self.assertEqual(totals['decode'], 0)
+        self.assertEqual(len(collector.as_list()), 3)
+
+    def test_measure(self):
+        with measure_phase('ttfb'):
+            pass  # no query: nothing is measured
+        self.assertIsNone(get_collector())
+        with collect_timings() as collector:
+            self.assertIs(get_collector(), collector)
+            with measure_query('get', 'pizza/') as timings:
+                with measure_phase('ttfb'):
+                    pass
+        self.assertIsNone(get_collector())
+        self.assertEqual(collector.queries, [timings])
+        self.assertIn('ttfb', timings.phases)
+
+    def test_log_totals(self):
+        with self.assertLogs('rest_models.backend.timings', logging.DEBUG) as logs:
+            with collect_timings():
+                with measure_query('get', 'pizza/') as timings:
+                    timings.add('ttfb', 0.1)
+        self.assertIn('1 api queries: middlewares=0.000, connect=0.000, ttfb=0.100', logs.output[0])
+        self.assertEqual(logs.records[0].api_timings, [{'method': 'get', 'url': 'pizza/', 'ttfb': 0.1}])
+
+
+class TestTimingsLocalApi(TestCase):
+    fixtures = ['data.json']
+    databases = ['default', 'api']
+
+    def test_query_timings(self):
+        with collect_timings() as collector:
+            pizzas = list(Pizza.objects.values_list('name', 'toppings__name'))
+        self.assertTrue(pizzas)
+        self.assertEqual(len(collector.queries), 1)
+        timings = collector.queries[0]
+        self.assertEqual(timings.method, 'get')
+        self.assertTrue(timings.url.endswith('/pizza'))
+        self.assertEqual(set(timings.phases), {'middlewares', 'ttfb', 'download', 'decode', 'hydration'})
+        self.assertGreater(timings.phases['hydration'], 0)
+
+    def test_not_collected(self):
+        response = connections['api'].cursor().get('pizza/')
+        self.assertEqual(set(response.timings.phases), {'middlewares', 'ttfb', 'download'})
+        list(Pizza.objects.all())
+        self.assertIsNone(get_collector())
+
+    def test_logger_extra(self):
+        connection = connections['api']
+        connection.force_debug_cursor = True
+        try:
+            with self.assertLogs('django.db.backends', logging.DEBUG) as logs:
+                connection.cursor().get('pizza/')
+        finally:
+            connection.force_debug_cursor = False
+        self.assertEqual(set(logs.records[0].timings), {'middlewares', 'ttfb', 'download'})
+
+    def test_middleware(self):
+        def view(request):
+            self.assertIs(get_collector(), request.api_timings)
+            return list(Pizza.objects.all())
+
+        request = RequestFactory().get('/')
+        TimingsMiddleware(view)(request)
+        self.assertEqual(len(request.api_timings.queries), 1)
+        self.assertIsNone(get_collector())
+
+
+class TestTimingsThreads(RestModelTestCase):
+    databases = ['default', 'api']
+    database_rest_fixtures = {'api': {
+        'pizza': [
+            {'filter': {'params': {'page': i}}, 'data': pizza_page(i)} for i in range(2, 6)
+        ] + [
+            {'data': pizza_page(1)}
+        ]
+    }}
+
+    def tearDown(self):
+        connections['api'].settings_dict['OPTIONS'].pop('PARALLEL_PAGES', None)
+        connections['api'].settings_dict['OPTIONS'].pop('PREFETCH_PAGES', None)
+        super(TestTimingsThreads, self).tearDown()
+
+    def assertPagesCollected(self):
+        with collect_timings() as collector:
+            self.assertEqual(list(Pizza.objects.values_list('id', flat=True)), list(range(1, 11)))
+        self.assertEqual(len(collector.queries), 5)
+        for timings in collector.queries:
+            self.assertIn('middlewares', timings.phases)
+            self.assertIn('decode', timings.phases)
+            self.assertIn('hydration', timings.phases)
+
+    def test_serial_pages(self):
+        self.assertPagesCollected()
+
+    def test_parallel_pages(self):
+        connections['api'].settings_dict['OPTIONS']['PARALLEL_PAGES'] = 3
+        self.assertPagesCollected()
+
+    def test_prefetch_pages(self):
+        connections['api'].settings_dict['OPTIONS']['PREFETCH_PAGES'] = 2
+        self.assertPagesCollected()
+
+    def test_page_timings_released(self):
+        # the timings of the pages are forgotten once read, or once the iteration is stopped
+        for stop in (None, 3):
+            compiler = Pizza.objects.values_list('id', flat=True).query.get_compiler(using='api')
+            with collect_timings() as collector:
+                rows = compiler.execute_sql(MULTI)
+                self.assertEqual([row[0][0] for row in itertools.islice(rows, stop)], list(range(1, 11))[:stop])
+                self.assertLessEqual(len(compiler.page_timings), 1)
+                rows.close()
+            self.assertEqual(compiler.page_timings, {})
+            self.assertIn('hydration', collector.queries[0].phases)
+
+
+class TestTimingsHttp(LiveServerTestCase):
+    fixtures = ['data.json']
+
+    def test_connect(self):
+        client = ApiConnexion(self.live_server_url + "/api/v2/", auth=None)
+        with collect_timings() as collector:
+            client.get('pizza/1/')
+            client.get('pizza/1/')
+        first, second = collector.queries
+        self.assertEqual(set(first.phases), {'middlewares', 'connect', 'ttfb', 'download'})
+        self.assertGreater(first.phases['connect'], 0)
+        self.assertGreater(first.phases['ttfb'], 0)
+        # the connection is taken from the pool but not opened again
+        self.assertIn('connect', second.phases)
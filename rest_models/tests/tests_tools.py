@@ -5,11 +5,12 @@ import datetime
 import time
 import unittest
 
+from django.core.exceptions import FieldDoesNotExist
 from django.db import NotSupportedError, OperationalError
 from django.test import TestCase
 
-from rest_models.backend.compiler import (ApiResponseReader, QueryParser, SQLCompiler, build_aliases_tree,
-                                          join_aliases, join_results, resolve_tree)
+from rest_models.backend.compiler import (ApiResponseReader, QueryParser, SQLCompiler, build_aliases_tree, convert_row,
+                                          get_column_converters, join_aliases, join_results, resolve_tree)
 from rest_models.storage import ExpirableDict
 from testapi import models as api_models
 from testapp import models as client_models
@@ -216,6 +217,49 @@ class TestJoinGenerator(TestCase):
         }
         self.assertRaisesMessage(NotSupportedError, "the result from the api ", list, join_results(row, resolved))
 
+    def test_row_materializer(self):
+        reader = ApiResponseReader(self.json_data)
+        rows = []
+        for queryset, pk in (
+                (client_models.Menu.objects.values('code', 'pizzas__toppings__name'), 2),
+                (client_models.Pizza.objects.values('id', 'menu__code', 'toppings__name'), 3),
+                (client_models.Pizza.objects.values('menu__name', 'menu__code'), 1),
+        ):
+            compiler = SQLCompiler(queryset.query, None, 'api')
+            compiler.setup_query()
+            item = reader[queryset.model][pk]
+            # the rows are the same as the ones given by the recursive join of the aliases
+            resolved = compiler.get_resolved_columns()
+            tree = build_aliases_tree({alias for alias, _ in resolved})
+            expected = [
+                result
+                for row in join_aliases(list(resolve_tree(tree)), reader, {tree.alias: item})
+                for result in join_results(row, resolved)
+            ]
+            rows.append(compiler.response_to_table(reader, item))
+            self.assertEqual(rows[-1], expected)
+        self.assertEqual(
+            rows[0],
+            [['cde', 'crème'], ['cde', 'lardon'], ['cde', 'crème'], ['cde', 'lardon'], ['cde', 'foie gras']]
+        )
+
+    def test_column_converters(self):
+        aliases = QueryParser(client_models.Topping.objects.values('cost', 'pizzas__menu__name').query).aliases
+        topping, pizza = aliases['testapp_topping'], aliases['testapp_pizza']
+        columns = get_column_converters([(topping, 'taxed_cost'), (topping, 'pizzas'), (pizza, 'unknown')])
+        self.assertEqual([(alias, db_column) for alias, db_column, _ in columns],
+                         [(topping, 'taxed_cost'), (topping, 'pizzas'), (pizza, 'unknown')])
+        self.assertEqual(columns[0][2], client_models.Topping._meta.get_field('cost').to_python)
+        self.assertIsNone(columns[1][2])
+        row = {
+            topping: {'taxed_cost': '1.5', 'pizzas': [1, 2]},
+            pizza: {},
+        }
+        self.assertEqual(convert_row(row, columns), [[1.5, 1, None], [1.5, 2, None]])
+        # the column which is not a field fail only if the api give a value for it
+        row[pizza] = {'unknown': 1}
+        self.assertRaises(FieldDoesNotExist, convert_row, row, columns)
+
 
 class TestExpirableDict(unittest.TestCase):
     def test_get_set(self):
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, print_function, unicode_literals
+
+from django.db import connections
+from django.db.utils import ConnectionHandler
+from django.test.testcases import TestCase
+
+from rest_models.backend.exceptions import FakeDatabaseDbAPI2
+from rest_models.backend.tracing import InMemorySpanExporter, Span, get_span_exporter
+from rest_models.test import RestModelTestCase
+from rest_models.tests.tests_compilers import pizza_page
+from testapp import models as client_models
+
+EXPORTER = 'rest_models.backend.tracing.InMemorySpanExporter'
+
+
+class TracingMixin(object):
+
+    def setUp(self):
+        super(TracingMixin, self).setUp()
+        self.options = connections['api'].settings_dict['OPTIONS']
+        self.options['TRACING_EXPORTER'] = EXPORTER
+        connections['api'].__dict__.pop('tracer', None)
+        self.exporter = get_span_exporter(EXPORTER)
+        self.exporter.clear()
+
+    def tearDown(self):
+        del self.options['TRACING_EXPORTER']
+        connections['api'].__dict__.pop('tracer', None)
+        super(TracingMixin, self).tearDown()
+
+    def get_spans(self, name):
+        return [span for span in self.exporter.get_finished_spans() if span.name == name]
+
+
+class TestSpan(TestCase):
+
+    def test_span(self):
+        parent = Span('parent')
+        child = Span('child', parent, {'a': 1})
+        self.assertEqual(child.trace_id, parent.trace_id)
+        self.assertEqual(child.parent_id, parent.span_id)
+        self.assertIsNone(parent.parent_id)
+        self.assertIsNone(child.duration)
+        child.increment('a')
+        child.increment('b', 2)
+        child.finish(ValueError('bad'))
+        self.assertGreaterEqual(child.duration, 0)
+        self.assertEqual(child.as_dict()['attributes'], {'a': 2, 'b': 2, 'error': 'ValueError: bad'})
+
+    def test_exporter_shared(self):
+        self.assertIsInstance(get_span_exporter(EXPORTER), InMemorySpanExporter)
+        self.assertIs(get_span_exporter(EXPORTER), get_span_exporter(EXPORTER))
+
+
+class TestTracing(TracingMixin, TestCase):
+    fixtures = ['data.json']
+    databases = ['default', 'api']
+
+    def test_select(self):
+        pizzas = list(client_models.Pizza.objects.all())
+        self.assertTrue(pizzas)
+        query, = self.get_spans('rest_models.select')
+        request, = self.get_spans('rest_models.request')
+        self.assertEqual(query.attributes, {'model': 'testapp.Pizza', 'alias': 'api', 'requests': 1, 'pages': 1})
+        self.assertIs(request.parent, query)
+        self.assertEqual(request.attributes['method'], 'GET')
+        self.assertEqual(request.attributes['status'], 200)
+        self.assertEqual(request.attributes['retries'], 0)
+        self.assertGreater(request.attributes['params_size'], 0)
+        self.assertLessEqual(query.start, request.start)
+        self.assertGreaterEqual(query.end, request.end)
+
+    def test_interrupted_iteration(self):
+        for pizza in client_models.Pizza.objects.iterator(chunk_size=1):
+            break
+        query, = self.get_spans('rest_models.select')
+        self.assertNotIn('error', query.attributes)
+
+    def test_write_queries(self):
+        topping = client_models.Topping.objects.create(name='lardons', cost=2)
+        client_models.Topping.objects.filter(pk=topping.pk).update(cost=3)
+        client_models.Topping.objects.filter(pk=topping.pk).delete()
+        insert, = self.get_spans('rest_models.insert')
+        self.assertEqual(insert.attributes['model'], 'testapp.Topping')
+        self.assertEqual(insert.attributes['requests'], 1)
+        self.assertEqual(len(self.get_spans('rest_models.update')), 1)
+        # the relations of the topping are deleted too
+        self.assertIn('testapp.Topping', [span.attributes['model'] for span in self.get_spans('rest_models.delete')])
+        for span in self.get_spans('rest_models.request'):
+            self.assertIsNotNone(span.parent)
+
+    def test_disabled(self):
+        del self.options['TRACING_EXPORTER']
+        connections['api'].__dict__.pop('tracer', None)
+        try:
+            self.assertIsNone(connections['api'].tracer)
+            list(client_models.Pizza.objects.all())
+            self.assertEqual(self.exporter.get_finished_spans(), [])
+        finally:
+            self.options['TRACING_EXPORTER'] = EXPORTER
+
+    def test_retries(self):
+        ch = ConnectionHandler({
+            'default': {
+                'ENGINE': 'rest_models.backend',
+                'NAME': 'http://127.0.0.1:7777/',
+                'OPTIONS': {'TRACING_EXPORTER': EXPORTER},
+            },
+        })
+        connexion = ch['default'].cursor()
+        connexion.retry = 2
+        self.assertRaises(FakeDatabaseDbAPI2.OperationalError, connexion.get, 'pizza/')
+        request, = self.get_spans('rest_models.request')
+        self.assertIsNone(request.parent)
+        self.assertEqual(request.attributes['retries'], 2)
+        self.assertIn('OperationalError', request.attributes['error'])
+
+
+class TestTracingPages(TracingMixin, RestModelTestCase):
+    databases = ['default', 'api']
+    database_rest_fixtures = {'api': {
+        'pizza': [
+            {'filter': {'params': {'page': i}}, 'data': pizza_page(i)} for i in range(2, 6)
+        ] + [
+            {'data': pizza_page(1)}
+        ]
+    }}
+
+    def tearDown(self):
+        self.options.pop('PARALLEL_PAGES', None)
+        super(TestTracingPages, self).tearDown()
+
+    def test_parallel_pages(self):
+        self.options['PARALLEL_PAGES'] = 3
+        self.assertEqual(list(client_models.Pizza.objects.values_list('id', flat=True)), list(range(1, 11)))
+        query, = self.get_spans('rest_models.select')
+        self.assertEqual(query.attributes['requests'], 5)
+        self.assertEqual(query.attributes['pages'], 5)
+        requests = self.get_spans('rest_models.request')
+        self.assertEqual(len(requests), 5)
+        for request in requests:
+            self.assertIs(request.parent, query)
@@ -1,5 +1,5 @@
 import json
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from pathlib import Path
 
 from django.contrib.auth.hashers import BasePasswordHasher
@@ -211,6 +211,84 @@ def pgcd(a, b):
     return b
 
 
+SlicePlan = namedtuple('SlicePlan', ['per_page', 'first_page', 'last_page', 'skip'])
+"""
+the pages to fetch for a slice of results: the pages first_page to last_page (included) of per_page rows, without
+the skip first rows. last_page is None if the slice has no end, and per_page too if the size of the pages is
+not limited.
+"""
+
+REQUEST_COST = 20
+"""
+the cost of a query to the api, in rows: a slice plan can fetch up to 20 rows more to save a query
+"""
+
+
+def plan_slice(low_mark, high_mark, max_per_page=None, max_requests=4):
+    """
+    find the pages to fetch for the rows from low_mark to high_mark, which cost the less queries and the less rows
+    fetched for nothing. the rows out of the slice are dropped once received.
+
+    :param int low_mark: the start offset
+    :param int|None high_mark: the end offset, or None for all the rows after low_mark
+    :param int max_per_page: the max number of rows by page accepted by the api
+    :param int max_requests: the max number of queries of the plans compared
+    :rtype: SlicePlan
+
+    >>> plan_slice(0, 10)
+    SlicePlan(per_page=10, first_page=1, last_page=1, skip=0)
+
+    >>> plan_slice(30, 40)
+    SlicePlan(per_page=10, first_page=4, last_page=4, skip=0)
+
+    >>> plan_slice(7, 13)
+    SlicePlan(per_page=7, first_page=2, last_page=2, skip=0)
+
+    >>> plan_slice(1, 3)
+    SlicePlan(per_page=3, first_page=1, last_page=1, skip=1)
+
+    >>> plan_slice(100, 300, max_per_page=100)
+    SlicePlan(per_page=100, first_page=2, last_page=3, skip=0)
+
+    >>> plan_slice(5, None)
+    SlicePlan(per_page=None, first_page=1, last_page=None, skip=5)
+
+    >>> plan_slice(5, None, max_per_page=100)
+    SlicePlan(per_page=100, first_page=1, last_page=None, skip=5)
+
+    """
+    if high_mark is None:
+        return SlicePlan(max_per_page, 1, None, low_mark)
+    count = max(1, high_mark - low_mark)
+    max_per_page = min(max_per_page or high_mark, high_mark)
+    best = None
+    for requests in range(1, max_requests + 1):
+        start = -(-count // requests)  # ceil
+        # with pages of count / (requests - 1) rows, the slice always fit in the given number of queries
+        stop = max_per_page if requests == 1 else min(max_per_page, -(-count // (requests - 1)))
+        # the search is bounded, the big slices are fetched with the fallback
+        for per_page in range(start, min(stop, start + 1000) + 1):
+            first = low_mark // per_page
+            last = (high_mark - 1) // per_page
+            fetched = (last - first + 1) * per_page
+            cost = (last - first + 1) * REQUEST_COST + fetched - count
+            if best is None or cost < best[0]:
+                best = (cost, per_page, first, last)
+            if best[0] <= requests * REQUEST_COST:
+                # no other page size with this number of queries can do better
+                break
+        if best is not None and best[0] <= (requests + 1) * REQUEST_COST:
+            # the plans with more queries cost at least their queries: none can do better
+            break
+    if best is None:
+        # the slice need more than max_requests pages of max_per_page rows
+        per_page = max_per_page
+        first, last = low_mark // per_page, (high_mark - 1) // per_page
+    else:
+        cost, per_page, first, last = best
+    return SlicePlan(per_page, first + 1, last + 1, low_mark - first * per_page)
+
+
 class NullPasswordHasher(BasePasswordHasher):
     """
     A non hashing password algorithm (only for tests)